@@ -1,34 +1,60 @@
 import re
+import sys
+import heapq
+from cpureg.regfile import CpuRegRegFile
+from cpureg.isa_db import CpuRegIsaDb
 
 # ================================
-# Multi-ISA RAW-Only Scheduler
+# Multi-ISA List Scheduler
 # ================================
+# opcodes are decoded by CpuRegIsaDb (BEQ is B, ADDS is ADD setting the flags, LDR.W is LDR),
+# a line it does not know (PUSH, IT, directives, ...) is kept where it is as a barrier.
+# a thumb-2 IT block (IT and the 1-4 instructions it makes conditional) is barriers only, so it stays one fixed sequence
+# (nothing is moved into its shadow, nothing in it moves out).
+# a block ends at every branch, conditional ones (BEQ, CBZ, rh850 BNE, ...) included.
+# per basic block, a dependency dag is built once (one pass, last writer / readers per register):
+#   RAW (read after write), WAR (write after read), WAW (write after write) on registers and flags
+#   (CMP / TST and the S suffix set the flags, armv7m condition suffixes read them),
+#   memory: a store stays after every earlier load/store, a load stays after the last store,
+#   calls, system register accesses, writes to pc and unknown lines are barriers (nothing moves across them)
+# then list scheduling: every cycle the ready instruction with the longest latency path to the end of the
+# block is issued (priority heap, ties keep the original order), stalls only if nothing is ready.
 
 # Regular expressions for parsing
-REGEX_REGISTER = re.compile(r"[A-Za-z]{1,2}\d+")    # R1, X2, etc.
 REGEX_SPLIT    = re.compile(r"[ ,()]+")             # splits opcode and operands
-REGEX_LABEL    = re.compile(r"^\w+:$")              # label lines
-
-# ISA configuration (ARMv7-M only for now)
-ISA_DB = {
-    'armv7m': {
-        'instrs': {
-            'MOV': {'read': [1], 'write': [0]},
-            'ADD': {'read': [1,2], 'write': [0]},
-            'SUB': {'read': [1,2], 'write': [0]},
-            'MUL': {'read': [1,2], 'write': [0]},
-            'LDR': {'read': [1], 'write': [0]},
-            'STR': {'read': [0,1], 'write': []},
-            'B':   {'read': [], 'write': []}
-        }
-    }
-}
+REGEX_LABEL    = re.compile(r"^[\w.$]+:$")          # label lines (.L2: too)
+REGEX_IT       = re.compile(r"^IT[TE]{0,3}$")        # IT, ITE, ITTE, ... (mnemonic)
+
+# ISA configuration (operand positions per opcode, shared with the clobber analysis)
+ISA_DB = CpuRegIsaDb.isa_db
+
+BRANCH_OPS = CpuRegIsaDb.branch_ops
 
-BRANCH_OPS = {'armv7m': {'B'}}
+# cycles until the result can be used (everything else: 1)
+LATENCY = {
+    'armv7m': {'LDR': 2, 'LDRB': 2, 'LDRH': 2, 'MUL': 2, 'MLA': 2},
+    'rh850': {'LD.B': 2, 'LD.BU': 2, 'LD.H': 2, 'LD.HU': 2, 'LD.W': 2, 'MUL': 2}
+}
+LOAD_OPS = {
+    'armv7m': {'LDR', 'LDRB', 'LDRH'},
+    'rh850': {'LD.B', 'LD.BU', 'LD.H', 'LD.HU', 'LD.W'}
+}
+STORE_OPS = {
+    'armv7m': {'STR', 'STRB', 'STRH'},
+    'rh850': {'ST.B', 'ST.H', 'ST.W'}
+}
+# set the condition flags (armv7m: only with the S suffix, besides these)
+FLAG_OPS = {
+    'armv7m': {'CMP', 'TST'},
+    'rh850': {'CMP', 'ADD', 'ADDI', 'SUB', 'SUBR', 'AND', 'ANDI', 'OR', 'ORI', 'XOR', 'XORI', 'SHL', 'SHR', 'SAR'}
+}
+BARRIER_OPS = {'armv7m': {'BL', 'BLX', 'MRS', 'MSR'}, 'rh850': {'JARL', 'LDSR', 'STSR'}}
+BARRIER_REGS = {'armv7m': ['pc'], 'rh850': []}  # writing them is a jump
 
-# Extract registers from a string
-def extract_registers(op):
-    return REGEX_REGISTER.findall(op.upper())
+# register sets are bitmasks of the register file of the isa, the condition flags are one more bit after the registers
+REGFILES = {isa: CpuRegRegFile(isa) for isa in ISA_DB}
+DECODERS = {isa: CpuRegIsaDb(isa) for isa in ISA_DB}
+FLAGS = {isa: 1 << REGFILES[isa].size for isa in ISA_DB}
 
 # Parse a single instruction
 def parse_instr(line, idx, isa):
@@ -37,26 +63,43 @@ def parse_instr(line, idx, isa):
         return None
     if REGEX_LABEL.match(text):
         return {'id': idx, 'opc': 'LABEL', 'text': text}
-    parts = REGEX_SPLIT.split(text)
-    opc = parts[0].upper()
-    if opc not in ISA_DB[isa]['instrs']:
-        return None
-    info = ISA_DB[isa]['instrs'][opc]
-    reads, writes = [], []
-    for i in info['read']:
-        if i + 1 < len(parts):
-            reads += extract_registers(parts[i+1])
-    for i in info['write']:
-        if i + 1 < len(parts):
-            writes += extract_registers(parts[i+1])
+    mnemonic = REGEX_SPLIT.split(text)[0].upper()
+    opc, reads, writes = DECODERS[isa].decode(text)
+    if opc is None:
+        # not in the isa db: stays in place, nothing is moved across it
+        return {'id': idx, 'opc': mnemonic, 'read': 0, 'write': 0, 'barrier': True, 'text': text}
+    if opc in FLAG_OPS[isa]:
+        writes |= FLAGS[isa]
+    if isa == 'armv7m':
+        # what lookup stripped off: [S][condition]
+        suffix = (mnemonic[:-2] if mnemonic.endswith(('.W', '.N')) else mnemonic)[len(opc):]
+        if suffix.startswith('S'):
+            writes |= FLAGS[isa]
+        if suffix[-2:] in CpuRegIsaDb.armv7m_conds and suffix[-2:] != 'AL':
+            reads |= FLAGS[isa]
     return {
         'id': idx,
         'opc': opc,
-        'read': set(reads),
-        'write': set(writes),
+        'read': reads,
+        'write': writes,
+        'barrier': opc in BARRIER_OPS[isa] or writes & REGFILES[isa].mask(BARRIER_REGS[isa]) != 0,
         'text': text
     }
 
+# Pin thumb-2 IT blocks: the IT itself (unknown, so a barrier already) and every instruction it covers
+def mark_it_blocks(parsed, isa):
+    if isa != 'armv7m':
+        return
+    shadow = 0
+    for instr in parsed:
+        if instr is None or instr['opc'] == 'LABEL':
+            continue
+        if shadow > 0:
+            instr['barrier'] = True
+            shadow -= 1
+        elif REGEX_IT.match(instr['opc']):
+            shadow = len(instr['opc']) - 1
+
 # Split into basic blocks
 def split_blocks(parsed, isa, lines):
     blocks = []
@@ -78,30 +121,101 @@ def split_blocks(parsed, isa, lines):
         blocks.append(current)
     return blocks
 
-# Schedule a block: reorder to avoid RAW hazards
+# Build the dependency dag of a block (instrs in program order)
+# returns succs[n] = [(successor, latency)] and the number of predecessors of every node
+def build_dag(instrs, isa):
+    regfile = REGFILES[isa]
+    n = len(instrs)
+    succs = [[] for _ in range(n)]
+    npreds = [0] * n
+    last_writer = {}    # register bit -> node
+    readers = {}        # register bit -> nodes that read it since its last write
+    last_store = -1
+    loads = []          # loads since the last store
+    last_barrier = -1
+    since_barrier = []
+
+    def edge(a, b, latency):
+        if a != -1 and a != b:
+            succs[a].append((b, latency))
+            npreds[b] += 1
+
+    for k, instr in enumerate(instrs):
+        opc = instr['opc']
+        reads = instr['read']
+        writes = instr['write']
+        if instr['barrier']:
+            for j in since_barrier:
+                edge(j, k, 1)
+            edge(last_barrier, k, 1)
+            last_barrier = k
+            since_barrier = []
+            # everything after depends on the barrier itself, the history before it is not needed anymore
+            last_writer = {}
+            readers = {}
+            last_store = -1
+            loads = []
+            continue
+        edge(last_barrier, k, 1)
+        since_barrier.append(k)
+        for i in regfile.indices(reads):
+            bit = 1 << i
+            if bit in last_writer:
+                edge(last_writer[bit], k, LATENCY[isa].get(instrs[last_writer[bit]]['opc'], 1))
+            readers.setdefault(bit, []).append(k)
+        for bit in [1 << i for i in regfile.indices(writes)]:
+            for j in readers.pop(bit, []):
+                edge(j, k, 0)       # WAR: may issue right after the read
+            if bit in last_writer:
+                edge(last_writer[bit], k, 1)    # WAW
+            last_writer[bit] = k
+        if opc in STORE_OPS[isa]:
+            for j in loads:
+                edge(j, k, 0)
+            edge(last_store, k, 1)
+            last_store = k
+            loads = []
+        elif opc in LOAD_OPS[isa]:
+            edge(last_store, k, 1)
+            loads.append(k)
+    return succs, npreds
+
+# Schedule a block: list scheduling over the dependency dag, longest path to the end first
 def schedule_block(block, isa):
     scheduled = []
-    remaining = [i for i in block if i and i['opc'] not in BRANCH_OPS[isa] and i['opc'] != 'LABEL']
+    body = [i for i in block if i and i['opc'] not in BRANCH_OPS[isa] and i['opc'] != 'LABEL']
     labels = [i for i in block if i and i['opc'] == 'LABEL']
     branches = [i for i in block if i and i['opc'] in BRANCH_OPS[isa]]
-    ready = set()
-    done = []
 
-    while remaining:
-        issued = False
-        for i in range(len(remaining)):
-            instr = remaining[i]
-            if instr['read'].issubset(ready):
-                done.append(instr)
-                ready.update(instr['write'])
-                del remaining[i]
-                issued = True
-                break
-        if not issued:
-            # no instruction ready, pick the next and just move on
-            instr = remaining.pop(0)
-            done.append(instr)
-            ready.update(instr['write'])
+    succs, npreds = build_dag(body, isa)
+    n = len(body)
+    # critical path: program order is a topological order, so one backwards pass does it
+    height = [0] * n
+    for k in range(n - 1, -1, -1):
+        own = LATENCY[isa].get(body[k]['opc'], 1)
+        height[k] = max([own] + [latency + height[j] for j, latency in succs[k]])
+
+    earliest = [0] * n
+    ready = [(-height[k], k) for k in range(n) if npreds[k] == 0]    # all predecessors issued
+    heapq.heapify(ready)
+    waiting = []    # (earliest cycle, -height, node): issued predecessors, result not available yet
+    cycle = 0
+    done = []
+    while ready or waiting:
+        while waiting and waiting[0][0] <= cycle:
+            t, h, k = heapq.heappop(waiting)
+            heapq.heappush(ready, (h, k))
+        if not ready:
+            cycle = waiting[0][0]   # stall until the next result is there
+            continue
+        h, k = heapq.heappop(ready)
+        done.append(body[k])
+        for j, latency in succs[k]:
+            earliest[j] = max(earliest[j], cycle + latency)
+            npreds[j] -= 1
+            if npreds[j] == 0:
+                heapq.heappush(waiting, (earliest[j], -height[j], j))
+        cycle += 1
 
     scheduled.extend(l['text'] for l in labels)
     scheduled.extend(i['text'] for i in done)
@@ -112,8 +226,8 @@ def schedule_block(block, isa):
 
 if __name__ == '__main__':
     isa = 'armv7m'
-    input_file = 'input.asm'
-    output_file = 'output.asm'
+    input_file = sys.argv[1] if len(sys.argv) > 1 else 'input.asm'
+    output_file = sys.argv[2] if len(sys.argv) > 2 else 'output.asm'
 
     # Read input assembly file
     with open(input_file, 'r') as f:
@@ -121,6 +235,7 @@ if __name__ == '__main__':
 
     # Parse instructions
     parsed = [parse_instr(line, i, isa) for i, line in enumerate(asm_lines)]
+    mark_it_blocks(parsed, isa)
 
     # Split into blocks
     blocks = split_blocks(parsed, isa, asm_lines)
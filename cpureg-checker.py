@@ -1,3 +1,6 @@
+import multiprocessing
 from cpureg.cpureg_checker import CpuRegApp
 
-CpuRegApp().main()
+if __name__ == "__main__":
+    multiprocessing.freeze_support()    # process pool workers in the pyinstaller build
+    CpuRegApp().main()
@@ -0,0 +1,163 @@
+import os
+import json
+import hashlib
+import re
+
+# CpuRegAsmCfg
+# control flow graph of every asm function, built once at generation and kept in the workspace (cfg.json).
+#
+# the instruction list of a function is its body split into lines (body.splitlines(), the same lines as proc_funcbody),
+# so instruction i is line i of the body.
+# a basic block is a range of instructions, stored by its first index only:
+#   block b = instructions[starts[b]:starts[b + 1]]  (the last block ends at "n")
+# a block ends at every branch (branch_ops: explicit mnemonic table of the isa, .w/.n stripped) and at every return,
+# the branch itself is the last instruction of its block.
+# successor edges inside the function are stored CSR style (block ids):
+#   successors of block b = succ[succ_offsets[b]:succ_offsets[b + 1]]
+#   fall-through into the next block comes first, the branch target after it
+# edges that leave the function: targets = [[block, target name, kind], ...]
+#   kind: "call" (returns to the next block), "jump" (unconditional), "cond" (conditional, falls through otherwise),
+#         "indirect" (target is a register)
+# a branch to "." (wait forever) loops on its own block
+# exits = blocks that leave the function for good (return, jump away, or falling off the end into the next label)
+#
+# CpuRegAsmCfg().build(asm_funcs, branch_ops, return_pattern, regnames)
+# rebuilds only the functions whose body changed since the cfg.json that was loaded before (sha1 of the body).
+
+class CpuRegAsmCfg:
+    version = 2
+    width_suffixes = (".w", ".n")
+    target_pattern = re.compile(r"[A-Za-z_.$][\w.$]*")
+
+    def __init__(self):
+        self.funcs = {}     # func -> {"hash", "n", "starts", "succ_offsets", "succ", "targets", "exits"}
+
+    def body_hash(self, body: str) -> str:
+        return hashlib.sha1(body.encode("utf-8")).hexdigest()
+
+    # asm_funcs: {func: body}
+    # branch_ops: {mnemonic: (kind "call"/"jump"/"cond", operand index of the target, -1 = last)}
+    # return_pattern: matches the (lower case) instructions that return to the caller
+    # regnames: register names, a branch to one of them is indirect
+    def build(self, asm_funcs: dict, branch_ops: dict, return_pattern, regnames: set) -> int:
+        funcs = {}
+        rebuilt = 0
+        for func, body in asm_funcs.items():
+            htemp = self.body_hash(body)
+            cfg = self.funcs.get(func, None)
+            if cfg is None or cfg["hash"] != htemp:
+                cfg = self.build_function(func, body, branch_ops, return_pattern, regnames)
+                cfg["hash"] = htemp
+                rebuilt += 1
+            funcs[func] = cfg
+        self.funcs = funcs
+        return rebuilt
+
+    # (kind, target) of a branch instruction, None if line does not branch
+    def decode_branch(self, line: str, branch_ops: dict, regnames: set):
+        parts = line.strip().split(None, 1)
+        if len(parts) == 0:
+            return None
+        mnemonic = parts[0].lower()
+        if mnemonic.endswith(self.width_suffixes):
+            mnemonic = mnemonic[:-2]
+        if mnemonic not in branch_ops:
+            return None
+        kind, index = branch_ops[mnemonic]
+        operands = [operand.strip() for operand in parts[1].split(",")] if len(parts) > 1 else [""]
+        operand = operands[index] if -len(operands) <= index < len(operands) else ""
+        if operand == ".":
+            return (kind, ".")
+        m = self.target_pattern.search(operand)
+        if not m:
+            return (kind, "")
+        target = m.group(0)     # keeps its case
+        if target.lower() in regnames:
+            return ("indirect", target)
+        return (kind, target.lstrip("_"))
+
+    def build_function(self, func: str, body: str, branch_ops: dict, return_pattern, regnames: set) -> dict:
+        lines = body.splitlines()
+        starts = [0]
+        ends = []   # per block: (kind, target) of its last instruction, or None if it just runs into the next block
+        for i, line in enumerate(lines):
+            lowered = line.strip().lower()
+            if return_pattern.search(lowered):
+                ends.append(("return", ""))
+            else:
+                end = self.decode_branch(line, branch_ops, regnames)
+                if end is None:
+                    continue
+                ends.append(end)
+            if i + 1 < len(lines):
+                starts.append(i + 1)
+        if len(ends) < len(starts):
+            ends.append(None)
+
+        succ_offsets = [0]
+        succ = []
+        targets = []
+        exits = []
+        for b, end in enumerate(ends):
+            last = b + 1 == len(starts)
+            falls = end is None or end[0] == "call" or end[0] == "cond"
+            if falls:
+                if last:
+                    exits.append(b)     # runs into whatever label comes next in the source
+                else:
+                    succ.append(b + 1)
+            if end is not None:
+                kind, target = end
+                if kind == "return":
+                    exits.append(b)
+                elif target == ".":
+                    if b not in succ[succ_offsets[-1]:]:
+                        succ.append(b)  # waits right here
+                elif target == func and kind != "call":
+                    if 0 not in succ[succ_offsets[-1]:]:
+                        succ.append(0)  # loops back to its own label
+                else:
+                    targets.append([b, target, kind])
+                    if kind == "jump" or kind == "indirect":
+                        exits.append(b)
+            succ_offsets.append(len(succ))
+
+        return {"n": len(lines), "starts": starts, "succ_offsets": succ_offsets, "succ": succ, "targets": targets, "exits": exits}
+
+    def save(self, path: str):
+        tmp_file = path + ".tmp"
+        with open(tmp_file, 'w', encoding="UTF-8") as f:
+            json.dump({"version": self.version, "funcs": self.funcs}, f, separators=(",", ":"))
+        os.replace(tmp_file, path)
+
+    # returns False if there is no (usable) cfg file
+    def load(self, path: str) -> bool:
+        self.funcs = {}
+        try:
+            with open(path, 'r', encoding="UTF-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if data.get("version", None) != self.version:
+            return False
+        self.funcs = data["funcs"]
+        return True
+
+    # [(start, end)] instruction ranges of every block of func (empty if func is not an asm function)
+    def blocks(self, func: str) -> list:
+        cfg = self.funcs.get(func, None)
+        if cfg is None:
+            return []
+        starts = cfg["starts"]
+        return [(starts[b], starts[b + 1] if b + 1 < len(starts) else cfg["n"]) for b in range(len(starts))]
+
+    def successors(self, func: str, block: int) -> list:
+        cfg = self.funcs[func]
+        return cfg["succ"][cfg["succ_offsets"][block]:cfg["succ_offsets"][block + 1]]
+
+    # [(target name, kind)] edges leaving func from block
+    def targets(self, func: str, block: int) -> list:
+        return [(target, kind) for b, target, kind in self.funcs[func]["targets"] if b == block]
+
+    def is_exit(self, func: str, block: int) -> bool:
+        return block in self.funcs[func]["exits"]
@@ -1,5 +1,8 @@
 import re
 import os
+import concurrent.futures
+from cpureg.regfile import CpuRegRegFile
+from cpureg.symbol_index import CpuRegSymbolIndex
 
 # CpuRegAsmEngine
 # this class provides register tracking (which gpr, sysregs, etc has it touched, 
@@ -7,167 +10,173 @@ import os
 #
 # CpuRegAsmEngine().register_component(funcname: str, funcbody: str)
 # 1. if function is a c function, funcbody is a inline assembly 
-# (processed from outside using CpuRegAsmParser().parse_functions_c_inlineasm_to_asm)
+# (captured by CpuRegCParser while the c bodies are cut out, workspace inlineasm.json)
 # 2. if function is a asm function, funcbody is an assembly code
-# 3. this is saved onto regcomp[funcname] = {funcbody, {}} 
-# (the dictionary inside -> register as key, push/pop count as value)
+# 3. this is saved onto regcomp[funcname] = (funcbody, counters, touched)
+# (counters -> one push/pop count per register index of the CpuRegRegFile of the arch, touched -> bitmask)
 # (push r4 makes it +1, pop r4 makes it -1; if push/pop exists for that register, it is marked 0.)
 # (if its not 0, then that register must be popped somewhere else, and is to be tracked further.)
-# (dictionary is to be iterated)
+# (regmap(funcname) gives the {reg name: count} view of the touched registers)
 #
-# CpuRegAsmEngine().generate_regmap() -> {}
-# 1. iterate regcomp dictionary
-# 2. per funcbody, iterate every lines, if regcomp[funcname][1][reg] is None, regcomp[funcname][1][reg] = 0
-# 3. if push or pop hit, get list of registers affected; iterate regcomp[funcname][1][reg]
-#    if push, ++; if pop, --.
+# CpuRegAsmEngine().generate_regmap(jobs: int = 1) -> {}
+# 1. iterate regcomp dictionary (in batches over jobs processes if jobs > 1)
+# 2. per funcbody, every line is dispatched on its first token (opcode table of the arch, one dict lookup):
+#    opcodes that are not in the table are skipped right away, the others go to exactly one operand decoder
+# 3. operand decoders turn the register list into a bitmask (CpuRegRegFile.parse_reglist, aliases like sp/lr/lp included,
+#    ranges like r4-r7 expanded), push adds +1 to every register in the mask, pop -1.
+#    (armv7m: a popped pc counts as lr, push {r4, lr} / pop {r4, pc} is the usual pair)
 # 4. return regcomp dictionary
+#
+# CpuRegAsmEngine().decode_line(line: str) -> (+1 push / -1 pop / 0, register bitmask)
+
+# whole batches of functions go to a worker process (regmaps only depend on their own body)
+def _regmap_batch(arch: str, bodies: list) -> list:
+    engine = CpuRegAsmEngine(arch)
+    return [engine.regmap_function(body) for body in bodies]
 
 class CpuRegAsmEngine:
+    armv7m_conds = ["", "eq", "ne", "cs", "hs", "cc", "lo", "mi", "pl", "vs", "vc", "hi", "ls", "ge", "lt", "gt", "le", "al"]
+    armv7m_ldm_modes = ["", "ia", "ib", "da", "db", "fd", "fa", "ed", "ea"]
+
     def __init__(self, arch="armv7m"):
-        # regcomp[funcname] = (funcbody, {reg: push/pop count})
+        # regcomp[funcname] = (funcbody, [push/pop count per register], touched register mask)
         self.regcomp = {}
-        self.arch = arch
-        # define push/pop regex lists per architecture
-        self.arch_patterns = {
-            "armv7m": {
-                "push": [
-                    re.compile(r"\s*push\s*\{([^\}]*)\}"),
-                    re.compile(r"\s*stm\w*\s+\w+\s*,\s*\{([^\}]*)\}")
-                ],
-                "pop": [
-                    re.compile(r"\s*pop\s*\{([^\}]*)\}"),
-                    re.compile(r"\s*ldm\w*\s+\w+\s*,\s*\{([^\}]*)\}")
-                ]
-            },
-            "rh850": {
-                "push": [
-                    re.compile(r"\s*pushsp\s+([r\d\-\, ]+)"),
-                    re.compile(r"\s*prepare\s+([r\d\-\, ]+),\s*\w+")
-                ],
-                "pop": [
-                    re.compile(r"\s*popsp\s+([r\d\-\, ]+)"),
-                    re.compile(r"\s*dispose\s+\w+,\s*([r\d\-\, ]+)")
-                ]
-            }
-        }
+        self.regfile = CpuRegRegFile(arch)
+        self.arch = self.regfile.arch
+        # first token -> (operand decoder, +1 push / -1 pop)
+        self.opcodes = {}
+        self.pop_return_mask = 0
+        self.push_return_mask = 0
+        if self.arch == "armv7m":
+            self.pop_return_mask = self.regfile.mask(["pc"])
+            self.push_return_mask = self.regfile.mask(["lr"])
+            for cond in self.armv7m_conds:
+                self.opcodes["push" + cond] = (self.regfile.parse_reglist, 1)
+                self.opcodes["pop" + cond] = (self.regfile.parse_reglist, -1)
+                for mode in self.armv7m_ldm_modes:
+                    # stm/ldm <base>, {list}: the base register is not part of the list
+                    self.opcodes["stm" + mode + cond] = (self.decode_multiple, 1)
+                    self.opcodes["ldm" + mode + cond] = (self.decode_multiple, -1)
+                    self.opcodes["stm" + cond + mode] = (self.decode_multiple, 1)   # pre-UAL spelling
+                    self.opcodes["ldm" + cond + mode] = (self.decode_multiple, -1)
+        elif self.arch == "rh850":
+            self.opcodes["pushsp"] = (self.regfile.parse_reglist, 1)
+            self.opcodes["popsp"] = (self.regfile.parse_reglist, -1)
+            # prepare list, imm / dispose imm, list[, [reg]]
+            self.opcodes["prepare"] = (self.decode_prepare, 1)
+            self.opcodes["dispose"] = (self.decode_dispose, -1)
 
     def register_component(self, funcname: str, funcbody: str):
         # initialize register tracking dictionary for this function
-        reg_dict = {}
-        self.regcomp[funcname] = (funcbody, reg_dict)
-
-    def _parse_registers(self, reg_str, arch):
-        # for armv7m: "r4, r5, r6"
-        # for rh850: "r4-r6, r10"
-        regs = []
-        reg_str = reg_str.replace(" ", "")
-        if arch == "armv7m":
-            regs = [r for r in reg_str.split(",") if r]
-        elif arch == "rh850":
-            for part in reg_str.split(","):
-                if "-" in part:
-                    start, end = part.split("-")
-                    if start.startswith("r") and end.startswith("r"):
-                        for i in range(int(start[1:]), int(end[1:]) + 1):
-                            regs.append("r" + str(i))
-                elif part:
-                    regs.append(part)
+        self.regcomp[funcname] = (funcbody, self.regfile.counters(), 0)
+
+    def decode_multiple(self, operands: str) -> int:
+        start = operands.find("{")
+        if start == -1:
+            return 0
+        return self.regfile.parse_reglist(operands[start:operands.find("}", start) + 1 or len(operands)])
+
+    def decode_prepare(self, operands: str) -> int:
+        end = operands.find("}") + 1 if "{" in operands else operands.rfind(",")
+        return self.regfile.parse_reglist(operands[:end] if end > 0 else operands)
+
+    def decode_dispose(self, operands: str) -> int:
+        comma = operands.find(",")
+        if comma == -1:
+            return 0
+        reglist = operands[comma + 1:]
+        if "{" in reglist:
+            reglist = reglist[:reglist.find("}") + 1]
+        elif "[" in reglist:
+            reglist = reglist[:reglist.find("[")]     # dispose imm, list, [reg]: the jump register is not popped
+        return self.regfile.parse_reglist(reglist)
+
+    def decode_line(self, line: str) -> tuple:
+        parts = line.strip().lower().split(None, 1)
+        if len(parts) == 0:
+            return 0, 0
+        opcode = parts[0]
+        if opcode.endswith((".w", ".n")):
+            opcode = opcode[:-2]
+        entry = self.opcodes.get(opcode, None)
+        if entry is None or len(parts) < 2:
+            return 0, 0
+        mask = entry[0](parts[1])
+        # push {.., lr} / pop {.., pc} is a pair: the return address goes back into pc
+        if entry[1] < 0 and mask & self.pop_return_mask:
+            mask = (mask & ~self.pop_return_mask) | self.push_return_mask
+        return entry[1], mask
+
+    # returns (counters, touched mask)
+    def regmap_function(self, funcbody: str) -> tuple:
+        counters = self.regfile.counters()
+        touched = 0
+        for line in funcbody.splitlines():
+            sign, mask = self.decode_line(line)
+            if mask == 0:
+                continue
+            touched |= mask
+            self.regfile.add(counters, mask, sign)
+        return counters, touched
+
+    def generate_regmap(self, jobs: int = 1):
+        funcnames = list(self.regcomp.keys())
+        bodies = [self.regcomp[funcname][0] for funcname in funcnames]
+        if jobs <= 1 or len(funcnames) < 2:
+            regmaps = [self.regmap_function(body) for body in bodies]
         else:
-            regs = [r for r in reg_str.split(",") if r]
-        return regs
-
-    def generate_regmap(self):
-        # iterate regcomp dictionary and count push/pop per register
-        patterns = self.arch_patterns.get(self.arch, self.arch_patterns["armv7m"])
-        push_patterns = patterns["push"]
-        pop_patterns = patterns["pop"]
-
-        for funcname in self.regcomp:
-            funcbody, reg_dict = self.regcomp[funcname]
-            lines = funcbody.splitlines()
-            for line in lines:
-                # check push patterns
-                for push_re in push_patterns:
-                    push_search = push_re.search(line)
-                    if push_search:
-                        regs = self._parse_registers(push_search.group(1), self.arch)
-                        for reg in regs:
-                            if reg not in reg_dict:
-                                reg_dict[reg] = 0
-                            reg_dict[reg] += 1
-                # check pop patterns
-                for pop_re in pop_patterns:
-                    pop_search = pop_re.search(line)
-                    if pop_search:
-                        regs = self._parse_registers(pop_search.group(1), self.arch)
-                        for reg in regs:
-                            if reg not in reg_dict:
-                                reg_dict[reg] = 0
-                            reg_dict[reg] -= 1
+            # a few big batches instead of one task per function (the per function work is tiny)
+            batch_size = (len(bodies) + jobs - 1) // jobs
+            regmaps = []
+            with concurrent.futures.ProcessPoolExecutor(max_workers = jobs) as executor:
+                batches = [bodies[i:i + batch_size] for i in range(0, len(bodies), batch_size)]
+                for batch_regmaps in executor.map(_regmap_batch, [self.arch] * len(batches), batches):
+                    regmaps += batch_regmaps
+        for funcname, body, (counters, touched) in zip(funcnames, bodies, regmaps):
+            self.regcomp[funcname] = (body, counters, touched)
         return self.regcomp
 
+    # {reg name: push/pop count} of the registers funcname touched
+    def regmap(self, funcname: str) -> dict:
+        funcbody, counters, touched = self.regcomp[funcname]
+        return {self.regfile.name(i): counters[i] for i in self.regfile.indices(touched)}
+
 
 # swiss army knife class
 class CpuRegAsmParser():
+    inlineasm_start_pattern = re.compile(r"__asm")
+    inlineasm_quote_pattern = re.compile(r"\"(.*?)\"")
+    inlineasm_trim_pattern = re.compile(r"^(.*?)\s*(?=\\|$)")
+
     # scour through everywhere for VTOR(armv7m) or SCBP(rh850) insertion code
     # attempt to locate the vector table.
-    def parse_arch_vectors(self, search_loc: str, arch: str) -> str:
+    # (only for workspaces without symbols.json, generate records the assignment sites itself now)
+    def parse_arch_vectors(self, search_loc: str, arch: str, jobs: int = 0) -> str:
         # Returns the name of the vector table assigned to VTOR (armv7m) or SCBP (rh850)
         genfiles = []
         for root, dirs, files in os.walk(search_loc):
             for file in files:
                 if ".generated." in file:
                     genfiles.append(os.path.join(root, file))
+        genfiles.sort()
+        if len(genfiles) == 0:
+            # gcc output is streamed into the parsers, the files are only there with --keep-intermediates
+            print("no preprocessed sources in " + search_loc + " to search (run -g again, it builds the symbol index)")
+            return ""
 
-        reg_name = ""
-        if arch == "armv7m":
-            reg_name = "VTOR"
-        elif arch == "rh850":
-            reg_name = "SCBP"
-        else:
+        reg_name = CpuRegSymbolIndex.arch_vector_regs.get(arch, "")
+        if reg_name == "":
             print("Unknown architecture: " + arch)
             return ""
 
-        # Case-insensitive pattern for direct assignment
-        assign_pattern = re.compile(r"\b" + reg_name + r"\s*=\s*([A-Za-z_][A-Za-z0-9_]*)", re.IGNORECASE)
-        # Pattern for GPR assignment (e.g. r0 = VectorTableName)
-        gpr_assign_pattern = re.compile(r"\b(r\d+)\s*=\s*([A-Za-z_][A-Za-z0-9_]*)", re.IGNORECASE)
-        # Pattern for system register assignment from GPR (e.g. VTOR = r0)
-        sysreg_from_gpr_pattern = re.compile(r"\b" + reg_name + r"\s*=\s*(r\d+)", re.IGNORECASE)
-
-        for file in genfiles:
-            try:
-                with open(file, "r", encoding="utf-8") as f:
-                    lines = f.readlines()
-                    # First, check for direct assignment
-                    for line in lines:
-                        m = assign_pattern.search(line)
-                        if m:
-                            vector_table = m.group(1)
-                            print("Found direct assignment in " + file + ": " + reg_name + " = " + vector_table)
-                            return vector_table
-                    # Next, check for indirect assignment via GPR
-                    gpr_map = {}
-                    for i, line in enumerate(lines):
-                        gpr_match = gpr_assign_pattern.search(line)
-                        if gpr_match:
-                            gpr = gpr_match.group(1)
-                            value = gpr_match.group(2)
-                            gpr_map[gpr] = value
-                        sysreg_match = sysreg_from_gpr_pattern.search(line)
-                        if sysreg_match:
-                            gpr = sysreg_match.group(1)
-                            # Look back for the last assignment to this GPR
-                            if gpr in gpr_map:
-                                vector_table = gpr_map[gpr]
-                                print("Found indirect assignment in " + file + ": " + reg_name + " = " + gpr + " = " + vector_table)
-                                return vector_table
-            except Exception as e:
-                print("Error reading " + file + ": " + str(e))
-        return ""
+        vector_table, file = CpuRegSymbolIndex(arch).rescan(genfiles, reg_name, jobs or os.cpu_count() or 1)
+        if vector_table != "":
+            print("Found assignment in " + file + ": " + reg_name + " = " + vector_table)
+        return vector_table
     
     # inlineasm inside c func parser
     # returns list of inline asm strings (one string per block)
+    # (only for workspaces without inlineasm.json, generate captures the inline asm itself now)
     def parse_functions_c_inlineasm_to_asm(self, c_func: str) -> list:
         inlineblocks = []
         tmplines = c_func.split('\n')
@@ -177,7 +186,7 @@ class CpuRegAsmParser():
         inblock = 0
         tmpstr = ""
         for i in range(0, loc):
-            if re.compile(r"__asm").search(lines[i]):
+            if self.inlineasm_start_pattern.search(lines[i]):
                 insideinlineasm = 1
             if insideinlineasm == 1 and "(" in lines[i]:
                 inblock = 1  # i do not expect any nested brackets in a inlineasm
@@ -188,8 +197,8 @@ class CpuRegAsmParser():
                 insideinlineasm = 0
                 inblock = 0
                 # process shit here and move on to the next inlineasm
-                parsedlines_v = re.compile(r"\"(.*?)\"").findall(tmpstr)
-                parsedlines = [re.compile(r"^(.*?)\s*(?=\\|$)").search(line).group(1).strip() for line in parsedlines_v]
+                parsedlines_v = self.inlineasm_quote_pattern.findall(tmpstr)
+                parsedlines = [self.inlineasm_trim_pattern.search(line).group(1).strip() for line in parsedlines_v]
                 parsedtostr = "\n".join(parsedlines)
                 inlineblocks.append(parsedtostr)
                 tmpstr = ""
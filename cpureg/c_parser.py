@@ -0,0 +1,258 @@
+import re
+import bisect
+
+# CpuRegCParser
+# single pass function/global extractor for preprocessed c sources.
+#
+# CpuRegCParser().parse_spans(text: str) -> (spans, global_vars)
+# 1. the whole preprocessed text is tokenized once (whitespace, comments, strings, identifiers, punctuation)
+# 2. brace/paren/bracket depth is tracked per token, so braces inside strings or comments do not count
+# 3. a paren group at the top level that is directly followed by '{' is a function definition
+#    spans = [(func_name, body_start, body_end, param_text, asm_blocks)] (body offsets are '{' and one past '}')
+#    asm_blocks: the inline asm statements of the body, read from the same tokens while the body is skipped
+#    (one string per statement, one instruction per line: the template strings before the first ':', split on \n)
+# 4. an identifier at the top level right before '[', '=', ',' or ';' is a global declaration
+#    (typedefs, struct tags, prototypes and initializers are skipped)
+#
+# CpuRegCParser().parse_functions(lines: list, srcname: str) -> (src_funcs, func_unit_tracker_src, global_vars, param_vars, inline_asm)
+# drop-in for the old line based state machine in CpuRegParser.parse_functions_c_persrc.
+# func_unit_tracker_src[func] = [line of '{', line of '}', srcname]
+# inline_asm[func] = asm_blocks (only functions that have inline asm)
+
+class CpuRegCParser:
+    # one alternation, so the text is scanned only once
+    c_token_pattern = re.compile(r"""
+        (?P<ws>\s+)
+        |(?P<comment>/\*.*?\*/|//[^\n]*)
+        |(?P<str>"(?:\\.|[^"\\\n])*"|'(?:\\.|[^'\\\n])*')
+        |(?P<ident>[A-Za-z_]\w*)
+        |(?P<num>\.?\d[\w.]*)
+        |(?P<punct>.)
+        """, re.S | re.X)
+
+    # these take a paren group but are not function names
+    attribute_keywords = {"__attribute__", "__attribute", "__declspec", "__asm__", "__asm", "asm", "__extension__"}
+    # the identifier after these is a tag, not a variable
+    tag_keywords = {"struct", "union", "enum"}
+    # inline asm statements inside a function body (qualifiers like volatile/goto may sit before the '(')
+    asm_keywords = {"__asm__", "__asm", "asm"}
+    asm_newline_pattern = re.compile(r"\\n|\\r")
+    asm_tab_pattern = re.compile(r"\\t")
+
+    def parse_spans(self, text: str) -> tuple:
+        spans = []
+        global_vars = set()
+
+        brace = 0       # {} depth
+        paren = 0       # () depth
+        bracket = 0     # [] depth
+
+        # top level statement state (reset on ';' at the top level)
+        typedef = 0         # statement started with typedef
+        initializer = 0     # after '=' until ',' or ';'
+        first_token = 1
+        last_ident = None   # declarator candidate
+        prev_tag = 0        # previous token was struct/union/enum
+        prev_ident = None   # identifier directly before '(' at the top level
+        group_name = None   # name of the paren group being read
+        group_start = 0
+        candidate = None    # (name, param_text) of a paren group that may turn into a function
+
+        func_name = None    # inside a function body if not None
+        func_start = 0
+        func_params = ""
+        func_asm = []       # inline asm blocks of the function body
+        asm_state = 0       # 1: asm keyword seen, 2: in the template strings, 3: in the operands
+        asm_paren = 0
+        asm_lines = []
+
+        for m in self.c_token_pattern.finditer(text):
+            kind = m.lastgroup
+            if kind == "ws" or kind == "comment":
+                continue
+            tok = m.group(kind)
+
+            # inside a function body we only care about the braces (and the inline asm)
+            if func_name is not None:
+                if asm_state == 0:
+                    if kind == "ident" and tok in self.asm_keywords:
+                        asm_state = 1
+                elif asm_state == 1:
+                    if tok == "(":
+                        asm_state = 2
+                        asm_paren = 1
+                        asm_lines = []
+                    elif kind != "ident":
+                        asm_state = 0
+                    continue
+                else:
+                    if tok == "(":
+                        asm_paren += 1
+                    elif tok == ")":
+                        asm_paren -= 1
+                        if asm_paren == 0:
+                            func_asm.append("\n".join(asm_lines))
+                            asm_state = 0
+                    elif asm_state == 2 and asm_paren == 1:
+                        if tok == ":":
+                            asm_state = 3
+                        elif kind == "str" and tok[0] == '"':
+                            self.parse_asm_template(asm_lines, tok[1:-1])
+                    continue
+                if tok == "{":
+                    brace += 1
+                elif tok == "}":
+                    brace -= 1
+                    if brace == 0:
+                        spans.append((func_name, func_start, m.end(), func_params, func_asm))
+                        func_name = None
+                        func_asm = []
+                        asm_state = 0
+                        # a function definition ends the statement
+                        typedef = initializer = 0
+                        first_token = 1
+                        last_ident = prev_ident = candidate = None
+                        prev_tag = 0
+                continue
+
+            if kind == "punct":
+                if tok == "(":
+                    if paren == 0 and brace == 0 and bracket == 0:
+                        group_name = prev_ident
+                        group_start = m.end()
+                        if group_name not in self.attribute_keywords:
+                            last_ident = None   # its a function name, not a variable
+                    paren += 1
+                elif tok == ")":
+                    paren -= 1
+                    if paren == 0 and brace == 0 and bracket == 0:
+                        if group_name is not None and group_name not in self.attribute_keywords:
+                            candidate = (group_name, text[group_start:m.start()])
+                        group_name = None
+                    if paren < 0:
+                        paren = 0
+                elif paren > 0:
+                    continue
+                elif tok == "[":
+                    if brace == 0 and bracket == 0 and initializer == 0:
+                        self.parse_add_global(global_vars, last_ident, typedef)
+                        last_ident = None
+                    bracket += 1
+                elif tok == "]":
+                    bracket = max(bracket - 1, 0)
+                elif bracket > 0:
+                    continue
+                elif tok == "{":
+                    if brace == 0 and initializer == 0 and candidate is not None:
+                        # function definition
+                        func_name, func_params = candidate
+                        func_start = m.start()
+                        brace = 1
+                        continue
+                    brace += 1
+                elif tok == "}":
+                    brace = max(brace - 1, 0)
+                elif brace > 0:
+                    continue
+                elif tok == "=":
+                    self.parse_add_global(global_vars, last_ident, typedef)
+                    last_ident = None
+                    initializer = 1
+                elif tok == ",":
+                    if initializer == 0:
+                        self.parse_add_global(global_vars, last_ident, typedef)
+                    last_ident = None
+                    initializer = 0
+                elif tok == ";":
+                    if initializer == 0:
+                        self.parse_add_global(global_vars, last_ident, typedef)
+                    typedef = initializer = 0
+                    first_token = 1
+                    last_ident = prev_ident = candidate = None
+                    prev_tag = 0
+                    continue
+                prev_ident = None
+                prev_tag = 0
+                if tok not in "()":
+                    candidate = None
+                first_token = 0
+                continue
+
+            if paren > 0 or bracket > 0 or brace > 0:
+                continue
+
+            if kind == "ident":
+                if first_token and tok == "typedef":
+                    typedef = 1
+                if tok in self.attribute_keywords:
+                    prev_ident = tok
+                elif tok in self.tag_keywords:
+                    prev_tag = 1
+                    prev_ident = None
+                    candidate = None
+                else:
+                    if initializer == 0 and prev_tag == 0:
+                        last_ident = tok
+                    prev_tag = 0
+                    prev_ident = tok
+                    candidate = None
+            else:
+                prev_ident = None
+                candidate = None
+            first_token = 0
+
+        return spans, global_vars
+
+    # one template string of an inline asm: every \n inside it ends an instruction
+    def parse_asm_template(self, asm_lines: list, template: str):
+        for line in self.asm_newline_pattern.split(template):
+            line = self.asm_tab_pattern.sub(" ", line).strip()
+            if line != "":
+                asm_lines.append(line)
+
+    def parse_add_global(self, global_vars: set, varname: str, typedef: int):
+        if varname is not None and typedef == 0:
+            global_vars.add(varname)
+
+    # cut the comments out of a function body (gcc -E usually took care of it already)
+    def parse_strip_comments(self, body: str) -> str:
+        if "/*" not in body and "//" not in body:
+            return body
+        pieces = []
+        last = 0
+        for m in self.c_token_pattern.finditer(body):
+            if m.lastgroup == "comment":
+                pieces.append(body[last:m.start()])
+                last = m.end()
+        pieces.append(body[last:])
+        return "".join(pieces)
+
+    def parse_functions(self, lines: list, srcname: str) -> tuple:
+        text = "".join(lines)
+        # offset of every line start, to turn span offsets back into line numbers
+        line_starts = [0]
+        offset = 0
+        for line in lines:
+            offset += len(line)
+            line_starts.append(offset)
+
+        spans, global_vars = self.parse_spans(text)
+
+        src_funcs = {}
+        func_unit_tracker_src = {}
+        param_vars = {}
+        inline_asm = {}
+        for func_name, start, end, params, asm_blocks in spans:
+            body = self.parse_strip_comments(text[start:end]).strip()
+            # same function defined twice -> longest one wins (same rule as merging sources)
+            if func_name in src_funcs and len(src_funcs[func_name]) >= len(body):
+                continue
+            src_funcs[func_name] = body
+            param_vars[func_name] = " ".join(params.split())
+            if len(asm_blocks) > 0:
+                inline_asm[func_name] = asm_blocks
+            else:
+                inline_asm.pop(func_name, None)
+            func_unit_tracker_src[func_name] = [bisect.bisect_right(line_starts, start) - 1, bisect.bisect_right(line_starts, end - 1) - 1, srcname]
+
+        return src_funcs, func_unit_tracker_src, global_vars, param_vars, inline_asm
@@ -0,0 +1,826 @@
+import os
+import re
+import bisect
+
+# CpuRegPreprocessor
+# in-process c preprocessor for --preprocessor builtin (gcc -E stays the reference backend).
+# saves one gcc process per source, and every header is read & tokenized only once per run.
+#
+# CpuRegPreprocessor(incpaths, sysincpaths, predefined).preprocess(srcpath, srctext=None, asm=False) -> (lines, deps)
+# 1. a file is tokenized once (comments dropped, backslash-newlines spliced) into logical lines,
+#    each token knows its physical line & column. the result is memoized per path (file_memo),
+#    together with the include guard of the file (#ifndef X / #define X ... #endif around everything),
+#    so a guarded header that is included again is skipped without even looking at it.
+# 2. #include / #include_next / #define / #undef / #if / #ifdef / #ifndef / #elif / #else / #endif / #pragma once
+#    are handled natively, #if expressions are evaluated by a small precedence climbing parser.
+# 3. with asm=True the main file may also use the assembler directives that the gcc path rewrites:
+#    .set NAME, VALUE (#define) and .if / .ifdef / .ifndef / .elif / .else / .endif
+# 4. macro expansion follows the usual hide set algorithm (Prosser), including # / ## / __VA_ARGS__
+#    and the gnu ", ## __VA_ARGS__" comma removal.
+# 5. the output is laid out like gcc -E lays it out, so line numbers (func_unit_tracker) come out the same:
+#    every token stays on its own source line, a jump of more than 8 lines (or into another file) is a linemarker,
+#    and linemarkers are dropped (like CpuRegParser.parse_preprocessed_lines does for gcc).
+#    (gcc also breaks lines where tokens spelled in system headers meet user tokens, which is not followed,
+#    so blank lines may differ around system header macros. --check-preprocessor compares the two backends)
+# 6. <stdc-predef.h> is pre-included and the predefined macros come from gcc -dM -E, like gcc does it.
+#
+# tokens are tuples: (text, line, col, white space before it, hide set or None)
+
+class CpuRegPreprocessor:
+    version = 1
+
+    pp_token_pattern = re.compile(r"""
+        (?P<ws>[ \t\f\v\r]+)
+        |(?P<nl>\n)
+        |(?P<comment>/\*.*?(?:\*/|\Z)|//[^\n]*)
+        |(?P<str>(?:u8|[LuU])?"(?:\\.|[^"\\\n])*"|(?:u8|[LuU])?'(?:\\.|[^'\\\n])*')
+        |(?P<ident>[A-Za-z_$][\w$]*)
+        |(?P<num>\.?\d(?:[eEpP][+-]|[\w.])*)
+        |(?P<punct>%:%:|\.\.\.|<<=|>>=|->|\+\+|--|<<|>>|&&|\|\||\#\#|%:|[-+*/%&|^<>=!]=|[][(){}.&*+\-~!/%<>^|?:;=,\#])
+        |(?P<other>.)
+        """, re.S | re.X)
+    splice_pattern = re.compile(r"\\[ \t]*\r?\n")
+
+    conditional_directives = {"if", "ifdef", "ifndef", "elif", "elifdef", "elifndef", "else", "endif"}
+    asm_directives = {"set": "define", "if": "if", "ifdef": "ifdef", "ifndef": "ifndef",
+                      "elif": "elif", "elseif": "elif", "else": "else", "endif": "endif"}
+    max_include_depth = 200
+
+    def __init__(self, incpaths: list, sysincpaths: list = [], predefined: list = []):
+        self.incpaths = [os.path.abspath(i) for i in incpaths]
+        self.sysincpaths = [os.path.abspath(i) for i in sysincpaths]
+        self.search_dirs = self.incpaths + self.sysincpaths
+        self.file_memo = {}         # (path, asm) -> (logical lines, include guard)
+        self.include_memo = {}      # (name, angled, curdir, search start) -> path (or None)
+        # predefined: "#define NAME VALUE" lines (gcc -dM -E)
+        self.macros = {}
+        for kind, tokens in self.parse_tokenize("\n".join(predefined), "<built-in>", False)[0]:
+            if kind == "directive" and len(tokens) > 2 and tokens[1][0] == "define":
+                self.parse_define(tokens[2:], "<built-in>")
+        self.base_macros = self.macros
+
+    def warn(self, where: str, line: int, msg: str):
+        print("builtin preprocessor: " + where + ":" + str(line) + ": " + msg)
+
+    # -------- tokenizing (memoized per file) --------
+
+    # returns (logical lines [(kind, tokens)], include guard or None)
+    # kind: "text" / "directive" / "asm" (asm directive of the main asm file)
+    def parse_tokenize(self, text: str, where: str, asm: bool) -> tuple:
+        # splice backslash-newlines first, but remember where the physical lines start
+        line_starts = [0]
+        pieces = []
+        last = 0
+        removed = 0
+        for m in self.splice_pattern.finditer(text):
+            pieces.append(text[last:m.start()])
+            removed += m.end() - m.start()
+            last = m.end()
+            line_starts.append(m.end() - removed)
+        pieces.append(text[last:])
+        spliced = "".join(pieces)
+        splice_starts = line_starts
+
+        # line start offsets in the spliced text (real newlines + spliced ones)
+        starts = []
+        pos = spliced.find("\n")
+        while pos != -1:
+            starts.append(pos + 1)
+            pos = spliced.find("\n", pos + 1)
+        line_starts = sorted([0] + starts + splice_starts[1:])
+
+        logical = []
+        tokens = []
+        ws = False
+        for m in self.pp_token_pattern.finditer(spliced):
+            kind = m.lastgroup
+            if kind == "ws" or kind == "comment":
+                ws = True
+                continue
+            if kind == "nl":
+                if len(tokens) > 0:
+                    logical.append(self.parse_classify(tokens, asm))
+                tokens = []
+                ws = False
+                continue
+            offset = m.start()
+            line = bisect.bisect_right(line_starts, offset)
+            col = offset - line_starts[line - 1] + 1
+            tok = m.group(kind)
+            if tok == "%:":
+                tok = "#"
+            elif tok == "%:%:":
+                tok = "##"
+            tokens.append((tok, line, col, ws, None))
+            ws = False
+        if len(tokens) > 0:
+            logical.append(self.parse_classify(tokens, asm))
+
+        return logical, self.parse_include_guard(logical)
+
+    def parse_classify(self, tokens: list, asm: bool) -> tuple:
+        if tokens[0][0] == "#":
+            return ("directive", tokens)
+        if asm and tokens[0][0] == "." and len(tokens) > 1 and tokens[1][0] in self.asm_directives and not tokens[1][3]:
+            return ("asm", tokens)
+        return ("text", tokens)
+
+    # #ifndef X (or #if !defined X) ... #endif around the whole file
+    def parse_include_guard(self, logical: list):
+        if len(logical) < 2 or logical[0][0] != "directive" or logical[-1][0] != "directive":
+            return None
+        first = [t[0] for t in logical[0][1][1:]]
+        if first[:1] == ["ifndef"] and len(first) == 2:
+            guard = first[1]
+        elif first[:3] == ["if", "!", "defined"]:
+            rest = [t for t in first[3:] if t not in ("(", ")")]
+            if len(rest) != 1:
+                return None
+            guard = rest[0]
+        else:
+            return None
+        if [t[0] for t in logical[-1][1][1:2]] != ["endif"]:
+            return None
+        # the #endif has to close the very first #if
+        depth = 0
+        for i, (kind, tokens) in enumerate(logical):
+            if kind != "directive" or len(tokens) < 2:
+                continue
+            name = tokens[1][0]
+            if name in ("if", "ifdef", "ifndef"):
+                depth += 1
+            elif name == "endif":
+                depth -= 1
+                if depth == 0 and i != len(logical) - 1:
+                    return None
+        return guard
+
+    def parse_file(self, path: str, asm: bool = False, text: str = None) -> tuple:
+        key = (path, asm)
+        if text is None and key in self.file_memo:
+            return self.file_memo[key]
+        if text is None:
+            with open(path, 'r', encoding = "UTF-8", errors = "replace") as f:
+                text = f.read()
+            self.file_memo[key] = self.parse_tokenize(text, path, asm)
+            return self.file_memo[key]
+        return self.parse_tokenize(text, path, asm)
+
+    # -------- translation unit --------
+
+    def preprocess(self, srcpath: str, srctext: str = None, asm: bool = False) -> tuple:
+        self.macros = dict(self.base_macros)
+        self.once = set()
+        self.pushed_macros = {}
+        self.completed = set()  # headers processed to the end (the include guard only counts after that)
+        self.deps = set()
+        self.counter = 0
+        self.out = []           # finished output lines
+        self.cur = None         # output line being printed (None: nothing printed on it yet)
+        self.printed_line = 1
+
+        # gcc pre-includes <stdc-predef.h> (only macros, nothing gets printed)
+        predef, predef_found = self.parse_find_include("stdc-predef.h", True, "", 0, False)
+        if predef is not None:
+            self.deps.add(predef)
+            self.parse_process_file(predef, self.parse_file(predef), os.path.dirname(predef), predef_found, 1)
+            self.out = []
+            self.cur = None
+            self.printed_line = 1
+
+        if srctext is None:
+            path = os.path.abspath(srcpath)
+            self.deps.add(path)
+            self.parse_process_file(path, self.parse_file(path, asm), os.path.dirname(path), -1, 0)
+        else:
+            # fed through stdin (gcc -x c - runs in the directory of srcpath): quote includes start next to srcpath
+            curdir = os.path.dirname(os.path.abspath(srcpath)) if srcpath else os.getcwd()
+            self.parse_process_file("<stdin>", self.parse_file("<stdin>", asm, srctext), curdir, -1, 0)
+        if self.cur is not None:
+            self.out.append(self.cur + "\n")
+        return self.out, self.deps
+
+    # found: index in search_dirs the file was found in (for include_next), -1 otherwise
+    def parse_process_file(self, path: str, parsed: tuple, curdir: str, found: int, depth: int):
+        logical, guard = parsed
+        # (active, some branch already taken, else seen)
+        conds = []
+        active = True
+        run = []    # text tokens waiting for macro expansion
+        for kind, tokens in logical:
+            if kind == "text":
+                if active:
+                    run.extend(tokens)
+                continue
+
+            if kind == "asm":
+                name = self.asm_directives[tokens[1][0]]
+                args = tokens[2:]
+                if name == "define":
+                    # .set NAME, VALUE
+                    if active and len(args) >= 1:
+                        self.parse_flush(run, path)
+                        run = []
+                        value = args[2:] if len(args) > 1 and args[1][0] == "," else args[1:]
+                        self.macros[args[0][0]] = (None, None, self.parse_body(value))
+                    continue
+            else:
+                if len(tokens) == 1:
+                    continue    # null directive
+                name = tokens[1][0]
+                args = tokens[2:]
+
+            if name in self.conditional_directives:
+                if name in ("if", "ifdef", "ifndef"):
+                    if active:
+                        taken = self.parse_condition(name, args, path, tokens[0][1], curdir, found)
+                        conds.append([active, taken, False])
+                        active = taken
+                    else:
+                        conds.append([False, True, False])
+                    continue
+                if len(conds) == 0:
+                    self.warn(path, tokens[0][1], "#" + name + " without #if")
+                    continue
+                top = conds[-1]
+                if name == "endif":
+                    conds.pop()
+                    active = top[0]
+                elif name == "else":
+                    top[2] = True
+                    active = top[0] and not top[1]
+                    top[1] = True
+                else:   # elif, elifdef, elifndef
+                    if top[0] and not top[1]:
+                        active = self.parse_condition(name[2:] if name != "elif" else "if", args, path, tokens[0][1], curdir, found)
+                        top[1] = active
+                    else:
+                        active = False
+                continue
+
+            if not active:
+                continue
+
+            # anything that changes the macros or the output has to see the text before it expanded
+            self.parse_flush(run, path)
+            run = []
+            line = tokens[0][1]
+            if name == "define":
+                if len(args) > 0:
+                    self.parse_define(args, path)
+            elif name == "undef":
+                if len(args) > 0:
+                    self.macros.pop(args[0][0], None)
+            elif name == "include" or name == "include_next":
+                if depth >= self.max_include_depth:
+                    self.warn(path, line, "#include nested too deeply")
+                    continue
+                self.parse_include(name, args, path, line, curdir, found, depth)
+            elif name == "pragma":
+                pragma = [tok[0] for tok in args[:2]]
+                if pragma[:1] == ["once"]:
+                    self.once.add(path)
+                    # gcc leaves an empty line for it
+                    self.parse_move_to(line)
+                    self.cur = ""
+                elif pragma[:1] == ["push_macro"] and len(args) > 2:
+                    macro_name = args[2][0][1:-1]
+                    self.pushed_macros.setdefault(macro_name, []).append(self.macros.get(macro_name, None))
+                elif pragma[:1] == ["pop_macro"] and len(args) > 2:
+                    macro_name = args[2][0][1:-1]
+                    if len(self.pushed_macros.get(macro_name, [])) > 0:
+                        macro = self.pushed_macros[macro_name].pop()
+                        if macro is None:
+                            self.macros.pop(macro_name, None)
+                        else:
+                            self.macros[macro_name] = macro
+                elif not (pragma[:1] == ["GCC"] and pragma[1:] in (["poison"], ["system_header"], ["dependency"])):
+                    # gcc prints the pragma on a line of its own, which is dropped like a linemarker
+                    self.parse_move_to(line)
+                    self.printed_line += 1
+            elif name == "error":
+                self.warn(path, line, "#error " + self.parse_spell(args))
+            # line, warning, ident, sccs and unknown directives are ignored
+
+        self.parse_flush(run, path)
+        if len(conds) > 0:
+            self.warn(path, logical[-1][1][0][1], "unterminated #if")
+
+    def parse_include(self, name: str, args: list, path: str, line: int, curdir: str, found: int, depth: int):
+        if len(args) > 0 and args[0][0][0] != "\"" and args[0][0] != "<":
+            args = self.parse_expand(args, path)   # #include MACRO
+        if len(args) == 0:
+            self.warn(path, line, "#include expects \"FILENAME\" or <FILENAME>")
+            return
+        if args[0][0].startswith("\""):
+            incname = args[0][0][1:-1]
+            angled = False
+        elif args[0][0] == "<":
+            incname = ""
+            for tok in args[1:]:
+                if tok[0] == ">":
+                    break
+                incname += (" " if tok[3] and incname != "" else "") + tok[0]
+            angled = True
+        else:
+            self.warn(path, line, "#include expects \"FILENAME\" or <FILENAME>")
+            return
+
+        start = found + 1 if name == "include_next" and found >= 0 else 0
+        incpath, incfound = self.parse_find_include(incname, angled, curdir, start, name == "include_next" and found >= 0)
+        if incpath is None:
+            self.warn(path, line, incname + ": No such file or directory")
+            return
+        if incpath in self.once:
+            return
+        parsed = self.parse_file(incpath)
+        if parsed[1] is not None and incpath in self.completed and parsed[1] in self.macros:
+            return  # include guard is defined already, nothing would come out of it
+
+        self.deps.add(incpath)
+        # linemarker into the header, and back
+        self.parse_move_to(line)
+        if self.cur is not None:
+            self.out.append(self.cur + "\n")
+        self.cur = None
+        self.printed_line = 1
+        self.parse_process_file(incpath, parsed, os.path.dirname(incpath), incfound, depth + 1)
+        self.completed.add(incpath)
+        if self.cur is not None:
+            self.out.append(self.cur + "\n")
+        self.cur = None
+        self.printed_line = line + 1
+
+    # returns (path, index of the search dir it was found in or -1)
+    def parse_find_include(self, incname: str, angled: bool, curdir: str, start: int, is_next: bool) -> tuple:
+        key = (incname, angled, curdir, start, is_next)
+        if key in self.include_memo:
+            return self.include_memo[key]
+        result = (None, -1)
+        if os.path.isabs(incname):
+            if os.path.isfile(incname):
+                result = (os.path.abspath(incname), -1)
+        else:
+            if not angled and not is_next:
+                candidate = os.path.join(curdir, incname)
+                if os.path.isfile(candidate):
+                    result = (os.path.abspath(candidate), -1)
+            if result[0] is None:
+                for i in range(start, len(self.search_dirs)):
+                    candidate = os.path.join(self.search_dirs[i], incname)
+                    if os.path.isfile(candidate):
+                        result = (os.path.abspath(candidate), i)
+                        break
+        self.include_memo[key] = result
+        return result
+
+    # -------- macros --------
+
+    # #define tokens (after the directive name)
+    # macros[name] = (params or None, variadic param name or None, body)
+    def parse_define(self, args: list, where: str):
+        name = args[0][0]
+        if len(args) > 1 and args[1][0] == "(" and not args[1][3]:
+            params = []
+            variadic = None
+            i = 2
+            while i < len(args) and args[i][0] != ")":
+                tok = args[i][0]
+                if tok == "...":
+                    variadic = "__VA_ARGS__"
+                    params.append(variadic)
+                elif tok != ",":
+                    if i + 1 < len(args) and args[i + 1][0] == "...":
+                        variadic = tok
+                        i += 1
+                    params.append(tok)
+                i += 1
+            if i >= len(args):
+                self.warn(where, args[0][1], "missing ')' in macro parameter list")
+                return
+            self.macros[name] = (params, variadic, self.parse_body(args[i + 1:]))
+        else:
+            self.macros[name] = (None, None, self.parse_body(args[1:]))
+
+    def parse_body(self, tokens: list) -> list:
+        body = []
+        for tok in tokens:
+            body.append((tok[0], 0, 0, tok[3] and len(body) > 0, None))
+        return body
+
+    # macro expansion (hide sets)
+    def parse_expand(self, tokens: list, where: str) -> list:
+        out = []
+        stack = list(reversed(tokens))
+        pending_ws = False  # a macro that expanded to nothing leaves its white space to the next token
+        while len(stack) > 0:
+            tok = stack.pop()
+            if pending_ws:
+                tok = tok[:3] + (True, tok[4])
+                pending_ws = False
+            name = tok[0]
+            macro = self.macros.get(name, None)
+            if macro is None or (tok[4] is not None and name in tok[4]):
+                if name == "__LINE__":
+                    out.append((str(tok[1]), tok[1], tok[2], tok[3], None))
+                elif name == "__FILE__":
+                    out.append(("\"" + where.replace("\\", "\\\\") + "\"", tok[1], tok[2], tok[3], None))
+                elif name == "__COUNTER__":
+                    out.append((str(self.counter), tok[1], tok[2], tok[3], None))
+                    self.counter += 1
+                else:
+                    out.append(tok)
+                continue
+
+            params, variadic, body = macro
+            hide = (tok[4] | {name}) if tok[4] is not None else frozenset((name,))
+            if params is None:
+                repl = self.parse_subst(body, None, None, None, hide, tok, where)
+                pending_ws = len(repl) == 0 and tok[3]
+                stack.extend(reversed(repl))
+                continue
+
+            # function-like: only a macro call if a '(' follows
+            if len(stack) == 0 or stack[-1][0] != "(":
+                out.append(tok)
+                continue
+            args = self.parse_collect_args(stack)
+            if args is None:
+                self.warn(where, tok[1], "unterminated argument list invoking macro \"" + name + "\"")
+                out.append(tok)
+                continue
+            args, rparen = args
+            if len(params) == 0 and len(args) == 1 and len(args[0]) == 0:
+                args = []
+            if variadic is not None and len(args) == len(params) - 1:
+                args.append([])     # variadic part left out
+            if variadic is not None and len(args) > len(params):
+                # everything past the named params goes into the variadic one
+                merged = args[len(params) - 1]
+                for extra in args[len(params):]:
+                    merged = merged + [(",", tok[1], tok[2], False, None)] + extra
+                args = args[:len(params) - 1] + [merged]
+            if len(args) != len(params):
+                self.warn(where, tok[1], "macro \"" + name + "\" passed " + str(len(args)) + " arguments, but takes " + str(len(params)))
+                out.append(tok)
+                continue
+            if rparen[4] is not None and tok[4] is not None:
+                hide = (tok[4] & rparen[4]) | {name}
+            else:
+                hide = frozenset((name,))
+            repl = self.parse_subst(body, params, variadic, args, hide, tok, where)
+            pending_ws = len(repl) == 0 and tok[3]
+            stack.extend(reversed(repl))
+        return out
+
+    # pops "( ... )" off the (reversed) token stack
+    # returns ([arg tokens, ...], closing paren) or None if the list is not terminated (stack left untouched)
+    def parse_collect_args(self, stack: list):
+        taken = [stack.pop()]   # '('
+        args = [[]]
+        depth = 1
+        while len(stack) > 0:
+            tok = stack.pop()
+            taken.append(tok)
+            if tok[0] == "(":
+                depth += 1
+            elif tok[0] == ")":
+                depth -= 1
+                if depth == 0:
+                    return args, tok
+            elif tok[0] == "," and depth == 1:
+                args.append([])
+                continue
+            args[-1].append(tok)
+        stack.extend(reversed(taken))
+        return None
+
+    def parse_subst(self, body: list, params: list, variadic: str, args: list, hide: frozenset, invoker: tuple, where: str) -> list:
+        res = []
+        expanded = {}   # param index -> fully expanded argument
+        i = 0
+        n = len(body)
+        while i < n:
+            tok = body[i]
+            text = tok[0]
+            pidx = params.index(text) if params is not None and text in params else -1
+
+            if text == "#" and params is not None and i + 1 < n and body[i + 1][0] in params:
+                arg = args[params.index(body[i + 1][0])]
+                res.append((self.parse_stringize(arg), 0, 0, tok[3], None))
+                i += 2
+                continue
+
+            if text == "##" and i + 1 < n:
+                nxt = body[i + 1]
+                nidx = params.index(nxt[0]) if params is not None and nxt[0] in params else -1
+                rhs = args[nidx] if nidx != -1 else [nxt]
+                lhs = res.pop() if len(res) > 0 else None
+                if nidx != -1 and nxt[0] == variadic and lhs is not None and lhs[0] == ",":
+                    # gnu: ", ## __VA_ARGS__" drops the comma when there are no variadic arguments
+                    if len(rhs) > 0:
+                        res.append(lhs)
+                        res.extend(rhs)
+                elif len(rhs) == 0:
+                    if lhs is not None:
+                        res.append(lhs)
+                elif lhs is None or lhs[0] == "":
+                    res.extend(rhs)
+                else:
+                    res.append((lhs[0] + rhs[0][0], 0, 0, lhs[3], None))
+                    res.extend(rhs[1:])
+                i += 2
+                continue
+
+            if pidx != -1:
+                if i + 1 < n and body[i + 1][0] == "##":
+                    arg = args[pidx]
+                    if len(arg) == 0:
+                        res.append(("", 0, 0, False, None))    # placemarker
+                    else:
+                        res.append(arg[0][:3] + (tok[3], arg[0][4]))
+                        res.extend(arg[1:])
+                else:
+                    if pidx not in expanded:
+                        expanded[pidx] = self.parse_expand(args[pidx], where)
+                    arg = expanded[pidx]
+                    if len(arg) > 0:
+                        res.append(arg[0][:3] + (tok[3], arg[0][4]))
+                        res.extend(arg[1:])
+                i += 1
+                continue
+
+            res.append(tok)
+            i += 1
+
+        # everything that came out of the macro is printed where the macro was called
+        line = invoker[1]
+        col = invoker[2]
+        result = []
+        for tok in res:
+            if tok[0] == "":
+                continue
+            tok_hide = (tok[4] | hide) if tok[4] is not None else hide
+            result.append((tok[0], line, col, invoker[3] if len(result) == 0 else tok[3], tok_hide))
+        return result
+
+    def parse_stringize(self, tokens: list) -> str:
+        spelled = ""
+        for tok in tokens:
+            text = tok[0]
+            if text[-1:] in ("\"", "'"):
+                text = text.replace("\\", "\\\\").replace("\"", "\\\"")
+            if tok[3] and spelled != "":
+                spelled += " "
+            spelled += text
+        return "\"" + spelled + "\""
+
+    def parse_spell(self, tokens: list) -> str:
+        spelled = ""
+        for tok in tokens:
+            if tok[3] and spelled != "":
+                spelled += " "
+            spelled += tok[0]
+        return spelled
+
+    # -------- #if --------
+
+    def parse_condition(self, name: str, args: list, where: str, line: int, curdir: str, found: int) -> bool:
+        if name == "ifdef" or name == "ifndef":
+            if len(args) == 0:
+                self.warn(where, line, "no macro name given in #" + name + " directive")
+                return False
+            defined = self.parse_is_defined(args[0][0])
+            return defined if name == "ifdef" else not defined
+
+        # defined X / defined(X) / __has_include(...) before expansion
+        tokens = []
+        i = 0
+        while i < len(args):
+            text = args[i][0]
+            if text == "defined":
+                if i + 1 < len(args) and args[i + 1][0] == "(":
+                    value = i + 2 < len(args) and self.parse_is_defined(args[i + 2][0])
+                    i += 4
+                else:
+                    value = i + 1 < len(args) and self.parse_is_defined(args[i + 1][0])
+                    i += 2
+                tokens.append(("1" if value else "0", line, 0, True, None))
+                continue
+            if text in ("__has_include", "__has_include_next"):
+                j = i + 2
+                incname = ""
+                angled = False
+                if j < len(args) and args[j][0].startswith("\""):
+                    incname = args[j][0][1:-1]
+                    j += 1
+                elif j < len(args) and args[j][0] == "<":
+                    angled = True
+                    j += 1
+                    while j < len(args) and args[j][0] != ">":
+                        incname += args[j][0]
+                        j += 1
+                    j += 1
+                is_next = text == "__has_include_next" and found >= 0
+                incpath = self.parse_find_include(incname, angled, curdir, found + 1 if is_next else 0, is_next)[0]
+                tokens.append(("1" if incpath is not None else "0", line, 0, True, None))
+                i = j + 1   # closing paren
+                continue
+            tokens.append(args[i])
+            i += 1
+
+        tokens = self.parse_expand(tokens, where)
+        texts = []
+        i = 0
+        while i < len(tokens):
+            text = tokens[i][0]
+            if text in ("__has_attribute", "__has_cpp_attribute", "__has_builtin", "__has_feature", "__has_extension"):
+                # we do not know the compiler builtins: none of them
+                depth = 0
+                i += 1
+                while i < len(tokens):
+                    if tokens[i][0] == "(":
+                        depth += 1
+                    elif tokens[i][0] == ")":
+                        depth -= 1
+                        if depth == 0:
+                            break
+                    i += 1
+                texts.append("0")
+            else:
+                texts.append(text)
+            i += 1
+
+        try:
+            value, pos = self.parse_eval(texts, 0, 0)
+            if pos != len(texts):
+                raise ValueError("missing binary operator before token \"" + texts[pos] + "\"")
+            return value != 0
+        except (ValueError, IndexError, ZeroDivisionError) as e:
+            self.warn(where, line, "#if: " + (str(e) or "invalid expression"))
+            return False
+
+    def parse_is_defined(self, name: str) -> bool:
+        return name in self.macros or name in ("__LINE__", "__FILE__", "__COUNTER__", "__has_include", "__has_include_next",
+                                               "__has_attribute", "__has_cpp_attribute", "__has_builtin")
+
+    binary_precedence = {
+        "*": 10, "/": 10, "%": 10,
+        "+": 9, "-": 9,
+        "<<": 8, ">>": 8,
+        "<": 7, ">": 7, "<=": 7, ">=": 7,
+        "==": 6, "!=": 6,
+        "&": 5, "^": 4, "|": 3, "&&": 2, "||": 1
+    }
+
+    # precedence climbing, returns (value, next position)
+    def parse_eval(self, texts: list, pos: int, min_prec: int) -> tuple:
+        lhs, pos = self.parse_eval_unary(texts, pos)
+        while pos < len(texts):
+            op = texts[pos]
+            if op == "?" and min_prec == 0:
+                mid, pos = self.parse_eval(texts, pos + 1, 0)
+                if pos >= len(texts) or texts[pos] != ":":
+                    raise ValueError("'?' without following ':'")
+                rhs, pos = self.parse_eval(texts, pos + 1, 0)
+                lhs = mid if lhs != 0 else rhs
+                continue
+            if op == "," and min_prec == 0:
+                lhs, pos = self.parse_eval(texts, pos + 1, 0)
+                continue
+            prec = self.binary_precedence.get(op, 0)
+            if prec == 0 or prec < min_prec:
+                break
+            rhs, pos = self.parse_eval(texts, pos + 1, prec + 1)
+            lhs = self.parse_eval_binary(op, lhs, rhs)
+        return lhs, pos
+
+    def parse_eval_unary(self, texts: list, pos: int) -> tuple:
+        tok = texts[pos]
+        if tok == "(":
+            value, pos = self.parse_eval(texts, pos + 1, 0)
+            if pos >= len(texts) or texts[pos] != ")":
+                raise ValueError("missing ')' in expression")
+            return value, pos + 1
+        if tok in ("+", "-", "~", "!"):
+            value, pos = self.parse_eval_unary(texts, pos + 1)
+            if tok == "-":
+                return -value, pos
+            if tok == "~":
+                return ~value, pos
+            if tok == "!":
+                return int(value == 0), pos
+            return value, pos
+        if tok[0].isdigit() or (tok[0] == "." and len(tok) > 1):
+            return self.parse_number(tok), pos + 1
+        if tok[-1:] == "'":
+            return self.parse_char(tok), pos + 1
+        if tok[0].isalpha() or tok[0] in "_$":
+            return 0, pos + 1   # identifiers left after expansion are 0
+        raise ValueError("token \"" + tok + "\" is not valid in preprocessor expressions")
+
+    def parse_eval_binary(self, op: str, a: int, b: int) -> int:
+        if op == "*":
+            return a * b
+        if op == "/" or op == "%":
+            q = abs(a) // abs(b)
+            if (a < 0) != (b < 0):
+                q = -q
+            return q if op == "/" else a - q * b
+        if op == "+":
+            return a + b
+        if op == "-":
+            return a - b
+        if op == "<<":
+            return a << b if b >= 0 else a >> -b
+        if op == ">>":
+            return a >> b if b >= 0 else a << -b
+        if op == "<":
+            return int(a < b)
+        if op == ">":
+            return int(a > b)
+        if op == "<=":
+            return int(a <= b)
+        if op == ">=":
+            return int(a >= b)
+        if op == "==":
+            return int(a == b)
+        if op == "!=":
+            return int(a != b)
+        if op == "&":
+            return a & b
+        if op == "^":
+            return a ^ b
+        if op == "|":
+            return a | b
+        if op == "&&":
+            return int(a != 0 and b != 0)
+        return int(a != 0 or b != 0)
+
+    def parse_number(self, tok: str) -> int:
+        digits = tok.rstrip("uUlL")
+        low = digits.lower()
+        if low.startswith("0x"):
+            return int(low[2:], 16)
+        if low.startswith("0b"):
+            return int(low[2:], 2)
+        if len(low) > 1 and low.startswith("0"):
+            return int(low, 8)
+        if not low.isdigit():
+            raise ValueError("floating constant in preprocessor expression")
+        return int(low)
+
+    def parse_char(self, tok: str) -> int:
+        body = tok[tok.index("'") + 1:-1]
+        if body.startswith("\\"):
+            esc = body[1:]
+            simple = {"n": 10, "t": 9, "r": 13, "0": 0, "a": 7, "b": 8, "f": 12, "v": 11, "\\": 92, "'": 39, "\"": 34, "?": 63}
+            if esc.startswith("x"):
+                return int(esc[1:], 16)
+            if esc[:1].isdigit():
+                return int(esc, 8)
+            return simple.get(esc, ord(esc[:1] or "\0"))
+        return ord(body[:1] or "\0")
+
+    # -------- output --------
+
+    # gcc style line keeping: up to 8 lines are filled with newlines, anything further is a linemarker
+    def parse_move_to(self, line: int):
+        if line <= self.printed_line and self.cur is not None:
+            return
+        if self.cur is not None:
+            self.out.append(self.cur + "\n")
+            self.printed_line += 1
+            self.cur = None
+        if self.printed_line <= line < self.printed_line + 8:
+            while line > self.printed_line:
+                self.out.append("\n")
+                self.printed_line += 1
+        else:
+            self.printed_line = line
+
+    def parse_flush(self, run: list, where: str):
+        if len(run) == 0:
+            return
+        prev_macro = False
+        for tok in self.parse_expand(run, where):
+            text = tok[0]
+            if tok[1] > self.printed_line or self.cur is None:
+                self.parse_move_to(tok[1])
+                self.cur = " " * (tok[2] - 1) + text
+                prev_macro = tok[4] is not None
+                continue
+            if tok[3] or (tok[4] is not None or prev_macro) and self.parse_avoid_paste(self.cur[-1:], text[:1]):
+                self.cur += " "
+            self.cur += text
+            prev_macro = tok[4] is not None
+
+    # would the two tokens lex as one if printed without a space (only checked next to macro expansions, like gcc)
+    def parse_avoid_paste(self, a: str, b: str) -> bool:
+        if (a.isalnum() or a in "_$") and (b.isalnum() or b in "_$"):
+            return True
+        if a == b and a in "+-&|<>:#=":
+            return True
+        if b == "=" and a in "+-*/%&|^<>!=":
+            return True
+        return (a == "-" and b == ">") or (a == "/" and b in "/*") or (a == "." and (b.isdigit() or b == "."))
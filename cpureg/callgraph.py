@@ -0,0 +1,458 @@
+import os
+import json
+
+# CpuRegCallGraph
+# the whole call graph of the workspace in a single file (callgraph.json), loaded with one read.
+#
+# functions and global variables are interned: they are referred to by their index in "funcs" / "globals".
+# adjacency is stored CSR style, one flat id list + one offset list per relation:
+#   callees of funcs[i]  = callee_ids[callee_offsets[i]:callee_offsets[i + 1]]
+#   callers of funcs[i]  = caller_ids[caller_offsets[i]:caller_offsets[i + 1]]
+#   globals of funcs[i]  = global_ids[global_offsets[i]:global_offsets[i + 1]]  (index into "globals")
+# "units" keeps the source file name of every function.
+# globals are also indexed the other way around (who touches a global), per global id:
+#   readers of globals[g] = reader_ids[reader_offsets[g]:reader_offsets[g + 1]]  (index into "funcs")
+#   writers of globals[g] = writer_ids[writer_offsets[g]:writer_offsets[g + 1]]
+# "scc_of" is the strongly connected component of every function (Tarjan, computed once at generation).
+# components are numbered in reverse topological order: a callee's component never has a larger id than its caller's,
+# so dp over the condensed graph is a plain loop over the component ids.
+# fold_callees() runs a bottom-up summary (e.g. the push/pop balance) over the components in that order,
+# fold_callers() the top-down one (e.g. which roots reach a component) in the opposite order.
+# reachability is answered per query by a walk over the condensed graph (nothing quadratic is stored or kept):
+# reach_bits() / reaching_bits() give the components below / above some functions as a bitset (bit c = component c),
+# a query that tests many functions against one target computes that bitset once and tests bits.
+# "roots" are the entry points of the program in vector table order, [slot, func id] (handlers that are not
+# functions of the graph are left out). root_masks() tells every component which roots reach it, in one pass.
+#
+# the old layout (callstack_gen/<func>.<sha1>.txt, callstack_gen/globals.<func>.<sha1>.txt) can still be
+# exported from it, and imported back into it (for workspaces generated before the graph file existed).
+
+class CpuRegCallGraph:
+    version = 1
+
+    def __init__(self):
+        self.funcs = []
+        self.units = []
+        self.globals = []
+        self.callee_offsets = [0]
+        self.callee_ids = []
+        self.caller_offsets = [0]
+        self.caller_ids = []
+        self.global_offsets = [0]
+        self.global_ids = []
+        self.reader_offsets = [0]
+        self.reader_ids = []
+        self.writer_offsets = [0]
+        self.writer_ids = []
+        self.func_ids = {}  # name -> id
+        self.global_name_ids = {}   # global name -> id
+        self.scc_of = []    # func id -> component id
+        self.scc_members = []   # component id -> func ids
+        self.scc_cyclic = []    # component id -> 1 if it is a recursion cycle (more than one func, or calls itself)
+        self.scc_callees = None     # condensed graph (built on demand)
+        self.scc_callers = None
+        self.path_counts = {}   # "callee"/"caller" -> number of paths per component (memoized)
+        self.roots = []         # [vector slot, func id], in slot order
+
+    # callstack_gen: {func: set of called funcs}, func_globals: {func: set of globals}, func_units: {func: srcname}
+    # func_global_reads / func_global_writes: {func: set of globals} (without them every use counts as a read)
+    def build(self, callstack_gen: dict, func_globals: dict, func_units: dict, func_global_reads: dict = None, func_global_writes: dict = None):
+        self.funcs = sorted(callstack_gen.keys())
+        self.func_ids = {func: i for i, func in enumerate(self.funcs)}
+        self.units = [func_units.get(func, "") for func in self.funcs]
+        global_names = set()
+        for gvars in func_globals.values():
+            global_names.update(gvars)
+        self.globals = sorted(global_names)
+        self.global_name_ids = {gvar: i for i, gvar in enumerate(self.globals)}
+
+        callers = [[] for _ in self.funcs]
+        self.callee_offsets = [0]
+        self.callee_ids = []
+        self.global_offsets = [0]
+        self.global_ids = []
+        for i, func in enumerate(self.funcs):
+            for callee in sorted(self.func_ids[c] for c in callstack_gen[func] if c in self.func_ids):
+                self.callee_ids.append(callee)
+                callers[callee].append(i)
+            self.callee_offsets.append(len(self.callee_ids))
+            self.global_ids.extend(sorted(self.global_name_ids[g] for g in func_globals.get(func, ())))
+            self.global_offsets.append(len(self.global_ids))
+
+        self.caller_offsets = [0]
+        self.caller_ids = []
+        for i in range(len(self.funcs)):
+            self.caller_ids.extend(callers[i])   # already sorted (filled in id order)
+            self.caller_offsets.append(len(self.caller_ids))
+
+        self.build_global_index(func_global_reads, func_global_writes)
+        self.condense()
+
+    # inverted global index (global id -> reading / writing func ids)
+    def build_global_index(self, func_global_reads: dict = None, func_global_writes: dict = None):
+        readers = [[] for _ in self.globals]
+        writers = [[] for _ in self.globals]
+        for i, func in enumerate(self.funcs):
+            if func_global_reads is None:
+                reads = self.global_ids_of(i)
+            else:
+                reads = [self.global_name_ids[g] for g in func_global_reads.get(func, ()) if g in self.global_name_ids]
+            for g in reads:
+                readers[g].append(i)
+            if func_global_writes is not None:
+                for g in func_global_writes.get(func, ()):
+                    if g in self.global_name_ids:
+                        writers[self.global_name_ids[g]].append(i)
+        self.reader_offsets = [0]
+        self.reader_ids = []
+        self.writer_offsets = [0]
+        self.writer_ids = []
+        for g in range(len(self.globals)):
+            self.reader_ids.extend(sorted(set(readers[g])))
+            self.reader_offsets.append(len(self.reader_ids))
+            self.writer_ids.extend(sorted(set(writers[g])))
+            self.writer_offsets.append(len(self.writer_ids))
+
+    # tarjan, iterative (the call chains can be way deeper than the recursion limit)
+    def condense(self):
+        n = len(self.funcs)
+        index = [-1] * n
+        low = [0] * n
+        onstack = [False] * n
+        stack = []
+        counter = 0
+        self.scc_of = [-1] * n
+        self.scc_members = []
+        for root in range(n):
+            if index[root] != -1:
+                continue
+            work = [[root, 0]]
+            while len(work) > 0:
+                top = work[-1]
+                v = top[0]
+                if top[1] == 0:
+                    index[v] = low[v] = counter
+                    counter += 1
+                    stack.append(v)
+                    onstack[v] = True
+                edge = self.callee_offsets[v] + top[1]
+                if edge < self.callee_offsets[v + 1]:
+                    top[1] += 1
+                    w = self.callee_ids[edge]
+                    if index[w] == -1:
+                        work.append([w, 0])
+                    elif onstack[w]:
+                        low[v] = min(low[v], index[w])
+                    continue
+                work.pop()
+                if len(work) > 0:
+                    u = work[-1][0]
+                    low[u] = min(low[u], low[v])
+                if low[v] == index[v]:
+                    # v is the root of a component
+                    comp = len(self.scc_members)
+                    members = []
+                    while True:
+                        w = stack.pop()
+                        onstack[w] = False
+                        self.scc_of[w] = comp
+                        members.append(w)
+                        if w == v:
+                            break
+                    self.scc_members.append(sorted(members))
+        self.load_scc_info()
+
+    def load_scc_info(self):
+        if len(self.scc_members) == 0:
+            comps = max(self.scc_of) + 1 if len(self.scc_of) > 0 else 0
+            self.scc_members = [[] for _ in range(comps)]
+            for i, comp in enumerate(self.scc_of):
+                self.scc_members[comp].append(i)
+        self.scc_cyclic = []
+        for members in self.scc_members:
+            v = members[0]
+            self.scc_cyclic.append(1 if len(members) > 1 or v in self.callee_ids_of(v) else 0)
+        self.scc_callees = None
+        self.scc_callers = None
+        self.path_counts = {}
+
+    # condensed call graph: component -> callee/caller components (edges inside a component are dropped)
+    def build_condensed(self):
+        if self.scc_callees is not None:
+            return
+        self.scc_callees = [set() for _ in self.scc_members]
+        self.scc_callers = [set() for _ in self.scc_members]
+        for v in range(len(self.funcs)):
+            cv = self.scc_of[v]
+            for w in self.callee_ids_of(v):
+                cw = self.scc_of[w]
+                if cw != cv:
+                    self.scc_callees[cv].add(cw)
+                    self.scc_callers[cw].add(cv)
+
+    def is_recursive(self, i: int) -> bool:
+        return self.scc_cyclic[self.scc_of[i]] == 1
+
+    # number of call paths from func down to a leaf ("callee", like get_caller_flow)
+    # or up to a root ("caller", like get_callee_flow), counted over the condensed graph without listing them.
+    # a recursion cycle counts as a single node.
+    def count_paths(self, func: str, direction: str) -> int:
+        i = self.func_ids.get(func, None)
+        if i is None:
+            return 0
+        if direction not in self.path_counts:
+            self.build_condensed()
+            comps = len(self.scc_members)
+            counts = [0] * comps
+            if direction == "callee":
+                order = range(comps)    # callees always have smaller component ids
+                edges = self.scc_callees
+            else:
+                order = range(comps - 1, -1, -1)
+                edges = self.scc_callers
+            for comp in order:
+                if len(edges[comp]) == 0:
+                    counts[comp] = 1
+                else:
+                    counts[comp] = sum(counts[nxt] for nxt in edges[comp])
+            self.path_counts[direction] = counts
+        return self.path_counts[direction][self.scc_of[i]]
+
+    # bottom-up summaries over the condensed graph, every component is visited once (callees first)
+    # combine(comp, callee results) -> result of comp (members of comp: scc_members[comp], recursion: scc_cyclic[comp])
+    # returns the result of every component
+    def fold_callees(self, combine) -> list:
+        self.build_condensed()
+        results = []
+        for comp in range(len(self.scc_members)):
+            results.append(combine(comp, [results[callee] for callee in sorted(self.scc_callees[comp])]))
+        return results
+
+    # top-down summaries over the condensed graph, every component is visited once (callers first)
+    # combine(comp, caller results) -> result of comp
+    # returns the result of every component
+    def fold_callers(self, combine) -> list:
+        self.build_condensed()
+        comps = len(self.scc_members)
+        results = [None] * comps
+        for comp in range(comps - 1, -1, -1):
+            results[comp] = combine(comp, [results[caller] for caller in sorted(self.scc_callers[comp])])
+        return results
+
+    # entries: [(slot, func name)], names that are not in the graph are dropped
+    def set_roots(self, entries: list):
+        self.roots = [[slot, self.func_ids[func]] for slot, func in entries if func in self.func_ids]
+
+    # component id -> bitset of the roots (bit r = roots[r]) that can end up calling into it
+    def root_masks(self) -> list:
+        own = {}
+        for r, (slot, i) in enumerate(self.roots):
+            own[self.scc_of[i]] = own.get(self.scc_of[i], 0) | (1 << r)
+
+        def combine(comp: int, caller_masks: list) -> int:
+            mask = own.get(comp, 0)
+            for caller_mask in caller_masks:
+                mask |= caller_mask
+            return mask
+
+        return self.fold_callers(combine)
+
+    # can funcs[a] end up calling funcs[b] (a function always reaches itself)
+    # components below b's one (smaller ids) can not lead to it, the walk does not go there
+    def reaches_id(self, a: int, b: int) -> bool:
+        self.build_condensed()
+        target = self.scc_of[b]
+        start = self.scc_of[a]
+        seen = {start}
+        stack = [start]
+        while len(stack) > 0:
+            comp = stack.pop()
+            if comp == target:
+                return True
+            for callee in self.scc_callees[comp]:
+                if callee >= target and callee not in seen:
+                    seen.add(callee)
+                    stack.append(callee)
+        return False
+
+    # bitset of the components reachable from any of the func ids (down the callee edges, or up the caller edges)
+    def reach_bits(self, ids, edges = None) -> int:
+        self.build_condensed()
+        if edges is None:
+            edges = self.scc_callees
+        bits = 0
+        stack = []
+        for i in ids:
+            comp = self.scc_of[i]
+            if not (bits >> comp) & 1:
+                bits |= 1 << comp
+                stack.append(comp)
+        while len(stack) > 0:
+            for nxt in edges[stack.pop()]:
+                if not (bits >> nxt) & 1:
+                    bits |= 1 << nxt
+                    stack.append(nxt)
+        return bits
+
+    # bitset of the components that can end up calling any of the func ids
+    def reaching_bits(self, ids) -> int:
+        self.build_condensed()
+        return self.reach_bits(ids, self.scc_callers)
+
+    # func ids of a component bitset
+    def bits_to_ids(self, bits: int) -> list:
+        ids = []
+        for comp, bit in enumerate(reversed(bin(bits)[2:])):
+            if bit == "1":
+                ids.extend(self.scc_members[comp])
+        return sorted(ids)
+
+    # name based reachability queries, None if a function is not in the graph
+    def reaches(self, a: str, b: str) -> bool:
+        if a not in self.func_ids or b not in self.func_ids:
+            return None
+        return self.reaches_id(self.func_ids[a], self.func_ids[b])
+
+    # everything called (directly or not) from any of funcs, funcs included
+    def reachable_from(self, funcs: list) -> list:
+        ids = [self.func_ids[func] for func in funcs if func in self.func_ids]
+        return [self.funcs[i] for i in self.bits_to_ids(self.reach_bits(ids))]
+
+    # every function that can end up calling func, func included
+    # (walk up the condensed caller edges: only the components that do reach func are visited)
+    def reaching(self, func: str) -> list:
+        i = self.func_ids.get(func, None)
+        if i is None:
+            return None
+        return [self.funcs[j] for j in self.bits_to_ids(self.reaching_bits([i]))]
+
+    def save(self, path: str):
+        data = {
+            "version": self.version,
+            "funcs": self.funcs,
+            "units": self.units,
+            "globals": self.globals,
+            "callee_offsets": self.callee_offsets,
+            "callee_ids": self.callee_ids,
+            "caller_offsets": self.caller_offsets,
+            "caller_ids": self.caller_ids,
+            "global_offsets": self.global_offsets,
+            "global_ids": self.global_ids,
+            "reader_offsets": self.reader_offsets,
+            "reader_ids": self.reader_ids,
+            "writer_offsets": self.writer_offsets,
+            "writer_ids": self.writer_ids,
+            "scc_of": self.scc_of,
+            "roots": self.roots
+        }
+        tmp_file = path + ".tmp"
+        with open(tmp_file, 'w', encoding="UTF-8") as f:
+            json.dump(data, f, separators=(",", ":"))
+        os.replace(tmp_file, path)
+
+    # returns False if there is no (usable) graph file
+    def load(self, path: str) -> bool:
+        try:
+            with open(path, 'r', encoding="UTF-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if data.get("version", None) != self.version:
+            return False
+        self.funcs = data["funcs"]
+        self.units = data["units"]
+        self.globals = data["globals"]
+        self.callee_offsets = data["callee_offsets"]
+        self.callee_ids = data["callee_ids"]
+        self.caller_offsets = data["caller_offsets"]
+        self.caller_ids = data["caller_ids"]
+        self.global_offsets = data["global_offsets"]
+        self.global_ids = data["global_ids"]
+        self.func_ids = {func: i for i, func in enumerate(self.funcs)}
+        self.global_name_ids = {gvar: i for i, gvar in enumerate(self.globals)}
+        if "reader_offsets" in data:
+            self.reader_offsets = data["reader_offsets"]
+            self.reader_ids = data["reader_ids"]
+            self.writer_offsets = data["writer_offsets"]
+            self.writer_ids = data["writer_ids"]
+        else:
+            self.build_global_index()
+        self.scc_members = []
+        if "scc_of" in data:
+            self.scc_of = data["scc_of"]
+            self.load_scc_info()
+        else:
+            self.condense()
+        self.roots = data.get("roots", [])
+        return True
+
+    def callee_ids_of(self, i: int) -> list:
+        return self.callee_ids[self.callee_offsets[i]:self.callee_offsets[i + 1]]
+
+    def caller_ids_of(self, i: int) -> list:
+        return self.caller_ids[self.caller_offsets[i]:self.caller_offsets[i + 1]]
+
+    def global_ids_of(self, i: int) -> list:
+        return self.global_ids[self.global_offsets[i]:self.global_offsets[i + 1]]
+
+    # name based lookups, None if the function is not in the graph
+    def callees(self, func: str) -> list:
+        i = self.func_ids.get(func, None)
+        if i is None:
+            return None
+        return [self.funcs[c] for c in self.callee_ids_of(i)]
+
+    def callers(self, func: str) -> list:
+        i = self.func_ids.get(func, None)
+        if i is None:
+            return None
+        return [self.funcs[c] for c in self.caller_ids_of(i)]
+
+    def globals_of(self, func: str) -> list:
+        i = self.func_ids.get(func, None)
+        if i is None:
+            return None
+        return [self.globals[g] for g in self.global_ids_of(i)]
+
+    # name based lookups by global, None if the global is not in the graph
+    def readers(self, gvar: str) -> list:
+        g = self.global_name_ids.get(gvar, None)
+        if g is None:
+            return None
+        return [self.funcs[i] for i in self.reader_ids[self.reader_offsets[g]:self.reader_offsets[g + 1]]]
+
+    def writers(self, gvar: str) -> list:
+        g = self.global_name_ids.get(gvar, None)
+        if g is None:
+            return None
+        return [self.funcs[i] for i in self.writer_ids[self.writer_offsets[g]:self.writer_offsets[g + 1]]]
+
+    # old one-file-per-function layout
+    # returns {file path: contents}, funcname_hashgen: CpuRegParser.funcname_hashgen
+    def export_per_file(self, callstack_gen_dir: str, funcname_hashgen) -> dict:
+        outputs = {}
+        for i, func in enumerate(self.funcs):
+            new_file = os.path.join(callstack_gen_dir, funcname_hashgen(func))
+            outputs[new_file] = "".join(self.funcs[c] + "\n" for c in self.callee_ids_of(i))
+            new_file = os.path.join(callstack_gen_dir, "globals." + funcname_hashgen(func))
+            outputs[new_file] = "".join(self.globals[g] + "\n" for g in self.global_ids_of(i))
+        return outputs
+
+    def import_per_file(self, callstack_gen_dir: str) -> bool:
+        callstack_gen = {}
+        func_globals = {}
+        if not os.path.isdir(callstack_gen_dir):
+            return False
+        for file in os.listdir(callstack_gen_dir):
+            if not file.endswith(".txt"):
+                continue
+            with open(os.path.join(callstack_gen_dir, file), 'r', encoding="UTF-8") as f:
+                entries = {line.strip() for line in f if line.strip() != ""}
+            if file.startswith("globals."):
+                func_globals[file.split(".")[1]] = entries
+            else:
+                callstack_gen[file.split(".")[0]] = entries
+        if len(callstack_gen) == 0:
+            return False
+        self.build(callstack_gen, func_globals, {})
+        return True
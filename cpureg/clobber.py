@@ -0,0 +1,91 @@
+from cpureg.asm_parser import CpuRegAsmEngine
+from cpureg.isa_db import CpuRegIsaDb
+
+# CpuRegClobbers
+# which registers a function may leave modified when it returns, directly or through its callees.
+#
+# CpuRegClobbers(callgraph, arch).analyze(asm_bodies: {func: asm text})
+# 1. per function, one pass over its lines:
+#    writes = destination registers of every instruction (operand positions from CpuRegIsaDb, bl/jarl write the link register)
+#    saved  = registers it pushes and pops again (CpuRegAsmEngine), whatever happens to them in between is undone
+#    c functions only count their inline asm
+# 2. clobbers(f) = (writes(f) | clobbers of every callee) & ~saved(f), all of them register bitmasks
+#    computed bottom-up over the condensed call graph (CpuRegCallGraph.fold_callees), so every function is done once.
+#    members of a recursion cycle depend on each other: they are iterated until nothing changes (the sets only grow)
+# 3. unsaved(f) = clobbers(f) without the stack pointer (and pc, or the rh850 zero register r0): what an entry point (isr, context switch)
+#    changes without restoring it. why(f, reg) tells which callee it comes from.
+
+class CpuRegClobbers:
+    def __init__(self, callgraph, arch: str):
+        self.callgraph = callgraph
+        self.engine = CpuRegAsmEngine(arch)
+        self.isa_db = CpuRegIsaDb(self.engine.arch)
+        self.regfile = self.isa_db.regfile
+        self.ignored = self.regfile.mask(["sp", "pc"]) if self.engine.arch == "armv7m" else self.regfile.mask(["sp", "r0"])
+        self.writes = []    # func id -> registers written directly
+        self.saved = []     # func id -> registers pushed and popped
+        self.clobbers = []  # func id -> registers modified on return (callees included)
+
+    def summarize_function(self, body: str) -> tuple:
+        writes = 0
+        pushed = 0
+        popped = 0
+        for line in body.splitlines():
+            sign, mask = self.engine.decode_line(line)
+            if sign > 0:
+                pushed |= mask
+                continue
+            if sign < 0:
+                popped |= mask  # a pop restores, it does not clobber
+                continue
+            opc, reads, written = self.isa_db.decode(line)
+            writes |= written
+        return writes, pushed & popped
+
+    def analyze(self, asm_bodies: dict):
+        self.writes = []
+        self.saved = []
+        for func in self.callgraph.funcs:
+            writes, saved = self.summarize_function(asm_bodies.get(func, ""))
+            self.writes.append(writes)
+            self.saved.append(saved)
+        self.clobbers = [0] * len(self.callgraph.funcs)
+
+        def combine(comp: int, callee_results: list):
+            members = self.callgraph.scc_members[comp]
+            changed = True
+            while changed:
+                changed = False
+                for i in members:
+                    clobbers = self.writes[i]
+                    for callee in self.callgraph.callee_ids_of(i):
+                        clobbers |= self.clobbers[callee]
+                    clobbers &= ~self.saved[i]
+                    if clobbers != self.clobbers[i]:
+                        self.clobbers[i] = clobbers
+                        changed = self.callgraph.scc_cyclic[comp] == 1
+            return None
+
+        self.callgraph.fold_callees(combine)
+
+    def unsaved(self, func: str) -> int:
+        return self.clobbers[self.callgraph.func_ids[func]] & ~self.ignored
+
+    # where a clobbered register comes from: "" (written by func itself) or a callee
+    def why(self, func: str, reg: int) -> str:
+        i = self.callgraph.func_ids[func]
+        if self.writes[i] >> reg & 1:
+            return ""
+        for callee in self.callgraph.callee_ids_of(i):
+            if self.clobbers[callee] >> reg & 1:
+                return self.callgraph.funcs[callee]
+        return ""
+
+    # [(entry func, unsaved mask)] for every component nobody else calls (a cycle is named by its first member)
+    def report(self) -> list:
+        entries = []
+        for comp, members in enumerate(self.callgraph.scc_members):
+            if len(self.callgraph.scc_callers[comp]) == 0:
+                func = self.callgraph.funcs[members[0]]
+                entries.append((func, self.unsaved(func)))
+        return entries
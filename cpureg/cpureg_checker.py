@@ -1,7 +1,8 @@
 import sys
+import os
 import subprocess
 import argparse
-from cpureg.cpureg_parser import CpuRegParser
+from cpureg.cpureg_parser import CpuRegParser, CpuRegGenerateAborted
 
 class CpuRegApp:
     def __init__(self):
@@ -27,9 +28,38 @@ class CpuRegApp:
         group.add_argument("-p", "--process", action="store_true", help="process and spit out rights & wrongs on your code")
 
         arg_parser.add_argument("-I", "--include", action="append", metavar="INCLUDE_PATH", type=str, help="include path for the generate option")
+        arg_parser.add_argument("--clean", action="store_true", help="wipe the workspace and generate everything from scratch")
+        arg_parser.add_argument("--keep-intermediates", action="store_true", help="write the preprocessed sources to parsed_gen (they are kept in memory otherwise)")
+        arg_parser.add_argument("--cache-dir", type=str, default="", help="preprocessing cache shared by all workspaces (default: $CPUREG_CACHE_DIR or ~/.cache/cpureg)")
+        arg_parser.add_argument("--cache-size", type=int, default=1024, metavar="MB", help="size limit of the preprocessing cache (default: 1024MB)")
+        arg_parser.add_argument("--no-cache", action="store_true", help="do not use the preprocessing cache")
+        arg_parser.add_argument("--preprocessor", type=str, choices=["gcc", "builtin"], default="gcc", help="gcc -E per source, or the builtin preprocessor (in-process, every header is parsed once per worker)")
+        arg_parser.add_argument("--gcc-jobs", type=int, default=0, metavar="N", help="number of gcc processes running at once (default: same as --jobs)")
+        arg_parser.add_argument("--gcc-timeout", type=float, default=120, metavar="SEC", help="kill gcc after SEC seconds on one source (0: no limit, default: 120)")
+        arg_parser.add_argument("--gcc-retries", type=int, default=1, metavar="N", help="run gcc again N times after a timeout or a crash (default: 1)")
+        arg_parser.add_argument("--gcc-errors", type=str, choices=["keep", "skip", "abort"], default="keep", help="gcc exited with an error: parse what it printed anyway, skip the source, or abort the generate (timeouts are skipped unless abort)")
+        arg_parser.add_argument("--check-preprocessor", action="store_true", help="with -g: compare the builtin preprocessor against gcc -E on every source instead of generating")
+        arg_parser.add_argument("--callscan", type=str, choices=["tokens", "regex"], default="tokens", help="call detection for asm bodies: token set lookup or one compiled alternation of the function names")
+        arg_parser.add_argument("--export-callstack-files", action="store_true", help="also write one callstack_gen file per function (old layout) next to callgraph.json")
+        arg_parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1, metavar="N", help="number of parser processes for the generate option (default: number of cores)")
 
         group.add_argument("-c", "--caller", type=str, help="print caller stack of function (test)")
         group.add_argument("-C", "--callee", type=str, help="print caller stack before reaching function (test)")
+        group.add_argument("-w", "--who-touches", type=str, metavar="GLOBAL", help="print the functions reading/writing a global variable")
+        group.add_argument("--cfg", type=str, metavar="FUNC", help="print the basic blocks of an asm function")
+        group.add_argument("--clobbers", type=str, nargs="?", const="", metavar="FUNC", help="print the registers every entry point (or FUNC, with where they come from) modifies without saving them")
+        group.add_argument("--vector-table", action="store_true", help="print the symbol assigned to the vector table register (VTOR/SCBP) and where")
+        group.add_argument("--roots", action="store_true", help="print the vector table handlers with what they reach, their stack depth and the globals they share")
+        group.add_argument("--stack-usage", action="store_true", help="print the worst case stack depth of every entry point, deepest first")
+        group.add_argument("--reaches", type=str, nargs=2, metavar=("FROM", "TO"), help="check if FROM can end up calling TO")
+        group.add_argument("--reachable-from", type=str, nargs="+", metavar="FUNC", help="print every function that can be called from any of FUNC")
+        group.add_argument("--reaching", type=str, metavar="FUNC", help="print every function that can end up calling FUNC")
+        arg_parser.add_argument("--count", action="store_true", help="with -c/-C: only print the number of paths (recursion cycles count as one node)")
+        arg_parser.add_argument("--max-depth", type=int, default=0, metavar="N", help="with -c/-C: stop following a path after N functions (0: no limit)")
+        arg_parser.add_argument("--max-paths", type=int, default=0, metavar="N", help="with -c/-C: stop after N paths (0: no limit)")
+        arg_parser.add_argument("--timeout", type=float, default=0, metavar="SEC", help="with -c/-C: give up after SEC seconds (0: no limit)")
+        arg_parser.add_argument("--filter-through", type=str, default="", metavar="FUNC", help="with -c/-C: only print the paths that go through FUNC")
+        arg_parser.add_argument("--format", type=str, choices=["text", "jsonl"], default="text", help="with -c/-C: output format (jsonl: one {\"kind\", \"path\"} object per line)")
         arg_parser.add_argument("-s", "--sourceview", action="store_true", help="launch the source viewer GUI")
         arg_parser.add_argument("-t", "--test", action="store_true", help="testmode")
 
@@ -41,24 +71,91 @@ class CpuRegApp:
             if len(incpaths) == 0:
                 arg_parser.error("generate requires at least one include path")
 
+            if args.jobs < 1:
+                arg_parser.error("jobs must be at least 1")
+            if args.gcc_jobs < 0 or args.gcc_timeout < 0 or args.gcc_retries < 0:
+                arg_parser.error("gcc limits cannot be negative")
+
+            self.parser.jobs = args.jobs
+            self.parser.keep_intermediates = args.keep_intermediates
+            self.parser.callscan_mode = args.callscan
+            self.parser.export_callstack_files = args.export_callstack_files
+            self.parser.preprocessor = args.preprocessor
+            self.parser.gcc_jobs = args.gcc_jobs
+            self.parser.gcc_timeout = args.gcc_timeout
+            self.parser.gcc_retries = args.gcc_retries
+            self.parser.gcc_on_error = args.gcc_errors
+            if args.cache_dir != "":
+                self.parser.cache.cache_dir = args.cache_dir
+            self.parser.cache.max_size = args.cache_size * 1024 * 1024
+            self.parser.cache.enabled = not args.no_cache
             srcpaths = self.parser.parse_per_target_platform(target_platform, incpaths)
-            self.parser.parse_workspace_cleanup()
-            self.parser.parse_functions(srcpaths, incpaths)
+            if args.check_preprocessor:
+                sys.exit(1 if self.parser.parse_check_preprocessor(srcpaths, incpaths) > 0 else 0)
+            if args.clean:
+                self.parser.parse_workspace_cleanup()
+            else:
+                # only the sources that changed since the last generate are parsed again
+                self.parser.parse_workspace_init()
+            try:
+                self.parser.parse_functions(srcpaths, incpaths)
+            except CpuRegGenerateAborted as e:
+                print(str(e) + ", generate aborted")
+                sys.exit(1)
 
         elif args.process:
-            pass
+            sys.exit(1 if self.parser.parse_process() > 0 else 0)
 
-        elif args.caller:
-            self.parser.get_caller_flow("", args.caller)
-            pass
-        elif args.callee:
-            self.parser.get_callee_flow(args.callee)
-            pass
+        elif args.caller or args.callee:
+            if args.max_depth < 0 or args.max_paths < 0 or args.timeout < 0:
+                arg_parser.error("path limits cannot be negative")
+            self.parser.flow_max_depth = args.max_depth
+            self.parser.flow_max_paths = args.max_paths
+            self.parser.flow_timeout = args.timeout
+            self.parser.flow_through = args.filter_through
+            self.parser.flow_format = args.format
+            if args.caller:
+                if args.count:
+                    print(self.parser.parse_load_callgraph().count_paths(args.caller, "callee"))
+                else:
+                    self.parser.get_caller_flow("", args.caller)
+            else:
+                if args.count:
+                    print(self.parser.parse_load_callgraph().count_paths(args.callee, "caller"))
+                else:
+                    self.parser.get_callee_flow(args.callee)
+        elif args.who_touches:
+            self.parser.get_global_users(args.who_touches)
+        elif args.cfg:
+            self.parser.get_cfg(args.cfg)
+        elif args.clobbers is not None:
+            self.parser.get_clobbers(args.clobbers)
+        elif args.vector_table:
+            sys.exit(0 if self.parser.get_vector_table() != "" else 1)
+        elif args.roots:
+            self.parser.get_roots()
+        elif args.stack_usage:
+            self.parser.get_stack_usage()
+        elif args.reaches:
+            reached = self.parser.parse_load_callgraph().reaches(args.reaches[0], args.reaches[1])
+            if reached is None:
+                print("incomplete gen")
+                sys.exit(2)
+            print(args.reaches[0] + (" reaches " if reached else " does not reach ") + args.reaches[1])
+            sys.exit(0 if reached else 1)
+        elif args.reachable_from:
+            for func in self.parser.parse_load_callgraph().reachable_from(args.reachable_from):
+                print(func)
+        elif args.reaching:
+            funcs = self.parser.parse_load_callgraph().reaching(args.reaching)
+            if funcs is None:
+                print("incomplete gen")
+                sys.exit(2)
+            for func in funcs:
+                print(func)
         elif args.test:
-            from cpureg.asm_parser import CpuRegAsmParser
-            testme = CpuRegAsmParser()
-            print(testme.parse_arch_vectors("cpureg_workspace/parsed_gen", "rh850"))
-            pass
+            # the preprocessed sources are not in parsed_gen anymore (streamed), the symbol index has the vectors
+            print(self.parser.get_vector_table())
 
         # elif args.sourceview:
         else:
@@ -2,10 +2,41 @@ import sys
 import os
 import shutil
 import concurrent.futures
+import asyncio
 import subprocess
 import re
 import hashlib
+import json
+import time
 from cpureg.asm_parser import CpuRegAsmParser
+from cpureg.c_parser import CpuRegCParser
+from cpureg.c_preprocessor import CpuRegPreprocessor
+from cpureg.gcc_scheduler import CpuRegGccScheduler
+from cpureg.preprocess_cache import CpuRegCache
+from cpureg.callgraph import CpuRegCallGraph
+from cpureg.asm_cfg import CpuRegAsmCfg
+from cpureg.regfile import CpuRegRegFile
+from cpureg.pushpop_checker import CpuRegPushPopChecker
+from cpureg.stack_usage import CpuRegStackUsage
+from cpureg.clobber import CpuRegClobbers
+from cpureg.symbol_index import CpuRegSymbolIndex
+from cpureg.roots import CpuRegRoots
+from cpureg.workspace_manifest import CpuRegManifest
+
+# process pool workers
+# every worker process gets its own copy of the parser once (initializer), instead of pickling it for every file
+_worker_parser = None
+
+def _worker_init(parser):
+    global _worker_parser
+    _worker_parser = parser
+
+def _worker_run(method_name: str, *args) -> tuple:
+    return getattr(_worker_parser, method_name)(*args)
+
+# gcc failed on a source with --gcc-errors abort (the caller decides how to go down: cli exits, gui shows it)
+class CpuRegGenerateAborted(Exception):
+    pass
 
 class CpuRegParser:
     
@@ -20,6 +51,26 @@ class CpuRegParser:
         self.pf_workspace_dir = os.path.join(self.mw_workspace_dir, "parsed_gen")
         self.callstack_gen_dir = os.path.join(self.mw_workspace_dir, "callstack_gen")
         self.proc_funcbody_dir = os.path.join(self.mw_workspace_dir, "proc_funcbody")
+        self.srcindex_dir = os.path.join(self.mw_workspace_dir, "src_index")
+        self.manifest_file = os.path.join(self.mw_workspace_dir, "manifest.json")
+        self.callgraph_file = os.path.join(self.mw_workspace_dir, "callgraph.json")
+        self.callgraph = None
+        self.cfg_file = os.path.join(self.mw_workspace_dir, "cfg.json")
+        self.inlineasm_file = os.path.join(self.mw_workspace_dir, "inlineasm.json")
+        self.symbols_file = os.path.join(self.mw_workspace_dir, "symbols.json")
+        self.symbol_sources = {}    # src name -> special register assignments & data tables found while generating
+        self.symbol_index = None
+        self.cfg = None
+        self.export_callstack_files = False  # also write the old callstack_gen/<func>.<sha1>.txt layout
+        self.manifest = CpuRegManifest(self.manifest_file, self.srcindex_dir)
+        self.c_parser = CpuRegCParser()
+        self.cache = CpuRegCache()  # preprocessing cache shared across workspaces (lives outside the workspace)
+        self.cache_gcc_version = ""
+        self.parser_version = 6     # bump when the parsers change what they extract (invalidates the cache)
+        self.preprocessor = "gcc"   # or "builtin" (CpuRegPreprocessor, in-process)
+        self.builtin_pp = None      # created lazily in every worker, so the header memo is per process
+        self.builtin_predefined = []    # gcc -dM -E output, the builtin preprocessor starts from the same macros
+        self.builtin_sysincpaths = []   # gcc's <...> search list
 
         # asm extensions
         self.asm_ext = []
@@ -27,24 +78,20 @@ class CpuRegParser:
         # user args
         self.supported_platforms = ["armv7m", "rh850"]
         self.target_platform = ""
-
-        # patterns for src comments
-        self.comment_pattern_1 = re.compile(r'^\s*/\*')
-        self.comment_pattern_2 = re.compile(r'\*/\s*$')
-        self.comment_pattern_w = re.compile(r'/\*.*?\*/')
-        self.comment_pattern_w2 = re.compile(r'(.*)/\*')
-
-        self.not_in_line = re.compile(r'(\w+;|^extern|\s+while|\s+for|\s+if|\s+switch)')
-        self.pre_func_pattern = re.compile(r'\)\s*{\s*')
-        self.func_pattern = re.compile(r'\s*(\w+)\s*$')
-
-        self.oneliner_func_pattern = re.compile(r'\)\s*{.*}\s*')
+        self.jobs = os.cpu_count() or 1  # number of worker processes for parsing
+        self.keep_intermediates = False     # write the preprocessed sources to parsed_gen (for debugging)
+        self.gcc_jobs = 0           # gcc processes running at once (0: same as jobs)
+        self.gcc_timeout = 120      # seconds per source (0: no limit)
+        self.gcc_retries = 1        # tries again after a timeout or a crash
+        self.gcc_on_error = "keep"  # gcc exited with an error: "keep" its output, "skip" the source or "abort"
+
+        # c sources are tokenized by CpuRegCParser (comments, functions and global declarations)
         self.stubinfo_pattern = re.compile(r'.*\\(\w+)\.')
 
         # patterns for asm comments
         self.asm_comment_pattern_1_start = re.compile(r"(.*?)/\*")
         self.asm_comment_pattern_1_end = re.compile(r"\*/(.*?)")
-        self.asm_comment_pattern_2 = re.compile(r"(.*?)\s*(?:-|\/\/|;)")
+        self.asm_comment_pattern_2 = re.compile(r"(.*?)\s*(?:--|\/\/|;)")  # a single '-' is a register range (r4-r7)
         # if none of the above match, we have a clean line
         # /* hello:
         # --_hello:
@@ -87,27 +134,55 @@ class CpuRegParser:
         # (TODO: to be taken care of by branch ident)
         # we can care about the order thing later.(TODO: further parsing to individual regs maybe)
 
-        self.asm_regname_intrinsics = {"sp": "r3", "lr": "r31"}
-        self.rh850_regname_intrinsics = {"sp": "r3", "lr": "r31"}
-        self.armv7m_regname_intrinsics = {"sp": "r13", "lr": "r14", "pc": "r15"}
+        # register names <-> indices (register sets are bitmasks), the aliases live in CpuRegRegFile.arch_intrinsics
+        self.regfile = CpuRegRegFile("rh850")
+        self.asm_regname_intrinsics = CpuRegRegFile.arch_intrinsics["rh850"]
+        self.rh850_regname_intrinsics = CpuRegRegFile.arch_intrinsics["rh850"]
+        self.armv7m_regname_intrinsics = CpuRegRegFile.arch_intrinsics["armv7m"]
 
         # we capture the branch op with the obj name. if obj name does not exist, we can find it in previous ops...
         self.asm_branch_pattern = re.compile(r"^jr\s+(\w+)|^jmp\s+(\w+)|^jarl\s+(\w+)|^b\w+\s+(\w+)")
         self.rh850_branch_pattern = re.compile(r"^jr\s+(\w+)|^jmp\s+(\w+)|^jarl\s+(\w+)|^b\w+\s+(\w+)")  # in rh850, theres no b ~ op
         self.armv7m_branch_pattern = re.compile(r"^b\w*\s+(\w+)")    # armv7m branch opnames always start with b
+        # branch mnemonics for the cfg (CpuRegAsmCfg), exact names (the .w/.n width is stripped before the lookup):
+        # mnemonic -> (kind, operand index of the target, -1 = last operand)
+        # calls come back to the next instruction, jumps never do, conditional ones fall through otherwise.
+        # anything that is not in here does not branch (bic, bfi, bkpt, bsh, bsw, bins, ...). returns end the function.
+        armv7m_conds = ("eq", "ne", "cs", "hs", "cc", "lo", "mi", "pl", "vs", "vc", "hi", "ls", "ge", "lt", "gt", "le")
+        self.rh850_branch_ops = {"br": ("jump", 0), "jr": ("jump", 0), "jmp": ("jump", 0), "jarl": ("call", 0), "loop": ("cond", -1)}
+        self.rh850_branch_ops.update({op: ("cond", 0) for op in ("bc", "be", "bge", "bgt", "bh", "bl", "ble", "blt", "bn", "bnc", "bne",
+                                                                  "bnh", "bnl", "bnv", "bnz", "bp", "bsa", "bv", "bz")})
+        self.armv7m_branch_ops = {"b": ("jump", 0), "bx": ("jump", 0), "bl": ("call", 0), "blx": ("call", 0),
+                                  "cbz": ("cond", -1), "cbnz": ("cond", -1)}
+        self.armv7m_branch_ops.update({"b" + cond: ("cond", 0) for cond in armv7m_conds})
+        self.asm_branch_ops = self.rh850_branch_ops
+        self.asm_return_pattern = re.compile(r"^jmp\s+\[(?:lp|r31)\]|^dispose\s+.*\[(?:lp|r31)\]")
+        self.rh850_return_pattern = re.compile(r"^jmp\s+\[(?:lp|r31)\]|^dispose\s+.*\[(?:lp|r31)\]")
+        self.armv7m_return_pattern = re.compile(r"^bx\s+lr\b|^pop\s*\{[^}]*\bpc\b|^ldm\w*\s+sp!\s*,\s*\{[^}]*\bpc\b")
         # this is to identify object address that is being passed to previous ops(mov), or in the branch op.
         # we need to identify this to figure out if its actually branching into a new function or not.
         # any code block that has a object name(blah:~) is considered a separate function.
         self.asm_genericop_pattern = re.compile(r"^\s*\w+\s+(.*)")
 
+        # call detection: every body is split into tokens once, the tokens are looked up in the function set
+        # (regex mode: asm bodies are scanned with one compiled alternation of the function names instead)
+        self.callscan_mode = "tokens"
+        self.call_token_pattern = re.compile(r"[a-zA-Z0-9_]+")
+        self.call_underscore_pattern = re.compile(r"(?<![a-zA-Z0-9_])_+(?![a-zA-Z0-9_])")
+
         # remove preprocessed garbage texts
         # preprocess_garbage_pattern = re.compile(r"^# \d+ \"(?!.*\.h\").*")
+        # but keep the file names from the linemarkers -> those are the headers gcc actually pulled in
+        self.linemarker_pattern = re.compile(r'^#\s*\d+\s+"(.*?)"')
 
         # capture global variables
-        self.global_var_pattern = re.compile(r"(\w+)\s*(?=\[|\s*=|;).*")
-        self.global_var_dontuse_pattern = re.compile(r"typedef\s*|enum\s*|struct\s*")
-        self.global_var_use_pattern = re.compile(r"(\w+)") # pretty bad but it works for now
-        self.global_var_use_asm_pattern = re.compile(r"^\s*\w+\s+(.*),")
+        # c: every identifier of the body in one pass, flagged as written if it is assigned, incremented or decremented
+        # (a.b / a->b field names are not identifiers of their own)
+        self.global_var_use_pattern = re.compile(r"(?P<pre>\+\+|--)?\s*(?<!\.)(?<!->)\b(?P<name>[A-Za-z_]\w*)"
+                                                 r"(?=(?P<post>(?:\s*(?:\[[^\]\n]*\]|\.\s*\w+|->\s*\w+))*\s*(?:\+\+|--|(?:<<|>>|[-+*/%&|^])?=(?!=))))?")
+        # asm: operands of every instruction, written if it is a store
+        self.global_var_use_asm_pattern = re.compile(r"^\s*([\w.]+)\s+(.*)", re.M)
+        self.global_var_write_asm_ops = ("st", "sst")
         self.local_var_pattern = re.compile(r"\w+\s+(\w+)\s*(?=\[|\s*=|;).*")
         self.param_var_pattern = re.compile(r".*\s+(\w+)")
 
@@ -117,383 +192,619 @@ class CpuRegParser:
         self.destructive_only = 0
         self.normality_count = 0 # doomed function if set 1
 
+        # limits for the caller/callee flow (0 = no limit)
+        self.flow_max_depth = 0
+        self.flow_max_paths = 0
+        self.flow_timeout = 0
+        self.flow_through = ""
+        self.flow_format = "text"   # or "jsonl"
+
     def srcpath_isnotc(self, srcpath: str) -> bool:
         if not srcpath.endswith(".c") and not srcpath.endswith(".h"):
             return True
         return False
 
-    # get caller flow
-    def get_caller_flow(self, calling_path: str, func: str):
-        if self.listup == 1:
-            self.listup_set.add(func)
-
-        file_to_open = os.path.join(self.callstack_gen_dir, self.funcname_hashgen(func))
+    # call graph of the workspace (loaded once)
+    def parse_load_callgraph(self) -> CpuRegCallGraph:
+        if self.callgraph is None:
+            self.callgraph = CpuRegCallGraph()
+            if not self.callgraph.load(self.callgraph_file):
+                # workspace generated before callgraph.json existed
+                self.callgraph.import_per_file(self.callstack_gen_dir)
+        return self.callgraph
+
+    # target platform of the last generate (recorded per source in the manifest), "" if there is none
+    def parse_workspace_platform(self) -> str:
+        self.manifest.load()
+        for source in self.manifest.sources.values():
+            platform = source.get("flags", {}).get("platform", "")
+            if platform != "":
+                return platform
+        return ""
+
+    # inline asm blocks of the c functions, {func: [block, ...]} (None if the workspace predates inlineasm.json)
+    def parse_load_inlineasm(self) -> dict:
         try:
-            with open(file_to_open, 'r', encoding="UTF-8") as f:
-                lines = f.readlines()
-                loc = len(lines)
-
-                if loc > 0:
-                    for i in range(0, loc):
-                        next_calling_path = calling_path + "->" + func
-                        # check for potential loop before continuing
-                        loop_dict = {}
-                        for item in next_calling_path.split("->"):
-                            if loop_dict.get(item, None) is not None:
-                                # dead end
-                                self.bad_path_list.add(item)
-                                if self.listup != 1:
-                                    print("looping " + next_calling_path)
-                                return
-                            else:
-                                loop_dict[item] = 1
-                        # continue to the next round
-                        next_func = lines[i].strip()
-                        self.get_caller_flow(next_calling_path, next_func)
-
-                else:
-                    # dead end... finish here
-                    if self.listup != 1:
-                        bad_path_detected = 0
-                        for item in (calling_path + "->" + func).split("->")[1:-1]:
-                            if item in self.bad_path_list:
-                                bad_path_detected = 1
-                                break
-                        if bad_path_detected == 0:
-                            if self.destructive_only == 0:
-                                print(calling_path + "->" + func)
-                                self.normality_count += 1
-                        else:
-                            print("bad " + calling_path + "->" + func)
-                    return
-        except:
-            if self.listup != 1:
-                bad_path_detected = 0
-                for item in (calling_path + "->" + func).split("->")[1:-1]:
-                    if item in self.bad_path_list:
-                        bad_path_detected = 1
-                        break
-                if bad_path_detected == 0:
-                    if self.destructive_only == 0:
-                        print(calling_path + "->" + func)
-                        self.normality_count += 1
-                else:
-                    print("bad " + calling_path + "->" + func)
-                print("incomplete gen")
+            with open(self.inlineasm_file, 'r', encoding = "UTF-8") as f:
+                return json.load(f)
+        except OSError:
+            return None
+
+    # the assembly of every function in the call graph: the body of asm functions, the inline asm of c functions
+    def parse_load_asm_bodies(self) -> dict:
+        callgraph = self.parse_load_callgraph()
+        inline_asm = self.parse_load_inlineasm()
+        asm_parser = CpuRegAsmParser()
+        asm_bodies = {}
+        for func, unit in zip(callgraph.funcs, callgraph.units):
+            if inline_asm is not None and not self.srcpath_isnotc(unit):
+                asm_bodies[func] = "\n".join(inline_asm.get(func, []))
+                continue
+            body_file = os.path.join(self.proc_funcbody_dir, unit + "." + self.funcname_hashgen(func))
+            try:
+                with open(body_file, 'r', encoding = "UTF-8") as f:
+                    body = f.read()
+            except OSError:
+                continue
+            if self.srcpath_isnotc(unit):
+                asm_bodies[func] = body
+            else:
+                asm_bodies[func] = "\n".join(asm_parser.parse_functions_c_inlineasm_to_asm(body))
+        return asm_bodies
+
+    # what every whole program analysis starts from: (platform, callgraph, asm_bodies) of the last generate,
+    # with the per platform patterns set up. None (and says so) if nothing was generated yet.
+    # asm_bodies is only loaded when asked for ({} otherwise)
+    def parse_load_workspace(self, bodies: bool = True):
+        platform = self.parse_workspace_platform()
+        if platform == "":
+            print("nothing generated yet (run -g first)")
+            return None
+        self.parse_per_target_platform(platform, [])
+        callgraph = self.parse_load_callgraph()
+        asm_bodies = self.parse_load_asm_bodies() if bodies else {}
+        return platform, callgraph, asm_bodies
+
+    # --process: whole program checks over the generated workspace
+    # returns the number of problems found
+    def parse_process(self) -> int:
+        workspace = self.parse_load_workspace()
+        if workspace is None:
+            return 1
+        platform, callgraph, asm_bodies = workspace
+
+        checker = CpuRegPushPopChecker(callgraph, platform)
+        problems = checker.check(asm_bodies)
+        print("push/pop balance (" + platform + "): " + str(len(callgraph.funcs)) + " functions, " + str(len(checker.entry_components())) + " entry points")
+        for func, kind, delta, origins in problems:
+            regs = ", ".join(reg + " " + ("+" if d > 0 else "") + str(d) for reg, d in delta.items())
+            if kind == "recursion":
+                print("recursion through " + func + " does not balance: " + regs + " (" + ", ".join(origins) + ")")
+            else:
+                print(func + " does not balance: " + regs + " (from " + ", ".join(origins) + ")")
+        if len(problems) == 0:
+            print("every entry point balances")
+        return len(problems)
+
+    # ranked worst case stack depth of every entry point
+    def get_stack_usage(self):
+        workspace = self.parse_load_workspace()
+        if workspace is None:
+            return
+        platform, callgraph, asm_bodies = workspace
+        usage = CpuRegStackUsage(callgraph, platform)
+        usage.analyze(asm_bodies)
+        print("worst case stack depth (" + platform + ", c functions only count their inline asm):")
+        for func, depth, path in usage.report():
+            print(("unbounded" if depth is None else str(depth) + " bytes") + "\t" + func + "\t" + " -> ".join(path))
+
+    # registers the entry points (or func) leave modified without saving them
+    def get_clobbers(self, func: str = ""):
+        workspace = self.parse_load_workspace()
+        if workspace is None:
+            return
+        platform, callgraph, asm_bodies = workspace
+        if func != "" and func not in callgraph.func_ids:
+            print("incomplete gen")
             return
+        clobbers = CpuRegClobbers(callgraph, platform)
+        clobbers.analyze(asm_bodies)
+        regfile = clobbers.regfile
+        if func == "":
+            print("registers clobbered without being saved (" + platform + ", c functions only count their inline asm):")
+            for entry, mask in clobbers.report():
+                if mask != 0:
+                    print(entry + "\t" + ", ".join(regfile.names(mask)))
+            return
+        i = callgraph.func_ids[func]
+        print("writes: " + ", ".join(regfile.names(clobbers.writes[i])))
+        print("saved: " + ", ".join(regfile.names(clobbers.saved[i])))
+        print("clobbers:")
+        for reg in regfile.indices(clobbers.unsaved(func)):
+            source = clobbers.why(func, reg)
+            print("    " + regfile.name(reg) + ("" if source == "" else "\t(from " + source + ")"))
+
+    # symbol assigned to the vector table register (VTOR / SCBP), "" if none
+    # a lookup in symbols.json, the generated files are only scanned again for workspaces that predate it
+    # (and only if they kept their intermediates, parsed_gen is empty otherwise)
+    def get_vector_table(self) -> str:
+        workspace = self.parse_load_workspace(bodies = False)
+        if workspace is None:
+            return ""
+        platform, callgraph, asm_bodies = workspace
+        reg = CpuRegSymbolIndex.arch_vector_regs[platform]
+        symbol_index = CpuRegSymbolIndex(platform)
+        if not symbol_index.load(self.symbols_file):
+            return CpuRegAsmParser().parse_arch_vectors(self.pf_workspace_dir, platform, self.jobs)
+        for symbol, src, where, line in symbol_index.sysregs.get(reg, []):
+            print(reg + " = " + symbol + " (" + src + ", line " + str(line) + " of " + where + ")")
+        return symbol_index.lookup(reg)
+
+    # every root of the call graph (vector table handlers) with what it reaches, its stack depth,
+    # and the globals more than one root touches, all of it in one pass per analysis
+    def get_roots(self):
+        workspace = self.parse_load_workspace()
+        if workspace is None:
+            return
+        platform, callgraph, asm_bodies = workspace
+        if len(callgraph.roots) == 0:
+            print("no vector table found (no roots)")
+            return
+        roots = CpuRegRoots(callgraph, platform)
+        roots.analyze(asm_bodies)
+        print("roots (" + platform + "): slot, handler, reachable functions, worst case stack depth")
+        for (slot, i), reachable, depth in zip(callgraph.roots, roots.reachable, roots.depths):
+            print(str(slot) + "\t" + callgraph.funcs[i] + "\t" + str(reachable) + "\t" + ("unbounded" if depth is None else str(depth) + " bytes"))
+        print("globals shared between roots:")
+        for gvar, users, writers in roots.shared:
+            print(gvar + "\t" + ", ".join(users) + ("\t(written by " + ", ".join(writers) + ")" if len(writers) > 0 else ""))
+
+    def parse_load_cfg(self) -> CpuRegAsmCfg:
+        if self.cfg is None:
+            self.cfg = CpuRegAsmCfg()
+            self.cfg.load(self.cfg_file)
+        return self.cfg
+
+    # print the basic blocks of an asm function with their instructions and edges
+    def get_cfg(self, func: str):
+        cfg = self.parse_load_cfg()
+        blocks = cfg.blocks(func)
+        if len(blocks) == 0:
+            print(func + " is not an asm function (or incomplete gen)")
+            return
+        callgraph = self.parse_load_callgraph()
+        body_file = os.path.join(self.proc_funcbody_dir, callgraph.units[callgraph.func_ids[func]] + "." + self.funcname_hashgen(func))
+        with open(body_file, 'r', encoding = "UTF-8") as f:
+            lines = f.read().splitlines()
+        for b, (start, end) in enumerate(blocks):
+            edges = [str(succ) for succ in cfg.successors(func, b)] + [target + " (" + kind + ")" for target, kind in cfg.targets(func, b)]
+            if cfg.is_exit(func, b):
+                edges.append("exit")
+            print("block " + str(b) + " [" + str(start) + ", " + str(end) + ") -> " + ", ".join(edges))
+            for line in lines[start:end]:
+                print("    " + line)
+
+    # walk every call path starting from func, lazily
+    # direction "callee": follow the callees (get_caller_flow, "->")
+    # direction "caller": follow the callers (get_callee_flow, "<-")
+    # yields (kind, [func names from func onwards]), kind is one of
+    #   "path"       finished path (reached a function without callees/callers)
+    #   "bad"        finished path that went through a recursive function
+    #   "looping"    ran back into a function already on the path (once per recursion cycle)
+    #   "cut"        stopped at max_depth functions, the last one has more callees/callers
+    #   "incomplete" func is not in the call graph
+    #   "unknown"    through is not in the call graph (only item)
+    #   "max_paths"  / "timeout": the search gave up here (last item)
+    #                (max_paths comes right after the max_paths-th path, if anything is left to search)
+    # limits are checked during the search, 0 means no limit.
+    # through: only walk towards paths that contain this function (anything that cannot reach it is pruned, reachability index)
+    # iterative dfs with enter/exit markers, so the functions on the current path are one shared set.
+    # recursion is known up front from the scc of every function.
+    def get_flow_paths(self, func: str, direction: str, max_depth: int = 0, max_paths: int = 0, timeout: float = 0, through: str = ""):
+        callgraph = self.parse_load_callgraph()
+        next_ids_of = callgraph.callee_ids_of if direction == "callee" else callgraph.caller_ids_of
+        deadline = time.monotonic() + timeout if timeout > 0 else 0
+
+        root = callgraph.func_ids.get(func, None)
+        if root is None:
+            yield ("incomplete", [func])
+            return
+
+        # "through" has to be reachable from every function we walk into (or be on the path already)
+        # through_bits: the components that lead to it, walked once for the whole search
+        through_id = -1
+        through_bits = 0
+        if through != "":
+            through_id = callgraph.func_ids.get(through, -1)
+            if through_id == -1:
+                yield ("unknown", [through])
+                return
+            through_bits = callgraph.reaching_bits([through_id]) if direction == "callee" else callgraph.reach_bits([through_id])
+
+        reported = set()    # recursion cycles (components) already reported
+        path = []           # func ids on the current path
+        onpath = set()
+        bad_depth = 0       # number of recursive funcs on the current path
+        found = 0
+        steps = 0
+        mystack = [(root, True)]
+        while len(mystack) > 0:
+            i, entering = mystack.pop()
+            if not entering:
+                path.pop()
+                onpath.discard(i)
+                if callgraph.is_recursive(i):
+                    bad_depth -= 1
+                continue
+
+            steps += 1
+            if deadline and steps % 1024 == 0 and time.monotonic() > deadline:
+                yield ("timeout", [callgraph.funcs[p] for p in path])
+                return
+
+            # nothing down here leads to "through"
+            if through_id != -1 and through_id not in onpath and not (through_bits >> callgraph.scc_of[i]) & 1:
+                continue
+
+            # looping / cut entries stop short of the end of the path, they only count if "through" is on what they show
+            on_prefix = through_id == -1 or through_id in onpath or i == through_id
+
+            # check for potential loop before continuing
+            if i in onpath:
+                # dead end
+                comp = callgraph.scc_of[i]
+                if on_prefix and comp not in reported:
+                    reported.add(comp)
+                    yield ("looping", [callgraph.funcs[p] for p in path] + [callgraph.funcs[i]])
+                continue
+
+            next_ids = next_ids_of(i)
+            if len(next_ids) > 0:
+                if max_depth > 0 and len(path) + 1 >= max_depth:
+                    if on_prefix:
+                        yield ("cut", [callgraph.funcs[p] for p in path] + [callgraph.funcs[i]])
+                    continue
+                path.append(i)
+                onpath.add(i)
+                if callgraph.is_recursive(i):
+                    bad_depth += 1
+                mystack.append((i, False))
+                # pushed in reverse so that the paths come out sorted
+                for nxt in reversed(next_ids):
+                    mystack.append((nxt, True))
+                continue
+
+            # dead end... finish here
+            found += 1
+            yield ("path" if bad_depth == 0 else "bad", [callgraph.funcs[p] for p in path] + [callgraph.funcs[i]])
+            if max_paths > 0 and found >= max_paths:
+                # stop right away, instead of searching on for looping/cut entries
+                if any(entering for nxt, entering in mystack):
+                    yield ("max_paths", [callgraph.funcs[p] for p in path] + [callgraph.funcs[i]])
+                return
+
+    # print every call path starting from func (limits and output format from flow_*)
+    def parse_flow(self, calling_path: str, func: str, direction: str):
+        sep = "->" if direction == "callee" else "<-"
+        paths = self.get_flow_paths(func, direction, self.flow_max_depth, self.flow_max_paths, self.flow_timeout, self.flow_through)
+        for kind, names in paths:
+            if kind == "looping":
+                self.bad_path_list.add(names[-1])
+            if self.listup == 1:
+                self.listup_set.update(names)
+                continue
+            if kind == "path" or kind == "incomplete":
+                if self.destructive_only == 1:
+                    continue
+                self.normality_count += 1
+
+            if self.flow_format == "jsonl":
+                print(json.dumps({"kind": kind, "path": names}))
+                continue
+            full_path = calling_path + "".join(sep + name for name in names)
+            if kind == "path":
+                print(full_path)
+            elif kind == "incomplete":
+                print(full_path)
+                print("incomplete gen")
+            elif kind == "unknown":
+                print(names[0] + " is not in the call graph")
+            elif kind == "max_paths":
+                print("max paths reached at " + full_path)
+            elif kind == "timeout":
+                print("timeout at " + full_path)
+            else:
+                print(kind + " " + full_path)
+
+    # get caller flow
+    def get_caller_flow(self, calling_path: str, func: str):
+        self.parse_flow(calling_path, func, "callee")
 
     # get callee flow
     def get_callee_flow(self, func: str):
-        test_files = []
-        # bring all the data back
-        for root, dirs, files in os.walk(self.callstack_gen_dir):
-            for file in files:
-                if not file.startswith("globals.") and file.endswith(".txt"):   # dont read globals.xxx.txt
-                    test_files.append(os.path.join(root, file))
-        calling_func_gen = {}
-        for file in test_files:
-            with open(file, 'r', encoding="UTF-8") as f:
-                lines = f.readlines()
-                loc = len(lines)
-
-                tc_func = os.path.basename(file).split(".")[0]
-                calling_func_gen[tc_func] = set()
-                for i in range(0, loc):
-                    calling_func_gen[tc_func].add(lines[i].strip())
-
-        # do a iterative dfs search
-        mystack = []
-        mystack.append([func, ""])
-        while len(mystack) > 0:
-            top = mystack.pop()
-            called = top[0]
-            toprint = top[1]
+        self.parse_flow("", func, "caller")
+
+    # print every function that touches a global variable
+    # "read", "write" or "read/write" + function + its source
+    def get_global_users(self, gvar: str):
+        callgraph = self.parse_load_callgraph()
+        readers = callgraph.readers(gvar)
+        if readers is None:
+            print(gvar + " is not used by any function")
+            return
+        readers = set(readers)
+        writers = set(callgraph.writers(gvar))
+        for func in sorted(readers | writers):
+            if func in readers and func in writers:
+                access = "read/write"
+            elif func in writers:
+                access = "write"
+            else:
+                access = "read"
+            print(access + " " + func + " (" + callgraph.units[callgraph.func_ids[func]] + ")")
+
+    # strip the linemarkers from the preprocessed lines
+    # gcc_cwd: directory gcc ran in (relative paths in the linemarkers are relative to it), "" for ours
+    # returns (filtered lines, set of files gcc actually pulled in)
+    def parse_preprocessed_lines(self, lines: list, gcc_cwd: str = "") -> tuple:
+        filtered = []
+        deps = set()
+        for line in lines:
+            if line.startswith("#"):
+                m = self.linemarker_pattern.search(line)
+                if m:
+                    dep = os.path.join(gcc_cwd, m.group(1).replace("\\\\", "\\"))    # gcc escapes backslashes (windows paths)
+                    if os.path.isfile(dep):
+                        deps.add(os.path.abspath(dep))
+            else:
+                filtered.append(line)
+        return filtered, deps
+
+    # runs parse_functions_<kind>_persrc(srcpath, incpaths) for every srcpath
+    # returns {srcpath: results} (sources gcc failed on are left out)
+    # the per-file parsing is pure python (threads get serialized by the GIL), so we use processes
+    def parse_run_jobs(self, kind: str, srcpaths: list, incpaths: list) -> dict:
+        if self.preprocessor == "gcc" and len(srcpaths) > 0:
+            return asyncio.run(self.parse_run_jobs_gcc(kind, srcpaths, incpaths))
+
+        method_name = "parse_functions_" + kind + "_persrc"
+        persrc_results = {}
+        max_workers = min(self.jobs, len(srcpaths))
+        if max_workers <= 1:
+            for srcpath in srcpaths:
+                persrc_results[srcpath] = getattr(self, method_name)(srcpath, incpaths)
+            return persrc_results
+
+        with concurrent.futures.ProcessPoolExecutor(max_workers = max_workers, initializer = _worker_init, initargs = (self,)) as executor:
+            futures = {executor.submit(_worker_run, method_name, srcpath, incpaths): srcpath for srcpath in srcpaths}
+            for future in concurrent.futures.as_completed(futures):
+                persrc_results[futures[future]] = future.result()
+        return persrc_results
+
+    # gcc runs from the event loop (CpuRegGccScheduler), every finished output goes straight to a parser process
+    # so gcc keeps preprocessing the next sources while the previous ones are being parsed
+    async def parse_run_jobs_gcc(self, kind: str, srcpaths: list, incpaths: list) -> dict:
+        scheduler = CpuRegGccScheduler(self.gcc_jobs or self.jobs, self.gcc_timeout, self.gcc_retries)
+        loop = asyncio.get_running_loop()
+        persrc_results = {}
+        executor = None
+        if min(self.jobs, len(srcpaths)) > 1:
+            executor = concurrent.futures.ProcessPoolExecutor(max_workers = min(self.jobs, len(srcpaths)), initializer = _worker_init, initargs = (self,))
+
+        async def run_one(srcpath: str):
+            # cache lookup (and the asm rewrite) happens here, so a cache hit never starts gcc
+            job = getattr(self, "parse_functions_" + kind + "_prepare")(srcpath, incpaths)
+            if "results" in job:
+                persrc_results[srcpath] = job["results"]
+                return
+            stdin = job["input"] is not None
+            status, stdout, stderr = await scheduler.run(self.parse_gcc_argv(srcpath, incpaths, stdin), job["input"], self.parse_gcc_cwd(srcpath, stdin))
+            if stderr != "":
+                print("gcc: " + srcpath + ":\n" + stderr.rstrip("\n"))
+            if status != "ok":
+                if self.gcc_on_error == "abort":
+                    raise CpuRegGenerateAborted("gcc " + status + " on " + srcpath)
+                if status != "error" or self.gcc_on_error == "skip":
+                    print("gcc " + status + " on " + srcpath + ", skipped (parsed again on the next generate)")
+                    return
+            lines, deps = self.parse_preprocessed_lines(stdout.splitlines(keepends = True), self.parse_gcc_cwd(srcpath, stdin) or "")
+            args = ("parse_functions_" + kind + "_index", srcpath, lines, deps, job["key"])
+            if executor is None:
+                # -j 1: parsed right here, one source at a time (the parser state is not shared with any thread)
+                persrc_results[srcpath] = getattr(self, args[0])(*args[1:])
+            else:
+                persrc_results[srcpath] = await loop.run_in_executor(executor, _worker_run, *args)
 
-            if self.listup == 1:
-                self.listup_set.add(called)
-
-            found = 0
-            for key in calling_func_gen.keys():
-                # found a callee (key), now we append
-                if called in calling_func_gen[key]:
-                    next_calling_path = toprint + "<-" + called
-                    # check for potential loop before continuing
-                    loop_dict = {}
-                    ok_to_cont = 0
-                    for item in next_calling_path.split("<-"):
-                        if loop_dict.get(item, None) is not None:
-                            # dead end
-                            self.bad_path_list.add(item)
-                            ok_to_cont = 0
-                            if self.listup != 1:
-                                print("looping " + next_calling_path)
-                            break
-                        else:
-                            ok_to_cont = 1
-                            loop_dict[item] = 1
-                    if ok_to_cont == 0:
-                        continue # skip
-                    # continue to the next round
-                    mystack.append([key, next_calling_path])
-                    found = 1
-
-        # dead end
-        if found == 0:
-            if self.listup != 1:
-                bad_path_detected = 0
-                for item in (toprint + "<-" + called).split("<-")[1:-1]:
-                    if item in self.bad_path_list:
-                        bad_path_detected = 1
-                        break
-                if bad_path_detected == 0:
-                    if self.destructive_only == 0:
-                        print(toprint + "<-" + called)
-                        self.normality_count += 1
-                else:
-                    print("bad " + toprint + "<-" + called)
+        tasks = [asyncio.create_task(run_one(srcpath)) for srcpath in srcpaths]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            # abort: whatever is still running goes down with it
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions = True)
+            if executor is not None:
+                executor.shutdown(cancel_futures = True)
+        return persrc_results
+
+    # run gcc -E and read the preprocessed output straight from its stdout (nothing goes through the disk)
+    # srctext: if given, it is fed to gcc through stdin instead of srcpath
+    # asm: srctext still has the assembler directives in it (builtin preprocessor only)
+    # returns (filtered lines, set of files gcc pulled in)
+    def parse_preprocess(self, srcpath: str, incpaths: list, srctext: str = None, asm: bool = False) -> tuple:
+        if self.preprocessor == "builtin":
+            if self.builtin_pp is None:
+                self.builtin_pp = CpuRegPreprocessor(incpaths, self.builtin_sysincpaths, self.builtin_predefined)
+            return self.builtin_pp.preprocess(srcpath, srctext, asm)
+
+        mw_gcc_arg = self.parse_gcc_argv(srcpath, incpaths, srctext is not None)
+        if srctext is None:
+            with subprocess.Popen(mw_gcc_arg, stdout = subprocess.PIPE, encoding = "UTF-8") as proc:
+                filtered, deps = self.parse_preprocessed_lines(proc.stdout)
+        else:
+            cwd = self.parse_gcc_cwd(srcpath, True)
+            proc = subprocess.run(mw_gcc_arg, input = srctext, stdout = subprocess.PIPE, encoding = "UTF-8", cwd = cwd)
+            filtered, deps = self.parse_preprocessed_lines(proc.stdout.splitlines(keepends = True), cwd)
+        return filtered, deps
+
+    # stdin: the source is fed through stdin (-x c -) instead of srcpath
+    # (gcc then runs in the directory of srcpath, see parse_gcc_cwd, so the include paths are made absolute)
+    def parse_gcc_argv(self, srcpath: str, incpaths: list, stdin: bool) -> list:
+        mw_gcc_arg = ["gcc", "-E"]
+        for i in incpaths:
+            mw_gcc_arg += ["-I", os.path.abspath(i) if stdin else i]
+        if stdin:
+            mw_gcc_arg += ["-x", "c", "-"]
+        else:
+            mw_gcc_arg.append(srcpath)
+        return mw_gcc_arg
+
+    # where gcc runs: a source fed through stdin has no directory of its own, gcc looks up #include "x" in its cwd first.
+    # it runs in the directory of srcpath, like for a source read from disk (and like the cache key assumes),
+    # instead of wherever cpureg was started. None: no change (srcpath is given to gcc)
+    def parse_gcc_cwd(self, srcpath: str, stdin: bool) -> str:
+        return os.path.dirname(os.path.abspath(srcpath)) if stdin else None
+
+    # the builtin preprocessor mimics the gcc that is installed: same predefined macros, same system include dirs
+    def parse_builtin_preprocessor_init(self):
+        predefs = subprocess.run(["gcc", "-dM", "-E", "-x", "c", "-"], input = "", stdout = subprocess.PIPE, encoding = "UTF-8")
+        self.builtin_predefined = predefs.stdout.splitlines()
+        search = subprocess.run(["gcc", "-E", "-x", "c", "-v", "-"], input = "", stdout = subprocess.PIPE, stderr = subprocess.PIPE, encoding = "UTF-8")
+        self.builtin_sysincpaths = []
+        in_list = False
+        for line in search.stderr.splitlines():
+            if line.startswith("#include <...> search starts here:"):
+                in_list = True
+            elif line.startswith("End of search list."):
+                break
+            elif in_list:
+                self.builtin_sysincpaths.append(line.strip())
+        self.builtin_pp = None
+
+    # preprocessor command line as the cache sees it
+    # (absolute include paths, so that other workspaces with the same tree can share the entries)
+    def parse_cache_argv(self, incpaths: list) -> list:
+        cache_argv = ["parser " + str(self.parser_version), "gcc " + self.cache_gcc_version, "-E"]
+        if self.preprocessor == "builtin":
+            cache_argv.append("builtin " + str(CpuRegPreprocessor.version))
+        for i in incpaths:
+            cache_argv += ["-I", os.path.abspath(i)]
+        return cache_argv
+
+    # cached index may come from a copy of the source with a different name
+    def parse_cached_tracker(self, index: dict, mw_srcpath: str) -> dict:
+        return {func: [tracker[0], tracker[1], mw_srcpath] for func, tracker in index["tracker"].items()}
 
+    # write an intermediate file to parsed_gen (only if asked for with keep_intermediates)
+    def parse_write_intermediate(self, filename: str, lines: list):
+        if not self.keep_intermediates:
+            return
+        with open(os.path.join(self.pf_workspace_dir, filename), 'w', encoding = "UTF-8") as f:
+            f.writelines(lines)
 
     # genfile: generated src path
     # this will strip every comment and index every function from c sources
-    # uses mw_workspace_dir to temporarily store the preprocessed files
+    # preprocessed lines are kept in memory, parsed_gen is only written with keep_intermediates
     def parse_functions_c_persrc(self, srcpath: str, incpaths: list) -> tuple:
-        # do macro preprocess first
-        mw_gcc_arg = "gcc -E "
-        mw_gcc_arg_inc = " -I "
+        job = self.parse_functions_c_prepare(srcpath, incpaths)
+        if "results" in job:
+            return job["results"]
+        # do macro preprocess first (preprocessed info texts are removed on the fly)
+        lines, deps = self.parse_preprocess(srcpath, incpaths)
+        return self.parse_functions_c_index(srcpath, lines, deps, job["key"])
+
+    # everything before the preprocessor runs
+    # returns {"results": ...} on a cache hit, {"key": cache key, "input": None} otherwise (gcc reads srcpath)
+    def parse_functions_c_prepare(self, srcpath: str, incpaths: list) -> dict:
         mw_srcpath = os.path.basename(srcpath)
         mw_srcpath_fnonly = mw_srcpath.split(".")[0]
         mw_srcpath_ext = mw_srcpath.split(".")[1]
-        genfile = os.path.join(self.pf_workspace_dir, mw_srcpath_fnonly + ".generated." + mw_srcpath_ext)
-        # check and remove old file
-        if os.path.exists(genfile) and os.path.isfile(genfile):
-            os.remove(genfile)
-        # generate args
-        mw_gcc_arg += srcpath
-        for i in incpaths:
-            mw_gcc_arg += mw_gcc_arg_inc + i
-        mw_gcc_arg += " -o " + genfile
-        # run gcc
-        subprocess.call(mw_gcc_arg, shell=True)
+        genfile = mw_srcpath_fnonly + ".generated." + mw_srcpath_ext
+
+        # this source may have been preprocessed & parsed already (same headers & command line, any workspace)
+        cache_key = None
+        if self.cache.enabled:
+            cache_key = self.cache.source_key("c", self.parse_cache_argv(incpaths), self.cache.file_hash(srcpath), srcpath)
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                self.parse_write_intermediate(genfile, cached["lines"])
+                index = cached["index"]
+                print(genfile + " number of funcs found (cached): " + str(len(index["funcs"])))
+                symbols = self.parse_scan_symbols_c(cached["lines"], index["inlineasm"], genfile)
+                return {"results": (index["funcs"], self.parse_cached_tracker(index, mw_srcpath), set(index["globals"]), index["params"], index["inlineasm"], symbols, set(cached["deps"]))}
+        return {"key": cache_key, "input": None}
+
+    # special register assignments, in the c code and in its inline asm
+    # (depend on the target platform, so they are never taken from the cache, which every platform shares)
+    def parse_scan_symbols_c(self, lines: list, inline_asm: dict, genfile: str) -> dict:
+        symbol_index = CpuRegSymbolIndex(self.target_platform)
+        symbols = symbol_index.scan_source(lines, False, genfile)
+        for func in sorted(inline_asm):
+            for block in inline_asm[func]:
+                symbols["sites"] += symbol_index.scan(block.splitlines(), func + "() inline asm")
+        return symbols
+
+    # lines, deps: preprocessed source (linemarkers stripped) and the files pulled in
+    def parse_functions_c_index(self, srcpath: str, lines: list, deps: set, cache_key: str) -> tuple:
+        mw_srcpath = os.path.basename(srcpath)
+        mw_srcpath_fnonly = mw_srcpath.split(".")[0]
+        mw_srcpath_ext = mw_srcpath.split(".")[1]
+        genfile = mw_srcpath_fnonly + ".generated." + mw_srcpath_ext
 
-        # remove preprocessed info texts..
-        with open(genfile, 'r', encoding="UTF-8") as f:
-            lines = f.readlines()
-            filtered = [line for line in lines if not line.startswith("#")]
+        deps.discard(os.path.abspath(srcpath))
+        self.parse_write_intermediate(genfile, lines)
 
-        with open(genfile, 'w', encoding="UTF-8") as f:
-            f.writelines(filtered)
+        # tokenize once and cut out the function bodies, global declarations and inline asm
+        src_funcs, func_unit_tracker_src, global_vars, param_vars, inline_asm = self.c_parser.parse_functions(lines, mw_srcpath)
 
-        global_vars = set() # get the global variables
-        src_funcs = {}
-        func_unit_tracker_src = {}
-        param_vars = {}
+        symbols = self.parse_scan_symbols_c(lines, inline_asm, genfile)
 
-        with open(genfile, 'r', encoding="UTF-8") as f:
-            lines = f.readlines()
-            loc = len(lines)
-            tmp_str = ""
-            func_name = ""
-            in_func = 0
-            bstack = 0
-
-            in_tfunc = 0
-            in_typedef_struct = 0
-            tstack = 0 # curly brackets
-            typedef_struct_semicolon_reached = 0
-
-            cstack = 0
-            in_param = 0
-
-            comment = 0 # inside comment
-            starti = 0 # starting location of function
-
-            for i in range(0, loc):
-                # inside a macro comment
-                if re.compile(r'^#.*').search(lines[i]):
-                    continue
+        if cache_key is not None:
+            index = {"funcs": src_funcs, "tracker": func_unit_tracker_src, "globals": sorted(global_vars), "params": param_vars, "inlineasm": inline_asm}
+            self.cache.put(cache_key, deps, {"lines": lines, "index": index})
 
-                # inside a comment - do not process
-                if self.comment_pattern_1.search(lines[i]):
-                    comment = 2
-
-                # end of line comment
-                if comment == 2 and self.comment_pattern_2.search(lines[i]):
-                    comment = 1
-                elif comment == 2 and "*/" in lines[i]:
-                    # has a code after comment
-                    comment = 0
-
-                # in a multiline comment - do nothing
-                if comment >= 1:
-                    if comment == 2:
-                        continue
-                    if comment == 1:
-                        comment = 0
-                        continue
-
-                # --- start of global var parsing ---
-                # simple typedef struct blocking
-                if in_func == 0 and self.global_var_dontuse_pattern.search(lines[i]):
-                    in_typedef_struct = 1
-                elif in_func == 0 and in_typedef_struct == 1 and in_tfunc == 0 and typedef_struct_semicolon_reached == 1:
-                    in_typedef_struct = 0
-                    typedef_struct_semicolon_reached = 0
-
-                # check whether we are in param
-                if "(" in lines[i]:
-                    if cstack == 0:
-                        in_param = 1
-                    cstack += 1
-                if ")" in lines[i]:
-                    cstack -= 1
-                    if cstack <= 0:
-                        in_param = 2 # we skip one line
-                        cstack = 0
-
-                # if we are not in a function, we can start capturing the global variables
-                if in_tfunc == 0 and in_param == 0 and in_typedef_struct == 0 and self.global_var_pattern.search(lines[i]):
-                    # capture the global variable
-                    varname = self.global_var_pattern.search(lines[i]).group(1)
-                    if not varname.isdigit():   # hackfix
-                        global_vars.add(varname)
-
-                # delay one line for param check
-                if in_param == 2:
-                    in_param = 0
-
-                if "{" in lines[i]:
-                    if tstack == 0:
-                        in_tfunc = 1
-                    tstack += 1
-                if "}" in lines[i]:
-                    tstack -= 1
-                    if tstack <= 0:
-                        in_tfunc = 0
-                        tstack = 0
-
-                # check if we reached semicolon in typedef struct
-                if in_func == 0 and in_typedef_struct == 1 and tstack == 0 and ';' in lines[i]:
-                    typedef_struct_semicolon_reached = 1
-                # --- end of global var parsing ---
-
-                # capture all lines preceding possible start of function - don't include extern/while/for/if/switch
-                if in_func == 0 and not self.not_in_line.search(lines[i]):
-                    tmp_str += lines[i].replace('\n', ' ')
-                
-                # reset capture if badness found
-                if in_func == 0 and self.not_in_line.search(lines[i]):
-                    tmp_str = ""
-
-                # found start of function - reverse travel index with captured lines and find function name
-                if in_func == 0 and '{' in lines[i]:
-                    tmp_str += lines[i].replace('\n', ' ')
-                    rline = tmp_str
-                    if not self.pre_func_pattern.search(tmp_str):
-                        tmp_str = ""
-                        continue
-                    tloc = len(tmp_str)
-                    in_brackets = 0
-                    once_set = 0
-                    tmp_str_copy = ""
-                    param_str = ""
-                    for t in range(tloc, 0, -1):
-                        if tmp_str[t - 1] == ")":
-                            in_brackets += 1
-                            once_set = 1
-                        elif tmp_str[t - 1] == "(":
-                            in_brackets -= 1
-                        elif in_brackets == 0 and once_set == 1:
-                            tmp_str_copy = tmp_str[0:t]
-                            break
-                        elif in_brackets != 0:
-                            param_str = tmp_str[t - 1] + param_str
-
-                    if self.func_pattern.search(tmp_str_copy):
-                        func_name = self.func_pattern.search(tmp_str_copy).group(1)
-                        param_vars[func_name] = param_str.strip()
-                        starti = i  # record starting location for func_name
-                    else:
-                        tmp_str = ""
-                        continue
-
-                    # one liner function might eist, like this:
-                    # void func (int asdf) {}
-                    if self.oneliner_func_pattern.search(tmp_str):
-                        tmp_str = ""
-                        continue
-
-                    bstack = 1
-                    in_func = 2
-
-                # the section is a one-liner
-                elif in_func == 2 and '{' in lines[i] and '}' in lines[i]:
-                    rline = lines[i] # copy line
-
-                # going in section
-                elif in_func == 2 and '{' in lines[i]:
-                    rline = lines[i]
-                    bstack += 1
-
-                # getting out of section - if bstack is 0: its the end of function
-                elif in_func == 2 and '}' in lines[i]:
-                    rline = lines[i]
-                    bstack -= 1
-                    if bstack <= 0:
-                        tmp_str = ""
-                        in_func = 1 # quit
-
-                # while in function
-                elif in_func == 2:
-                    rline = lines[i]
-
-                # save the contents(copy line) of the function (if in function)
-                if in_func >= 1:
-                    # strip last line cocmment
-                    if self.comment_pattern_w2.search(lines[i]):
-                        rline = self.comment_pattern_w2.search(lines[i]).group(1) + "\n"
-                    else:
-                        rline = lines[i]
-
-                    if src_funcs.get(func_name, None) != None:
-                        src_funcs[func_name] += rline
-                    else:
-                        # very first insert, we parse it out so that it doesnt include the func head ever.
-                        src_funcs[func_name] = re.compile(r".*?({.*)").search(rline).group(1) + "\n"
-
-                    if in_func == 1:
-                        # strip comments
-                        src_funcs[func_name] = self.comment_pattern_w.sub('', src_funcs[func_name]).strip()
-                        # another set to keep track of which file the function is located in
-                        func_unit_tracker_src[func_name] = [starti, i, mw_srcpath]
-                        in_func = 0
-                        func_name = ""
-
-        print(os.path.basename(genfile) + " number of funcs found: " + str(len(src_funcs)))
-        return src_funcs, func_unit_tracker_src, global_vars, param_vars
+        print(genfile + " number of funcs found: " + str(len(src_funcs)))
+        return src_funcs, func_unit_tracker_src, global_vars, param_vars, inline_asm, symbols, deps
 
     def parse_functions_c_write(self, srcpaths: list, incpaths: list) -> tuple:
         global_vars = set()  # global variables
         src_funcs = {}
         func_unit_tracker_src = {}  # this is just for grouping function set for each source file. nothing fancy
         param_vars = {}
-        max_workers = int(os.cpu_count() / 4)
+        inline_asm = {}     # func -> inline asm blocks (only c functions that have some)
+
+        # only the sources that changed since the last run are parsed again, the rest comes from the manifest
+        flags = self.parse_gcc_flags(incpaths)
+        dirty_srcpaths = [srcpath for srcpath in srcpaths if self.keep_intermediates or self.manifest.source_changed(srcpath, flags)]
+        persrc_results = {}
+        for srcpath in srcpaths:
+            if srcpath not in dirty_srcpaths:
+                index = self.manifest.load_source_index(srcpath)
+                persrc_results[srcpath] = (index["funcs"], index["tracker"], set(index["globals"]), index["params"], index["inlineasm"], index["symbols"])
+        print("c sources to parse: " + str(len(dirty_srcpaths)) + "/" + str(len(srcpaths)))
 
         # src_funcs should go in the pre_c
-        with concurrent.futures.ThreadPoolExecutor(max_workers = max_workers) as executor:
-            futures = [executor.submit(self.parse_functions_c_persrc, srcpath, incpaths) for srcpath in srcpaths]
-            for future in concurrent.futures.as_completed(futures):
-                results = future.result()
-                # merge dicts
-                for xfunc in results[0].keys():
-                    if src_funcs.get(xfunc, None) == None:
-                        src_funcs[xfunc] = results[0][xfunc]
-                        func_unit_tracker_src[xfunc] = results[1][xfunc]
-                    elif len(results[0][xfunc]) > len(src_funcs[xfunc]):
-                        # if the function is longer, we replace it
-                        src_funcs[xfunc] = results[0][xfunc]
-                        func_unit_tracker_src[xfunc] = results[1][xfunc]
-                global_vars.update(results[2])
-                param_vars.update(results[3])
+        for srcpath, results in self.parse_run_jobs("c", dirty_srcpaths, incpaths).items():
+            index = {"funcs": results[0], "tracker": results[1], "globals": sorted(results[2]), "params": results[3], "inlineasm": results[4], "symbols": results[5]}
+            self.manifest.update_source(srcpath, flags, results[6], index)
+            persrc_results[srcpath] = results[0:6]
+
+        # merge in a fixed order so that the result does not depend on which worker finished first
+        for srcpath in sorted(persrc_results):
+            results = persrc_results[srcpath]
+            # merge dicts
+            for xfunc in results[0].keys():
+                if src_funcs.get(xfunc, None) == None or len(results[0][xfunc]) > len(src_funcs[xfunc]):
+                    # if the function is longer, we replace it (its inline asm goes along)
+                    src_funcs[xfunc] = results[0][xfunc]
+                    func_unit_tracker_src[xfunc] = results[1][xfunc]
+                    if xfunc in results[4]:
+                        inline_asm[xfunc] = results[4][xfunc]
+                    else:
+                        inline_asm.pop(xfunc, None)
+            global_vars.update(results[2])
+            param_vars.update(results[3])
+            self.symbol_sources[os.path.basename(srcpath)] = results[5]
 
         # tidy up
         # anything that is in function tracker but not in the body capture, is probably a one liner empty function
@@ -502,185 +813,184 @@ class CpuRegParser:
             if trackerkey not in src_funcs:
                 src_funcs[trackerkey] = "{}"
 
-        # test inline asm
-        for src_func in src_funcs.values():
-            inlineasmfuncs = CpuRegAsmParser().parse_functions_c_inlineasm_to_asm(src_func)
-            for inlineasm in inlineasmfuncs:
-                print("processed inline funcs:\n" + inlineasm)
+        # inline asm was captured while the bodies were cut out, saved as {func: [block, ...]}
+        tmp_file = self.inlineasm_file + ".tmp"
+        with open(tmp_file, 'w', encoding = "UTF-8") as f:
+            json.dump({func: inline_asm[func] for func in sorted(inline_asm)}, f)
+        os.replace(tmp_file, self.inlineasm_file)
+        print("c funcs with inline asm: " + str(len(inline_asm)) + "/" + str(len(src_funcs)))
 
         return src_funcs, func_unit_tracker_src, global_vars, param_vars
 
-    # returns sorted list of strings of registers
+    # returns the register bitmask of a register list (CpuRegRegFile of the target platform)
     # takes care of , and -
-    def parse_functions_asm_individual_reg(self, regs: str) -> list:
-        reglist_ = regs.replace(" ", "").split(",")
-        reglist = set()
-        for reg_ in reglist_:
-            reg = reg_.lower().strip()
-            if "-" in reg:
-                regprefix = re.compile(r"([a-z]+) ").search(reg).group(1)  # opcode
-                regget = re.compile(r"[a-z]+([0-9]+)-[a-z]+([0-9]+)").search(reg)   # operands rx-ry
-                regstart = regget.group(1)
-                regend = regget.group(2)
-                for i in range(regstart, regend+1):
-                    reglist.add(regprefix + str(i))
-            else:
-                reglist.add(reg)
+    def parse_functions_asm_individual_reg(self, regs: str) -> int:
+        return self.regfile.parse_reglist(regs)
 
-        # sort it out
-        sorted_reglist = sorted(reglist)
-        return sorted_reglist
+    # split preprocessed asm lines into functions, in one pass
+    # every label starts a function that runs until the next label, the body lines are joined once at the end.
+    # returns asm_funcs(body), func_unit_tracker(for caller stack)
+    # func_unit_tracker_asm[func] = [line of the label, last line of the body, srcname]
+    # (line numbers count the sanitized lines: directives and comment-only blocks are not counted)
+    def parse_asm_spans(self, lines: list, mw_srcpath: str) -> tuple:
+        bodies = {}     # func name -> body lines (a label seen twice keeps adding to the same function)
+        func_unit_tracker_asm = {}
+        body = None
+        func_name = ""
+        starti = 0  # label line of the current function
+        n = 0       # sanitized line number
+        in_comment = 0  # 1 if inside comment
+        for line in lines:
+            # skip if line begins with a dot or a sharp (., #)
+            if line.strip().startswith((".", "#")):
+                continue
+            # trim start-end comments first
+            comment_start = line.find("/*")
+            if comment_start != -1:
+                line = line[:comment_start]     # trim comment
+                in_comment = 1
+            elif in_comment != 0 and "*/" in line:
+                line = ""
+                in_comment = 0
+            elif in_comment == 0:
+                # trim other comments if available
+                m = self.asm_comment_pattern_2.match(line)
+                if m:
+                    line = m.group(1)
+            elif in_comment == 1:   # inside comment
+                in_comment = 2      # ignore everything
+            if in_comment == 2:
+                continue
+
+            # clean by strip and add newline
+            line = line.strip() + "\n"
+            m = self.asm_func_pattern_1.match(line)
+            if m:
+                # the previous function ends right before this label
+                if body is not None and n - 1 > starti:
+                    func_unit_tracker_asm[func_name] = [starti, n - 1, mw_srcpath]
+                func_name = m.group(1).lstrip("_")    # lets strip the starting '_'
+                body = bodies.setdefault(func_name, [])
+                starti = n
+            elif body is not None:
+                body.append(line)
+            n += 1
+        if body is not None and n - 1 > starti:
+            func_unit_tracker_asm[func_name] = [starti, n - 1, mw_srcpath]
+
+        asm_funcs = {func: "".join(body_lines) for func, body_lines in bodies.items()}
+        return asm_funcs, func_unit_tracker_asm
 
     # we shall only get the func body here.
     # we shall do macro preprocessing just like the c source as well
     # returns asm_funcs(body), func_unit_tracker(for caller stack)
     # TODO: 1. we shall parse for callstack first, 2. and then parse push/pop after that.
     def parse_functions_asm_persrc(self, srcpath: str, incpaths: list) -> tuple:
+        job = self.parse_functions_asm_prepare(srcpath, incpaths)
+        if "results" in job:
+            return job["results"]
+        lines, deps = self.parse_preprocess(srcpath, incpaths, job["input"], self.preprocessor == "builtin")
+        return self.parse_functions_asm_index(srcpath, lines, deps, job["key"])
+
+    # everything before the preprocessor runs
+    # returns {"results": ...} on a cache hit, {"key": cache key, "input": rewritten source for stdin} otherwise
+    def parse_functions_asm_prepare(self, srcpath: str, incpaths: list) -> dict:
         mw_srcpath = os.path.basename(srcpath)
         mw_srcpath_fnonly = mw_srcpath.split(".")[0]
         mw_srcpath_ext = mw_srcpath.split(".")[1]
         lines = []
         with open(srcpath, 'r') as f:
             lines = f.readlines()
-        new_srcpath = os.path.join(self.pf_workspace_dir, mw_srcpath_fnonly + ".pregen.c") 
+        new_srcpath = mw_srcpath_fnonly + ".pregen.c"
 
         # Process .set directives before macro preprocessing
+        # and sanitize before pushing into compiler (same pass)
+        # (the builtin preprocessor understands .set / .if itself, only the comments go)
         set_defines = {}
-        processed_lines = []
+        pregen_lines = []
         set_pattern = re.compile(r"^\s*\.set\s+(\w+)\s*,\s*(.+)")
+        builtin = self.preprocessor == "builtin"
         for line in lines:
-            m = set_pattern.match(line)
+            m = None if builtin else set_pattern.match(line)
             if m:
                 # Save the macro name and value
                 macro_name = m.group(1)
                 macro_value = m.group(2).strip()
                 set_defines[macro_name] = macro_value
                 # Replace .set with #define for C preprocessor
-                processed_lines.append("#define " + macro_name + " " + macro_value + "\n")
-            else:
-                processed_lines.append(line)
-
-        # sanitize before pushing into compiler
-        with open(new_srcpath, 'w') as f:
-            for i in processed_lines:
-                parsedi = i
-                if (parsedi.strip().startswith(".if") or parsedi.strip().startswith(".elif") or 
-                    parsedi.strip().startswith(".else") or parsedi.strip().startswith(".endif")):
-                    parsedi = parsedi.replace(".", "#")   
-                # get rid of the comments
-                if self.asm_comment_pattern_2.search(parsedi):
-                    parsedi = self.asm_comment_pattern_2.search(parsedi).group(1) + "\n"
-                f.write(parsedi)
-
-        # and then do some macro preprocessing
-        mw_gcc_arg = "gcc -E "
-        mw_gcc_arg_inc = " -I "
-        
-        genfile = os.path.join(self.pf_workspace_dir, mw_srcpath_fnonly + ".generated." + mw_srcpath_ext)
-        # check and remove old file
-        if os.path.exists(genfile) and os.path.isfile(genfile):
-            os.remove(genfile)
-        # generate args
-        mw_gcc_arg += new_srcpath
-        for i in incpaths:
-            mw_gcc_arg += mw_gcc_arg_inc + i
-        mw_gcc_arg += " -o " + genfile
-        # run gcc
-        subprocess.call(mw_gcc_arg, shell = True)
-        
-        # remove preprocessed info texts..
-        with open(genfile, 'r', encoding = "UTF-8") as f:
-            lines = f.readlines()
-            filtered = [line for line in lines if not line.startswith("#")]
+                line = "#define " + macro_name + " " + macro_value + "\n"
+            elif not builtin and line.strip().startswith((".if", ".elif", ".else", ".endif")):
+                line = line.replace(".", "#")
+            # get rid of the comments
+            m = self.asm_comment_pattern_2.match(line)
+            if m:
+                line = m.group(1) + "\n"
+            pregen_lines.append(line)
+        self.parse_write_intermediate(new_srcpath, pregen_lines)
+
+        # and then do some macro preprocessing (fed through stdin, no pregen file needed)
+        genfile = mw_srcpath_fnonly + ".generated." + mw_srcpath_ext
+        pregen_text = "".join(pregen_lines)
+
+        # this source may have been preprocessed & parsed already (same headers & command line, any workspace)
+        cache_key = None
+        if self.cache.enabled:
+            cache_key = self.cache.source_key("asm", self.parse_cache_argv(incpaths), self.manifest.content_hash(pregen_text), srcpath)
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                self.parse_write_intermediate(genfile, cached["lines"])
+                index = cached["index"]
+                print(genfile + " number of funcs found (cached): " + str(len(index["funcs"])))
+                # the symbol sites depend on the platform, the cache does not: scanned again from the cached lines
+                symbols = CpuRegSymbolIndex(self.target_platform).scan_source(cached["lines"], True, genfile)
+                return {"results": (index["funcs"], self.parse_cached_tracker(index, mw_srcpath), symbols, set(cached["deps"]))}
+        return {"key": cache_key, "input": pregen_text}
+
+    # lines, deps: preprocessed source (linemarkers stripped) and the files pulled in
+    def parse_functions_asm_index(self, srcpath: str, lines: list, deps: set, cache_key: str) -> tuple:
+        mw_srcpath = os.path.basename(srcpath)
+        mw_srcpath_fnonly = mw_srcpath.split(".")[0]
+        mw_srcpath_ext = mw_srcpath.split(".")[1]
+        genfile = mw_srcpath_fnonly + ".generated." + mw_srcpath_ext
+        self.parse_write_intermediate(genfile, lines)
 
-        with open(genfile, 'w', encoding = "UTF-8") as f:
-            f.writelines(filtered)
+        asm_funcs, func_unit_tracker_asm = self.parse_asm_spans(lines, mw_srcpath)
+        symbols = CpuRegSymbolIndex(self.target_platform).scan_source(lines, True, genfile)
 
-        # file have been preprocessed. now we start parsing
-        in_comment = 0  # 1 if inside comment
-        sanitizedlines = []
+        if cache_key is not None:
+            self.cache.put(cache_key, deps, {"lines": lines, "index": {"funcs": asm_funcs, "tracker": func_unit_tracker_asm}})
 
-        # sanitize lines from comments first
-        with open(genfile, 'r') as f:
-            lines = f.readlines()
-            loc = len(lines)
-            for i in range(0, loc):
-                line = lines[i]
-                # skip if line begins with a dot or a sharp (., #)
-                if line.strip().startswith(".") or line.strip().startswith("#"):
-                    continue
-                # trim start-end comments first
-                if self.asm_comment_pattern_1_start.search(line):
-                    line = self.asm_comment_pattern_1_start.search(line).group(1)    # trim comment
-                    in_comment = 1
-                elif in_comment != 0 and self.asm_comment_pattern_1_end.search(line):
-                    line = self.asm_comment_pattern_1_end.search(line).group(1)
-                    in_comment = 0
-                elif in_comment == 0:
-                    # trim other comments if available
-                    if self.asm_comment_pattern_2.search(line):
-                        line = self.asm_comment_pattern_2.search(line).group(1)
-                    else:   # the line is clean
-                        pass
-                elif in_comment == 1:   # inside comment
-                    in_comment = 2      # ignore everything
-
-                # clean by strip and add newline
-                line = line.strip() + "\n"
-
-                if in_comment != 2: # will capture in_comment == 0 & 1
-                    sanitizedlines += [line]
-
-        # we sanitized it, now we capture functions on it
-        sanitizedloc = len(sanitizedlines)
-
-        # lets skim and find all the function names first
-        pre_func_names = set()
-        for i in range(0, sanitizedloc):
-            sanitizedline = sanitizedlines[i]
-            if self.asm_func_pattern_1.search(sanitizedline):
-                pre_func_names.add(self.asm_func_pattern_1.search(sanitizedline).group(1))
-        # and thats it...
-        
-        # parse functions: k:func_name - v:body
-        asm_funcs = {}
-        func_unit_tracker_asm = {}
-        func_name = ""
-        in_func = 0 # once it is 1, it will never be 0 again until EOF
-        starti = 0 # starting location of function
-        for i in range(0, sanitizedloc):
-            sanitizedline = sanitizedlines[i]
-            if self.asm_func_pattern_1.search(sanitizedline):    # will run regardless of in_func.
-                func_name = self.asm_func_pattern_1.search(sanitizedline).group(1).lstrip("_")    # lets strip the starting '_'
-                # if funcname was not encountered before, init
-                if asm_funcs.get(func_name, None) == None:
-                    asm_funcs[func_name] = ""
-                in_func = 1
-                starti = i
-            elif in_func == 1:  # will always run, once in_func changed to 1 & is not on a function name
-                # capture func body
-                asm_funcs[func_name] += sanitizedline
-                # another set to keep track of which file the function is located in
-                # (will run several times atm, TODO: make it run only once)
-                func_unit_tracker_asm[func_name] = [starti, i, mw_srcpath]
-
-        print(os.path.basename(genfile) + " number of funcs found: " + str(len(asm_funcs)))
-        return asm_funcs, func_unit_tracker_asm
+        print(genfile + " number of funcs found: " + str(len(asm_funcs)))
+        return asm_funcs, func_unit_tracker_asm, symbols, deps
             
 
     def parse_functions_asm_write(self, srcpaths: list, incpaths: list) -> tuple:
         asm_funcs = {}
         func_unit_tracker_asm = {}  # this is just for grouping function set for each source file. nothing fancy
-        max_workers = int(os.cpu_count() / 4)
+
+        # only the sources that changed since the last run are parsed again, the rest comes from the manifest
+        flags = self.parse_gcc_flags(incpaths)
+        dirty_srcpaths = [srcpath for srcpath in srcpaths if self.keep_intermediates or self.manifest.source_changed(srcpath, flags)]
+        persrc_results = {}
+        for srcpath in srcpaths:
+            if srcpath not in dirty_srcpaths:
+                index = self.manifest.load_source_index(srcpath)
+                persrc_results[srcpath] = (index["funcs"], index["tracker"], index["symbols"])
+        print("asm sources to parse: " + str(len(dirty_srcpaths)) + "/" + str(len(srcpaths)))
 
         # asm_funcs should go in the pre_asm
-        with concurrent.futures.ThreadPoolExecutor(max_workers = max_workers) as executor:
-            futures = [executor.submit(self.parse_functions_asm_persrc, srcpath, incpaths) for srcpath in srcpaths]
-            for future in concurrent.futures.as_completed(futures):
-                results = future.result()
-                # merge dicts
-                asm_funcs.update(results[0])
-                func_unit_tracker_asm.update(results[1])
+        for srcpath, results in self.parse_run_jobs("asm", dirty_srcpaths, incpaths).items():
+            index = {"funcs": results[0], "tracker": results[1], "symbols": results[2]}
+            self.manifest.update_source(srcpath, flags, results[3], index)
+            persrc_results[srcpath] = results[0:3]
+
+        # merge in a fixed order so that the result does not depend on which worker finished first
+        for srcpath in sorted(persrc_results):
+            results = persrc_results[srcpath]
+            # merge dicts
+            asm_funcs.update(results[0])
+            func_unit_tracker_asm.update(results[1])
+            self.symbol_sources[os.path.basename(srcpath)] = results[2]
 
         # tidy up
         # anything that is in function tracker but not in the body capture, is probably a one liner empty function
@@ -689,16 +999,78 @@ class CpuRegParser:
             if trackerkey not in asm_funcs:
                 asm_funcs[trackerkey] = "{}"
 
-        # test
-        for asm_func in asm_funcs.values():
-            tmp_funcs = CpuRegAsmParser().parse_functions_asm_breakdown_branches(asm_func, self.asm_branch_pattern)
-            for mstr in tmp_funcs:
-                print("\nbreakdown:\n" + mstr)
-
-            print("\nreassemble:\n" + CpuRegAsmParser().parse_functions_asm_reassemble_branches(asm_func, tmp_funcs, self.asm_branch_pattern))
+        # basic blocks & branch edges of every asm function (only the changed bodies are split again)
+        self.cfg = CpuRegAsmCfg()
+        self.cfg.load(self.cfg_file)
+        rebuilt = self.cfg.build(asm_funcs, self.asm_branch_ops, self.asm_return_pattern, set(self.regfile.name_to_index))
+        self.cfg.save(self.cfg_file)
+        print("asm cfgs built: " + str(rebuilt) + "/" + str(len(asm_funcs)))
 
         return asm_funcs, func_unit_tracker_asm
 
+    # one compiled alternation of all function names, for the regex callscan mode
+    # names are folded into a trie first, so re does not retry every single name at every position
+    # (names starting with '_' are left out: the token scan strips leading '_' so it never matches them either)
+    def parse_callscan_pattern(self, func_names: set) -> re.Pattern:
+        trie = {}
+        for name in func_names:
+            if name == "" or name.startswith("_"):
+                continue
+            node = trie
+            for ch in name:
+                node = node.setdefault(ch, {})
+            node[""] = {}   # end of name
+
+        def trie_to_regex(node: dict) -> str:
+            alts = [re.escape(ch) + trie_to_regex(node[ch]) for ch in sorted(node.keys()) if ch != ""]
+            if len(alts) == 0:
+                return ""
+            if "" in node:
+                return "(?:" + "|".join(alts) + ")?"
+            if len(alts) == 1:
+                return alts[0]
+            return "(?:" + "|".join(alts) + ")"
+
+        if len(trie) == 0:
+            return re.compile(r"(?!)")  # matches nothing
+        return re.compile(r"(?<![a-zA-Z0-9_])_*(" + trie_to_regex(trie) + r")(?![a-zA-Z0-9_])")
+
+    # globals touched by a c function body, tokenized once
+    # returns (read globals, written globals), compound assignments and ++/-- count as both
+    def parse_global_access_c(self, body: str, global_vars: set) -> tuple:
+        reads = set()
+        writes = set()
+        for m in self.global_var_use_pattern.finditer(body):
+            name = m.group("name")
+            if name not in global_vars:
+                continue
+            post = m.group("post")
+            if m.group("pre") is None and post is None:
+                reads.add(name)
+                continue
+            writes.add(name)
+            op = post.rstrip() if post is not None else ""
+            if not op.endswith("=") or (len(op) > 1 and op[-2] in "+-*/%&|^<>"):
+                reads.add(name)
+        return reads, writes
+
+    # globals touched by an asm function body (symbols may carry the leading '_' of the c name)
+    # returns (read globals, written globals), operands of store instructions are writes
+    def parse_global_access_asm(self, body: str, global_vars: set) -> tuple:
+        reads = set()
+        writes = set()
+        for m in self.global_var_use_asm_pattern.finditer(body):
+            tokens = set(self.call_token_pattern.findall(m.group(2)))
+            tokens |= {tok.lstrip("_") for tok in tokens}
+            found = tokens & global_vars
+            if len(found) == 0:
+                continue
+            if m.group(1).lower().startswith(self.global_var_write_asm_ops):
+                writes |= found
+            else:
+                reads |= found
+        return reads, writes
+
     # TODO: process both asm and c src for callstack
     def parse_functions_process_callstack(self, funcs: list, func_unit_tracker: list, global_vars: set, param_vars: dict):
         # generate call stack estimation
@@ -706,49 +1078,38 @@ class CpuRegParser:
         # get them init first (so we can create files even if empty)
         for key in funcs.keys():
             callstack_gen[key] = set()
-        funcs_v = funcs.copy()
+        # hashed symbol table of every known function
+        func_names = set(funcs.keys())
+        callscan_pattern = None
+        if self.callscan_mode == "regex":
+            callscan_pattern = self.parse_callscan_pattern(func_names)
         for func in funcs.keys():
-            code = funcs[func].splitlines()
             # before we continue, we need to make sure we dont include the header of the function
             # otherwise we get a callstack that calls itself (which is wrong)
 
             # c and asm to share parse code
-            # if os.path.basename(func_unit_tracker[func]).split(".")[1] in asm_ext:
-            for cline in code:
-                # split the line into tokens and skip any possible empty lines
+            if callscan_pattern is not None and self.srcpath_isnotc(func_unit_tracker[func][2]):
+                # asm: one compiled alternation over the whole body
+                callstack_gen[func] = {m.group(1) for m in callscan_pattern.finditer(funcs[func])}
+                if "" in func_names and self.call_underscore_pattern.search(funcs[func]):
+                    callstack_gen[func].add("")
+            else:
+                # tokenize the body once and intersect with the known functions
                 # (if possible) we strip the first underscore from the function name due to asm
-                # regex: [^] means "not", so we split by anything that is not a-z, A-Z, 0-9, or _
-                cc = [x.lstrip("_") for x in re.split(r'[^a-zA-Z0-9_]+', cline) if x.strip() != ""]
-                for key in funcs_v.keys():
-                    if key in cc:
-                        callstack_gen[func].add(key)
-
-        # save lists of all callstacks
-        for func in callstack_gen.keys():
-            new_file = os.path.join(self.callstack_gen_dir, self.funcname_hashgen(func))
-            with open(new_file, 'w') as wf:
-                for calling in callstack_gen[func]:
-                    wf.write(calling + "\n")
+                cc = {x.lstrip("_") for x in self.call_token_pattern.findall(funcs[func])}
+                callstack_gen[func] = cc & func_names
 
         # save global variable list used by functions
         # we will check again for local vars and subtract them from detected global vars (only for c files)
+        func_globals = {}
+        func_global_reads = {}
+        func_global_writes = {}
         for func in callstack_gen.keys():
-            new_file = os.path.join(self.callstack_gen_dir, "globals." + self.funcname_hashgen(func))
             if self.srcpath_isnotc(func_unit_tracker[func][2]):
-                with open(new_file, 'w') as wf:
-                    findvar = set()
-                    # we split the lines
-                    lines = funcs[func].splitlines()
-                    varmatches = []
-                    for line in lines:
-                        if self.global_var_use_asm_pattern.search(line):
-                            varmatches.append(self.global_var_use_asm_pattern.search(line).group(1))
-                    for varmatch in varmatches:
-                        for gvar in global_vars:
-                            if gvar in varmatch:
-                                findvar.add(gvar)
-                    for gvar in findvar:
-                        wf.write(gvar + "\n")
+                reads, writes = self.parse_global_access_asm(funcs[func], global_vars)
+                func_globals[func] = reads | writes
+                func_global_reads[func] = reads
+                func_global_writes[func] = writes
             else: # c file
                 # get local vars
                 local_vars = set()
@@ -763,22 +1124,33 @@ class CpuRegParser:
                         if self.param_var_pattern.search(pvar):
                             local_vars.add(self.param_var_pattern.search(pvar).group(1))
 
-                with open(new_file, 'w') as wf:
-                    findvar = set()
-                    for line in funcs[func].splitlines():
-                        matches = self.global_var_use_pattern.findall(line)
-                        for gvar in matches:
-                            if gvar in global_vars:
-                                findvar.add(gvar)
-                    findvar -= local_vars # subtract local vars from global vars
-                    for gvar in findvar:
-                        wf.write(gvar + "\n")
+                reads, writes = self.parse_global_access_c(funcs[func], global_vars)
+                # subtract local vars from global vars
+                func_globals[func] = (reads | writes) - local_vars
+                func_global_reads[func] = reads - local_vars
+                func_global_writes[func] = writes - local_vars
+
+        # save the whole call graph in one file
+        self.callgraph = CpuRegCallGraph()
+        self.callgraph.build(callstack_gen, func_globals, {func: func_unit_tracker[func][2] for func in funcs.keys()}, func_global_reads, func_global_writes)
+        if self.symbol_index is not None and self.symbol_index.vector_table() != "":
+            # the handlers of the vector table are the entry points of the program (slot order)
+            self.callgraph.set_roots(self.symbol_index.vector_entries())
+            print("vector table " + self.symbol_index.vector_table() + ": " + str(len(self.callgraph.roots)) + " roots")
+        self.callgraph.save(self.callgraph_file)
+
+        # everything else is collected here first {file: contents}, and only the changed files are written at the end
+        outputs = {}
+        if self.export_callstack_files:
+            outputs.update(self.callgraph.export_per_file(self.callstack_gen_dir, self.funcname_hashgen))
 
         # save processed function bodies
         for func in funcs.keys():
             new_file = os.path.join(self.proc_funcbody_dir, func_unit_tracker[func][2] + "." + self.funcname_hashgen(func))
-            with open(new_file, 'w') as wf:
-                wf.write(funcs[func])
+            outputs[new_file] = funcs[func]
+
+        written = self.manifest.write_outputs(outputs)
+        print("workspace files written: " + str(written) + "/" + str(len(outputs)))
 
     # now we will start parsing for all the functions (c and asm alike)
     def parse_functions(self, srcpaths: list, incpaths: list):
@@ -798,6 +1170,22 @@ class CpuRegParser:
             else:   # c file
                 srcpaths_c.append(srcpath)
 
+        # files may have been edited since the last generate of this parser (gui): hash them again
+        self.manifest.hash_memo = {}
+        self.cache.hash_memo = {}
+
+        # whatever was generated before (if any) is reused for the unchanged sources
+        self.manifest.load()
+        self.manifest.prune_sources(srcpaths)
+
+        # a different gcc may preprocess differently, so its version goes into the cache key
+        if self.cache.enabled:
+            gcc_version = subprocess.run(["gcc", "-dumpfullversion", "-dumpversion"], stdout = subprocess.PIPE, encoding = "UTF-8")
+            self.cache_gcc_version = gcc_version.stdout.strip()
+        if self.preprocessor == "builtin":
+            self.parse_builtin_preprocessor_init()
+
+        self.symbol_sources = {}
         funcs, func_unit_tracker, global_vars, param_vars = self.parse_functions_c_write(srcpaths_c, incpaths)   
         # generate all c files and their func bodies & callstack
         funcs_v, func_unit_tracker_v = self.parse_functions_asm_write(srcpaths_asm, incpaths)   
@@ -811,16 +1199,86 @@ class CpuRegParser:
             if func_unit_tracker.get(func, None) == None:
                 func_unit_tracker[func] = [0, 0, "unknown.c"]
 
+        # special register assignments and data tables of every source (vector table -> call graph roots)
+        self.symbol_index = CpuRegSymbolIndex(self.target_platform)
+        self.symbol_index.build(self.symbol_sources)
+        self.symbol_index.save(self.symbols_file)
+        print("special register assignments: " + ", ".join(reg + " " + str(len(sites)) for reg, sites in sorted(self.symbol_index.sysregs.items())))
+
         self.parse_functions_process_callstack(funcs, func_unit_tracker, global_vars, param_vars) # generate callstack and write to file.
+        self.manifest.save()
+        self.cache.evict()
 
         # TODO: test
         with open("global_vars.txt", 'w') as wf:
             for gvar in global_vars:
                 wf.write(gvar + "\n")
 
+    # conformance check of the builtin preprocessor against gcc -E (the reference)
+    # every source is parsed with both backends (no cache) and the extracted index is compared:
+    # function bodies (white space does not matter), globals and params have to be the same,
+    # line numbers (func_unit_tracker) only get reported, they may differ around macros of system headers
+    # returns the number of sources that do not match
+    def parse_check_preprocessor(self, srcpaths: list, incpaths: list) -> int:
+        cache_enabled = self.cache.enabled
+        preprocessor = self.preprocessor
+        self.cache.enabled = False
+        self.parse_builtin_preprocessor_init()
+        mismatches = 0
+        for srcpath in sorted(srcpaths):
+            method_name = "parse_functions_asm_persrc" if srcpath.split(".")[-1] in self.asm_ext else "parse_functions_c_persrc"
+            results = {}
+            for backend in ("gcc", "builtin"):
+                self.preprocessor = backend
+                results[backend] = getattr(self, method_name)(srcpath, incpaths)
+            problems = self.parse_compare_index(results["gcc"], results["builtin"])
+            if len(problems) > 0:
+                mismatches += 1
+            for problem in problems:
+                print("preprocessor check: " + srcpath + ": " + problem)
+            for func, tracker in sorted(results["gcc"][1].items()):
+                other = results["builtin"][1].get(func, None)
+                if other is not None and other[0:2] != tracker[0:2]:
+                    print("preprocessor check: " + srcpath + ": " + func + " lines " + str(tracker[0:2]) + " (gcc) " + str(other[0:2]) + " (builtin)")
+        self.preprocessor = preprocessor
+        self.cache.enabled = cache_enabled
+        print("preprocessor check: " + str(len(srcpaths) - mismatches) + "/" + str(len(srcpaths)) + " sources match")
+        return mismatches
+
+    # persrc results: (funcs, tracker, [globals, params, inline asm,] symbols (special register sites, tables), deps)
+    def parse_compare_index(self, expected: tuple, actual: tuple) -> list:
+        problems = []
+        funcs_e = {func: " ".join(body.split()) for func, body in expected[0].items()}
+        funcs_a = {func: " ".join(body.split()) for func, body in actual[0].items()}
+        for func in sorted(funcs_e.keys() - funcs_a.keys()):
+            problems.append(func + " missing")
+        for func in sorted(funcs_a.keys() - funcs_e.keys()):
+            problems.append(func + " not expected")
+        for func in sorted(funcs_e.keys() & funcs_a.keys()):
+            if funcs_e[func] != funcs_a[func]:
+                problems.append(func + " body differs")
+        if len(expected) > 4:
+            if expected[2] != actual[2]:
+                problems.append("globals differ: " + " ".join(sorted(expected[2] ^ actual[2])))
+            for func in sorted(expected[3].keys() | actual[3].keys()):
+                if expected[3].get(func, None) != actual[3].get(func, None):
+                    problems.append(func + " params differ")
+            for func in sorted(expected[4].keys() | actual[4].keys()):
+                if expected[4].get(func, None) != actual[4].get(func, None):
+                    problems.append(func + " inline asm differs")
+        if sorted(site[0:2] for site in expected[-2]["sites"]) != sorted(site[0:2] for site in actual[-2]["sites"]):
+            problems.append("special register assignments differ")
+        if expected[-2]["tables"] != actual[-2]["tables"] or expected[-2]["aliases"] != actual[-2]["aliases"]:
+            problems.append("data tables differ")
+        if expected[-1] != actual[-1]:
+            problems.append("includes differ: " + " ".join(sorted(expected[-1] ^ actual[-1])))
+        return problems
+
     # srcpaths: should return list of source files
     def parse_per_target_platform(self, target_platform: str, incpaths: list) -> set:
         self.asm_ext = []   # reset
+        self.target_platform = target_platform
+        self.regfile = CpuRegRegFile(target_platform)
 
         # get extension
         if target_platform not in self.supported_platforms:
@@ -834,6 +1292,8 @@ class CpuRegParser:
             self.asm_pop_pattern = self.rh850_pop_pattern
             self.asm_regname_intrinsics = self.rh850_regname_intrinsics
             self.asm_branch_pattern = self.rh850_branch_pattern
+            self.asm_branch_ops = self.rh850_branch_ops
+            self.asm_return_pattern = self.rh850_return_pattern
         elif target_platform == "armv7m":
             # asm extension
             self.asm_ext.append("s")
@@ -843,6 +1303,8 @@ class CpuRegParser:
             self.asm_pop_pattern = self.armv7m_pop_pattern
             self.asm_regname_intrinsics = self.armv7m_regname_intrinsics
             self.asm_branch_pattern = self.armv7m_branch_pattern
+            self.asm_branch_ops = self.armv7m_branch_ops
+            self.asm_return_pattern = self.armv7m_return_pattern
 
         # get source files
         srcpaths = set()
@@ -855,12 +1317,21 @@ class CpuRegParser:
         
         return srcpaths
 
-    def parse_workspace_cleanup(self):
-        # delete whole workspace directory
-        if os.path.exists(self.mw_workspace_dir) and os.path.isdir(self.mw_workspace_dir):
-            shutil.rmtree(self.mw_workspace_dir)
+    # gcc flags recorded per source in the manifest (if these change, the source is parsed again)
+    def parse_gcc_flags(self, incpaths: list) -> dict:
+        return {"platform": self.target_platform, "incpaths": list(incpaths), "preprocessor": self.preprocessor, "parser": self.parser_version}
+
+    # keep whatever is in the workspace (for incremental generate)
+    def parse_workspace_init(self):
         os.makedirs(self.mw_workspace_dir, exist_ok = True)
         os.makedirs(self.pf_workspace_dir, exist_ok = True)
         os.makedirs(self.callstack_gen_dir, exist_ok = True)
         os.makedirs(self.proc_funcbody_dir, exist_ok = True)
+        os.makedirs(self.srcindex_dir, exist_ok = True)
+
+    def parse_workspace_cleanup(self):
+        # delete whole workspace directory
+        if os.path.exists(self.mw_workspace_dir) and os.path.isdir(self.mw_workspace_dir):
+            shutil.rmtree(self.mw_workspace_dir)
+        self.parse_workspace_init()
 
@@ -0,0 +1,74 @@
+import os
+import signal
+import asyncio
+import subprocess
+
+# CpuRegGccScheduler
+# runs gcc -E for many sources at once from one asyncio event loop (argv lists, no shell).
+#
+# CpuRegGccScheduler(concurrency, timeout, retries)
+# await run(argv, srctext=None, cwd=None) -> (status, stdout, stderr)
+# 1. at most `concurrency` gcc processes run at the same time (the rest wait on a semaphore)
+# 2. a gcc that runs longer than `timeout` seconds is killed (0 = no limit)
+# 3. a gcc that timed out, died on a signal or could not be started is tried again, `retries` times
+# 4. stdout and stderr are both captured, nothing goes to the terminal on its own
+#    status: "ok" (exit 0), "error" (gcc complained, stdout may still hold a partial result),
+#            "timeout" or "failed" (after the retries, stdout is empty)
+#
+# the caller awaits run() for every source and can parse a result as soon as it is there,
+# while the other gcc processes keep going (CpuRegParser.parse_run_jobs_gcc).
+
+class CpuRegGccScheduler:
+    def __init__(self, concurrency: int = 1, timeout: float = 0, retries: int = 1):
+        self.concurrency = max(concurrency, 1)
+        self.timeout = timeout
+        self.retries = retries
+        self.semaphore = None   # created on first use, it belongs to the running loop
+
+    async def run(self, argv: list, srctext: str = None, cwd: str = None) -> tuple:
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.concurrency)
+        async with self.semaphore:
+            status = "failed"
+            stderr = ""
+            for attempt in range(self.retries + 1):
+                status, stdout, stderr = await self.run_once(argv, srctext, cwd)
+                if status == "ok" or status == "error":
+                    return status, stdout, stderr
+            return status, "", stderr
+
+    async def run_once(self, argv: list, srctext: str, cwd: str = None) -> tuple:
+        try:
+            # own process group: gcc is only the driver, cc1 has to go down with it on a timeout
+            proc = await asyncio.create_subprocess_exec(*argv,
+                                                        stdin = subprocess.DEVNULL if srctext is None else subprocess.PIPE,
+                                                        stdout = subprocess.PIPE, stderr = subprocess.PIPE, cwd = cwd,
+                                                        start_new_session = os.name == "posix")
+        except OSError as e:
+            return "failed", "", str(e)
+
+        try:
+            stdout, stderr = await asyncio.wait_for(proc.communicate(None if srctext is None else srctext.encode("UTF-8")),
+                                                    self.timeout if self.timeout > 0 else None)
+        except asyncio.TimeoutError:
+            self.kill(proc)
+            await proc.wait()
+            return "timeout", "", "timed out after " + str(self.timeout) + "s"
+        except asyncio.CancelledError:
+            self.kill(proc)
+            raise
+
+        stdout = stdout.decode("UTF-8", errors = "replace")
+        stderr = stderr.decode("UTF-8", errors = "replace")
+        if proc.returncode < 0:
+            return "failed", "", stderr + "killed by signal " + str(-proc.returncode)
+        return ("ok" if proc.returncode == 0 else "error"), stdout, stderr
+
+    def kill(self, proc):
+        try:
+            if os.name == "posix":
+                os.killpg(proc.pid, signal.SIGKILL)
+            else:
+                proc.kill()
+        except ProcessLookupError:
+            pass
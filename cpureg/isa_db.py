@@ -0,0 +1,146 @@
+import re
+from cpureg.regfile import CpuRegRegFile
+
+# CpuRegIsaDb
+# which operands an instruction reads and writes, per ISA (shared by cpuhazard-checker and the clobber analysis).
+#
+# isa_db[isa]["instrs"][OPCODE] = {"read": [operand positions], "write": [operand positions]}
+# operands are what is left after splitting the line on spaces, commas and parens (the opcode is not counted):
+#   armv7m "ADD R3, R1, R4"   -> 0: R3, 1: R1, 2: R4   (destination first)
+#   rh850  "add r1, r2"       -> 0: r1, 1: r2          (destination last)
+#
+# CpuRegIsaDb(isa).decode(line: str) -> (OPCODE or None, read register mask, write register mask)
+# 1. the opcode is looked up as is, then without the .w/.n width, the s (set flags) and the condition suffix (armv7m)
+# 2. registers of the operands are turned into a bitmask by the CpuRegRegFile of the isa (aliases like sp/lr included)
+# unknown opcodes give (None, 0, 0)
+
+class CpuRegIsaDb:
+    isa_db = {
+        'armv7m': {
+            'instrs': {
+                'MOV': {'read': [1], 'write': [0]},
+                'MVN': {'read': [1], 'write': [0]},
+                'ADD': {'read': [1,2], 'write': [0]},
+                'ADC': {'read': [1,2], 'write': [0]},
+                'SUB': {'read': [1,2], 'write': [0]},
+                'SBC': {'read': [1,2], 'write': [0]},
+                'RSB': {'read': [1,2], 'write': [0]},
+                'MUL': {'read': [1,2], 'write': [0]},
+                'MLA': {'read': [1,2,3], 'write': [0]},
+                'AND': {'read': [1,2], 'write': [0]},
+                'ORR': {'read': [1,2], 'write': [0]},
+                'EOR': {'read': [1,2], 'write': [0]},
+                'BIC': {'read': [1,2], 'write': [0]},
+                'LSL': {'read': [1,2], 'write': [0]},
+                'LSR': {'read': [1,2], 'write': [0]},
+                'ASR': {'read': [1,2], 'write': [0]},
+                'ROR': {'read': [1,2], 'write': [0]},
+                'LDR': {'read': [1], 'write': [0]},
+                'LDRB': {'read': [1], 'write': [0]},
+                'LDRH': {'read': [1], 'write': [0]},
+                'STR': {'read': [0,1], 'write': []},
+                'STRB': {'read': [0,1], 'write': []},
+                'STRH': {'read': [0,1], 'write': []},
+                'CMP': {'read': [0,1], 'write': []},
+                'TST': {'read': [0,1], 'write': []},
+                'MRS': {'read': [], 'write': [0]},
+                'MSR': {'read': [1], 'write': []},
+                'BL':  {'read': [], 'write': ['lr']},
+                'BLX': {'read': [0], 'write': ['lr']},
+                'BX':  {'read': [0], 'write': []},
+                'CBZ': {'read': [0], 'write': []},
+                'CBNZ': {'read': [0], 'write': []},
+                'B':   {'read': [], 'write': []}
+            }
+        },
+        'rh850': {
+            'instrs': {
+                'MOV': {'read': [0], 'write': [1]},
+                'MOVEA': {'read': [0,1], 'write': [2]},
+                'MOVHI': {'read': [0,1], 'write': [2]},
+                'ADD': {'read': [0,1], 'write': [1]},
+                'ADDI': {'read': [0,1], 'write': [2]},
+                'SUB': {'read': [0,1], 'write': [1]},
+                'SUBR': {'read': [0,1], 'write': [1]},
+                'MUL': {'read': [0,1], 'write': [1,2]},
+                'AND': {'read': [0,1], 'write': [1]},
+                'ANDI': {'read': [0,1], 'write': [2]},
+                'OR': {'read': [0,1], 'write': [1]},
+                'ORI': {'read': [0,1], 'write': [2]},
+                'XOR': {'read': [0,1], 'write': [1]},
+                'XORI': {'read': [0,1], 'write': [2]},
+                'SHL': {'read': [0,1], 'write': [1]},
+                'SHR': {'read': [0,1], 'write': [1]},
+                'SAR': {'read': [0,1], 'write': [1]},
+                'LD.B': {'read': [0], 'write': [1]},
+                'LD.BU': {'read': [0], 'write': [1]},
+                'LD.H': {'read': [0], 'write': [1]},
+                'LD.HU': {'read': [0], 'write': [1]},
+                'LD.W': {'read': [0], 'write': [1]},
+                'ST.B': {'read': [0,1], 'write': []},
+                'ST.H': {'read': [0,1], 'write': []},
+                'ST.W': {'read': [0,1], 'write': []},
+                'CMP': {'read': [0,1], 'write': []},
+                'LDSR': {'read': [0], 'write': []},
+                'STSR': {'read': [], 'write': [1]},
+                'JARL': {'read': [], 'write': [1]},
+                'JR':  {'read': [], 'write': []},
+                'JMP': {'read': [0], 'write': []},
+                'BR':  {'read': [], 'write': []}
+            }
+        }
+    }
+    rh850_cond_branches = ('BC', 'BE', 'BGE', 'BGT', 'BH', 'BL', 'BLE', 'BLT', 'BN', 'BNC', 'BNE', 'BNH', 'BNL', 'BNV', 'BNZ', 'BP', 'BSA', 'BV', 'BZ')
+    isa_db['rh850']['instrs'].update({op: {'read': [], 'write': []} for op in rh850_cond_branches})
+    # opcodes that end a basic block (armv7m conditional branches decode to B)
+    branch_ops = {'armv7m': {'B', 'BX', 'CBZ', 'CBNZ'}, 'rh850': {'BR', 'JR', 'JMP'} | set(rh850_cond_branches)}
+
+    split_pattern = re.compile(r"[ ,()]+")
+    register_pattern = re.compile(r"[A-Za-z]\w*")
+    armv7m_conds = ("EQ", "NE", "CS", "HS", "CC", "LO", "MI", "PL", "VS", "VC", "HI", "LS", "GE", "LT", "GT", "LE", "AL")
+
+    def __init__(self, isa: str):
+        self.isa = isa
+        self.instrs = self.isa_db[isa]['instrs']
+        self.regfile = CpuRegRegFile(isa)
+
+    def lookup(self, opc: str):
+        opc = opc.upper()
+        if opc in self.instrs:
+            return opc
+        if opc.endswith((".W", ".N")):
+            opc = opc[:-2]
+            if opc in self.instrs:
+                return opc
+        if self.isa == "armv7m":
+            if opc[-2:] in self.armv7m_conds and opc[:-2] in self.instrs:
+                opc = opc[:-2]
+            if opc.endswith("S") and opc[:-1] in self.instrs:
+                opc = opc[:-1]
+            if opc in self.instrs:
+                return opc
+        return None
+
+    # registers named in one operand (R1, [R2], 4[r2], sp!, ...)
+    def operand_mask(self, operand: str) -> int:
+        return self.regfile.mask(self.register_pattern.findall(operand))
+
+    def decode(self, line: str) -> tuple:
+        parts = [part for part in self.split_pattern.split(line.strip()) if part != ""]
+        if len(parts) == 0:
+            return None, 0, 0
+        opc = self.lookup(parts[0])
+        if opc is None:
+            return None, 0, 0
+        info = self.instrs[opc]
+        reads = 0
+        writes = 0
+        for i in info['read']:
+            if i + 1 < len(parts):
+                reads |= self.operand_mask(parts[i + 1])
+        for i in info['write']:
+            if isinstance(i, str):
+                writes |= self.regfile.mask([i])    # implicit (bl writes lr)
+            elif i + 1 < len(parts):
+                writes |= self.operand_mask(parts[i + 1])
+        return opc, reads, writes
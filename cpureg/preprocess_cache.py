@@ -0,0 +1,136 @@
+import os
+import json
+import hashlib
+
+# CpuRegCache
+# persistent preprocessing cache shared by every workspace (and every platform) on the machine.
+# the gcc -E output of a source only depends on the source, the headers it pulled in and the command line,
+# so the same tree generated for armv7m and rh850, or on two branches, hits the same entries.
+#
+# lookup is done in two steps (we only know which headers a source pulls in after preprocessing it):
+# 1. source key = hash(kind, parser version, command line, directory of the source, source contents)
+#    (the directory is in there because #include "x.h" is looked up next to the source first:
+#    the same contents somewhere else may pull in a different x.h that is not among the recorded headers.
+#    asm sources are fed to gcc through stdin, gcc runs in their directory so that this holds for them too)
+#    <source key>.manifest.json keeps the header sets seen for that source key: [{header: hash}, ...]
+# 2. for every header set, hash the headers again; if all of them still match,
+#    result key = hash(source key, headers and their hashes) -> <result key>.json
+#    {"lines": preprocessed lines, "deps": [headers], "index": parsed function index}
+#
+# the cache is bounded by size, the least recently used results go first (hits refresh the mtime).
+
+class CpuRegCache:
+    version = 1
+    max_candidates = 8  # header sets remembered per source key
+
+    def __init__(self, cache_dir: str = "", max_size: int = 1024 * 1024 * 1024):
+        if cache_dir == "":
+            cache_dir = os.environ.get("CPUREG_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "cpureg"))
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.enabled = True
+        self.hash_memo = {}     # header path -> sha1 (per generate, cleared by CpuRegParser.parse_functions)
+
+    def file_hash(self, path: str) -> str:
+        if path in self.hash_memo:
+            return self.hash_memo[path]
+        try:
+            with open(path, 'rb') as f:
+                htemp = hashlib.sha1(f.read()).hexdigest()
+        except OSError:
+            htemp = ""
+        self.hash_memo[path] = htemp
+        return htemp
+
+    def entry_path(self, key: str, suffix: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], key + suffix)
+
+    # kind: "c" or "asm" (what the index was parsed with)
+    # argv: effective preprocessor command line
+    # srchash: hash of whatever is fed into gcc
+    # srcpath: the source itself (only its absolute directory goes into the key)
+    def source_key(self, kind: str, argv: list, srchash: str, srcpath: str) -> str:
+        keystr = "\0".join([str(self.version), kind] + argv + [os.path.dirname(os.path.abspath(srcpath)), srchash])
+        return hashlib.sha1(keystr.encode("utf-8")).hexdigest()
+
+    def result_key(self, source_key: str, deps: dict) -> str:
+        keystr = source_key + "".join("\0" + dep + "\0" + deps[dep] for dep in sorted(deps))
+        return hashlib.sha1(keystr.encode("utf-8")).hexdigest()
+
+    def read_json(self, path: str):
+        try:
+            with open(path, 'r', encoding="UTF-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def write_json(self, path: str, data):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_file = path + "." + str(os.getpid()) + ".tmp"
+        with open(tmp_file, 'w', encoding="UTF-8") as f:
+            json.dump(data, f)
+        os.replace(tmp_file, path)
+
+    # returns the cached payload or None
+    def get(self, source_key: str):
+        if not self.enabled:
+            return None
+        manifest_file = self.entry_path(source_key, ".manifest.json")
+        candidates = self.read_json(manifest_file)
+        if candidates is None:
+            return None
+        for deps in candidates:
+            if all(self.file_hash(dep) == dephash for dep, dephash in deps.items()):
+                result_file = self.entry_path(self.result_key(source_key, deps), ".json")
+                payload = self.read_json(result_file)
+                if payload is not None:
+                    try:
+                        # LRU
+                        os.utime(result_file)
+                        os.utime(manifest_file)
+                    except OSError:
+                        pass
+                    return payload
+        return None
+
+    # deps: headers gcc pulled in, payload: {"lines": [...], "index": {...}}
+    def put(self, source_key: str, deps: set, payload: dict):
+        if not self.enabled:
+            return
+        dephashes = {dep: self.file_hash(dep) for dep in sorted(deps)}
+        payload["deps"] = sorted(deps)
+        try:
+            self.write_json(self.entry_path(self.result_key(source_key, dephashes), ".json"), payload)
+            manifest_file = self.entry_path(source_key, ".manifest.json")
+            candidates = self.read_json(manifest_file) or []
+            candidates = [dephashes] + [c for c in candidates if c != dephashes]
+            self.write_json(manifest_file, candidates[:self.max_candidates])
+        except OSError as e:
+            print("cannot write to the cache: " + str(e))
+
+    # drop the least recently used results until the cache fits in max_size
+    def evict(self):
+        if not self.enabled or not os.path.isdir(self.cache_dir):
+            return
+        entries = []
+        total = 0
+        for root, dirs, files in os.walk(self.cache_dir):
+            for file in files:
+                path = os.path.join(root, file)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                total += st.st_size
+                entries.append((st.st_mtime, st.st_size, path))
+        if total <= self.max_size:
+            return
+        entries.sort()
+        for mtime, size, path in entries:
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            if total <= self.max_size:
+                break
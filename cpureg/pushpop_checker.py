@@ -0,0 +1,79 @@
+from cpureg.asm_parser import CpuRegAsmEngine
+
+# CpuRegPushPopChecker
+# whole program push/pop balance, across asm functions and the inline asm of c functions.
+#
+# CpuRegPushPopChecker(callgraph, arch).check(asm_bodies: {func: asm text}) -> list of problems
+# 1. every function gets a local delta per register (CpuRegAsmEngine: push +1, pop -1),
+#    c functions only contribute their inline asm (captured at generate, CpuRegParser.parse_load_asm_bodies)
+# 2. the deltas are summed bottom-up over the condensed call graph (CpuRegCallGraph.fold_callees):
+#    effect(component) = deltas of its members + effect of every callee component
+#    so a push in one function that is popped by a callee (or the other way around) comes out balanced.
+#    every component is summarized once, no matter how many paths run through it.
+# 3. a recursion cycle whose members do not balance each other drifts on every round: reported as such
+# 4. every entry point (component without callers) whose effect is not zero is reported,
+#    with the functions below it that push/pop that register without a partner
+#
+# problems: (func, kind, {reg name: delta}, [functions the imbalance comes from])
+#   kind: "entry" (entry point does not balance) or "recursion" (cycle that does not balance, func is its first member)
+
+class CpuRegPushPopChecker:
+    def __init__(self, callgraph, arch: str):
+        self.callgraph = callgraph
+        self.engine = CpuRegAsmEngine(arch)
+        self.regfile = self.engine.regfile
+        self.local = []     # func id -> push/pop delta per register
+        self.effect = []    # component id -> delta per register, callees included (memoized summaries)
+
+    def summarize(self, asm_bodies: dict):
+        self.local = []
+        for func in self.callgraph.funcs:
+            counters, touched = self.engine.regmap_function(asm_bodies.get(func, ""))
+            self.local.append(counters)
+
+        def combine(comp: int, callee_effects: list) -> list:
+            effect = self.regfile.counters()
+            for member in self.callgraph.scc_members[comp]:
+                effect = [a + b for a, b in zip(effect, self.local[member])]
+            for callee_effect in callee_effects:
+                effect = [a + b for a, b in zip(effect, callee_effect)]
+            return effect
+
+        self.effect = self.callgraph.fold_callees(combine)
+
+    def delta_names(self, delta: list) -> dict:
+        return {self.regfile.name(i): d for i, d in enumerate(delta) if d != 0}
+
+    # functions (below func ids) that push/pop the registers of mask without a partner in the same function
+    def origins(self, ids: list, mask: int) -> list:
+        funcs = []
+        for i in self.callgraph.bits_to_ids(self.callgraph.reach_bits(ids)):
+            if any(self.local[i][r] != 0 for r in self.regfile.indices(mask)):
+                funcs.append(self.callgraph.funcs[i])
+        return funcs
+
+    def check(self, asm_bodies: dict) -> list:
+        self.summarize(asm_bodies)
+        problems = []
+        for comp, members in enumerate(self.callgraph.scc_members):
+            if self.callgraph.scc_cyclic[comp] == 0:
+                continue
+            cycle = self.regfile.counters()
+            for member in members:
+                cycle = [a + b for a, b in zip(cycle, self.local[member])]
+            drift = self.delta_names(cycle)
+            if len(drift) > 0:
+                mask = self.regfile.mask(drift.keys())
+                problems.append((self.callgraph.funcs[members[0]], "recursion", drift,
+                                 [self.callgraph.funcs[m] for m in members if any(self.local[m][r] != 0 for r in self.regfile.indices(mask))]))
+
+        for comp in self.entry_components():
+            delta = self.delta_names(self.effect[comp])
+            if len(delta) > 0:
+                members = self.callgraph.scc_members[comp]
+                problems.append((self.callgraph.funcs[members[0]], "entry", delta, self.origins(members, self.regfile.mask(delta.keys()))))
+        return problems
+
+    # components nobody else calls (a plain function without callers, or a recursion cycle only called from inside)
+    def entry_components(self) -> list:
+        return [comp for comp in range(len(self.callgraph.scc_members)) if len(self.callgraph.scc_callers[comp]) == 0]
@@ -0,0 +1,91 @@
+import re
+
+# CpuRegRegFile
+# register file model of an ISA, shared by the push/pop engine, the parser and the hazard checker.
+# every register has an index, a set of registers is an int bitmask (bit n = register n),
+# so unions / intersections / subset tests are single integer ops and nothing gets allocated per register.
+#
+# CpuRegRegFile(arch: str)
+# 1. names: "r0".."rN" plus the aliases of the arch (the *_regname_intrinsics of CpuRegParser, sp/lr/pc, gp/tp/ep/lp)
+#    all lower case, index(name) does the lower() itself
+# 2. mask(names) / names(mask) convert between the two, name(i) is the canonical name ("r13", never "sp")
+# 3. parse_reglist("{r4-r7, lr}") -> mask (braces, commas and rx-ry ranges)
+# 4. counters() -> [0] * size, add(counters, mask, delta) for push/pop counting per register
+
+class CpuRegRegFile:
+    arch_sizes = {"armv7m": 16, "rh850": 32}
+    arch_intrinsics = {
+        "armv7m": {"sp": "r13", "lr": "r14", "pc": "r15"},
+        "rh850": {"sp": "r3", "lr": "r31", "gp": "r4", "tp": "r5", "ep": "r30", "lp": "r31"}
+    }
+    regrange_pattern = re.compile(r"([a-z]+)(\d+)\s*-\s*([a-z]+)(\d+)$")
+
+    def __init__(self, arch: str = "armv7m"):
+        if arch not in self.arch_sizes:
+            arch = "armv7m"
+        self.arch = arch
+        self.size = self.arch_sizes[arch]
+        self.all_mask = (1 << self.size) - 1
+        self.canonical = ["r" + str(i) for i in range(self.size)]
+        self.name_to_index = {name: i for i, name in enumerate(self.canonical)}
+        for alias, name in self.arch_intrinsics[arch].items():
+            self.name_to_index[alias] = self.name_to_index[name]
+
+    # None if name is not a register of this arch
+    def index(self, name: str) -> int:
+        return self.name_to_index.get(name.strip().lower(), None)
+
+    def name(self, index: int) -> str:
+        return self.canonical[index]
+
+    def mask(self, names) -> int:
+        mask = 0
+        for name in names:
+            i = self.index(name)
+            if i is not None:
+                mask |= 1 << i
+        return mask
+
+    # register indices in a mask, lowest first
+    def indices(self, mask: int) -> list:
+        indices = []
+        while mask:
+            low = mask & -mask
+            indices.append(low.bit_length() - 1)
+            mask ^= low
+        return indices
+
+    def names(self, mask: int) -> list:
+        return [self.canonical[i] for i in self.indices(mask)]
+
+    def range_mask(self, first: int, last: int) -> int:
+        return ((1 << (last + 1)) - 1) & ~((1 << first) - 1)
+
+    # "r4, r5-r7, lr" or "{r4-r7, lr}" -> mask (anything that is not a register is ignored)
+    def parse_reglist(self, text: str) -> int:
+        mask = 0
+        for part in text.replace("{", "").replace("}", "").split(","):
+            part = part.strip().lower()
+            if part == "":
+                continue
+            if "-" in part:
+                m = self.regrange_pattern.match(part)
+                if m and m.group(1) == m.group(3):
+                    first = self.name_to_index.get(m.group(1) + m.group(2), None)
+                    last = self.name_to_index.get(m.group(3) + m.group(4), None)
+                    if first is not None and last is not None and first <= last:
+                        mask |= self.range_mask(first, last)
+                continue
+            i = self.name_to_index.get(part, None)
+            if i is not None:
+                mask |= 1 << i
+        return mask
+
+    def counters(self) -> list:
+        return [0] * self.size
+
+    def add(self, counters: list, mask: int, delta: int):
+        while mask:
+            low = mask & -mask
+            counters[low.bit_length() - 1] += delta
+            mask ^= low
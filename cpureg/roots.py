@@ -0,0 +1,56 @@
+from cpureg.stack_usage import CpuRegStackUsage
+
+# CpuRegRoots
+# analyses over all the roots of the call graph (the handlers of the vector table) at once,
+# instead of one -c run per isr.
+#
+# CpuRegRoots(callgraph, arch).analyze(asm_bodies: {func: asm text})
+# 1. reach: one top-down pass over the condensed graph (CpuRegCallGraph.root_masks),
+#    every component gets the bitset of the roots that can end up calling into it
+#    reachable[r] = number of functions roots[r] can end up calling, itself included
+# 2. stack: one bottom-up pass (CpuRegStackUsage) gives the worst case depth of every component,
+#    depths[r] is the one of the root's component (None: recursion, unbounded)
+# 3. globals: one pass over the functions, every global collects the roots of the functions touching it
+#    shared = [(global name, [root func], [root func that writes it])] for globals touched by more than one root
+#    (a global written under one isr and read under another needs a lock or has to be atomic)
+
+class CpuRegRoots:
+    def __init__(self, callgraph, arch: str):
+        self.callgraph = callgraph
+        self.arch = arch
+        self.masks = []     # component id -> bitset of roots
+        self.reachable = []
+        self.depths = []
+        self.shared = []
+
+    def root_funcs(self, mask: int) -> list:
+        return [self.callgraph.funcs[self.callgraph.roots[r][1]] for r in range(len(self.callgraph.roots)) if (mask >> r) & 1]
+
+    def analyze(self, asm_bodies: dict):
+        callgraph = self.callgraph
+        roots = callgraph.roots
+        self.masks = callgraph.root_masks()
+
+        self.reachable = [0] * len(roots)
+        for comp, mask in enumerate(self.masks):
+            while mask:
+                low = mask & -mask
+                self.reachable[low.bit_length() - 1] += len(callgraph.scc_members[comp])
+                mask ^= low
+
+        usage = CpuRegStackUsage(callgraph, self.arch)
+        usage.analyze(asm_bodies)
+        self.depths = [usage.depths[callgraph.scc_of[i]] for slot, i in roots]
+
+        touched = [0] * len(callgraph.globals)
+        written = [0] * len(callgraph.globals)
+        for g in range(len(callgraph.globals)):
+            for i in callgraph.reader_ids[callgraph.reader_offsets[g]:callgraph.reader_offsets[g + 1]]:
+                touched[g] |= self.masks[callgraph.scc_of[i]]
+            for i in callgraph.writer_ids[callgraph.writer_offsets[g]:callgraph.writer_offsets[g + 1]]:
+                touched[g] |= self.masks[callgraph.scc_of[i]]
+                written[g] |= self.masks[callgraph.scc_of[i]]
+        self.shared = []
+        for g, gvar in enumerate(callgraph.globals):
+            if bin(touched[g]).count("1") > 1:
+                self.shared.append((gvar, self.root_funcs(touched[g]), self.root_funcs(written[g])))
@@ -285,19 +285,15 @@ QScrollBar:vertical, QScrollBar:horizontal {
             self.tree.setExpanded(src_item.index(), True)
 
     def load_call_list(self, func_name: str) -> set[str]:
-        # Use cpureg_parser's funcname_hashgen method
-        call_list_file = os.path.join(self.cpureg.callstack_gen_dir, self.cpureg.funcname_hashgen(func_name))
-        print("[DEBUG] Reading call list file: " + call_list_file)
+        # Use cpureg_parser's call graph (callgraph.json)
+        callees = self.cpureg.parse_load_callgraph().callees(func_name)
         functions = set()
-        if os.path.exists(call_list_file):
-            with open(call_list_file, "r", encoding="utf-8") as f:
-                for line in f:
-                    func = line.strip()
-                    print("[DEBUG] Call list line: '" + func + "'")
-                    if func:
-                        functions.add(func)
+        if callees is not None:
+            for func in callees:
+                if func:
+                    functions.add(func)
         else:
-            print("[DEBUG] Call list file does not exist: " + call_list_file)
+            print("[DEBUG] Function is not in the call graph: " + func_name)
         print("[DEBUG] Final call list for '" + func_name + "': " + str(functions))
         return functions
 
@@ -399,7 +395,7 @@ QScrollBar:vertical, QScrollBar:horizontal {
             try:
                 CpuRegApp().check_gcc()
                 srcpaths = self.cpureg.parse_per_target_platform(target_platform, include_paths)
-                self.cpureg.parse_workspace_cleanup()
+                self.cpureg.parse_workspace_init()
                 self.cpureg.parse_functions(srcpaths, include_paths)
                 self.populate_tree()
                 # Reset source view after generate
@@ -0,0 +1,116 @@
+import re
+from cpureg.asm_parser import CpuRegAsmEngine
+
+# CpuRegStackUsage
+# worst case stack depth of every entry point, from the frame size of every function and the call graph.
+#
+# CpuRegStackUsage(callgraph, arch).analyze(asm_bodies: {func: asm text})
+# 1. frame size of a function = deepest point its own stack pointer reaches, in bytes (one pass over its lines):
+#    push / pop / stm / ldm (4 bytes per register, CpuRegAsmEngine.decode_line),
+#    the immediate of rh850 prepare / dispose (words), and sp arithmetic (sub sp, sp, #n / add -n, sp / addi -n, sp, sp)
+#    c functions only count their inline asm (the frame the compiler sets up is not known here)
+# 2. longest path over the condensed call graph (CpuRegCallGraph.fold_callees, callees first):
+#    depth(component) = frame + deepest callee, computed once per component
+#    a recursion cycle has no bound (None), and neither has anything that can call into one
+# 3. report() ranks the entry points (components without callers), unbounded ones first,
+#    each with the call chain of its worst case
+
+class CpuRegStackUsage:
+    word_size = 4
+    armv7m_sp_pattern = re.compile(r"^(sub|add)(?:s)?(?:\.w)?\s+sp\s*,\s*(?:sp\s*,\s*)?#\s*(-?(?:0x[0-9a-f]+|\d+))")
+    multiple_sp_pattern = re.compile(r"^\S+\s+(?:sp|r13)\s*!")
+    rh850_sp_pattern = re.compile(r"^(?:add|addi)\s+(-?(?:0x[0-9a-f]+|\d+))\s*,\s*sp\b")
+    rh850_frame_pattern = re.compile(r"^(prepare|dispose)\s+(.*)")
+    rh850_imm_pattern = re.compile(r"(?:^|,)\s*(0x[0-9a-f]+|\d+)\s*(?:,|$)")
+
+    def __init__(self, callgraph, arch: str):
+        self.callgraph = callgraph
+        self.engine = CpuRegAsmEngine(arch)
+        self.arch = self.engine.arch
+        self.frames = []    # func id -> frame size in bytes
+        self.depths = []    # component id -> worst case depth in bytes (None: unbounded)
+        self.deepest = []   # component id -> callee component of the worst case (-1: none)
+
+    # bytes the stack grows by with this instruction (negative: shrinks)
+    def stack_delta(self, line: str) -> int:
+        text = line.strip().lower()
+        sign, mask = self.engine.decode_line(text)
+        if text.startswith(("stm", "ldm")) and not self.multiple_sp_pattern.match(text):
+            mask = 0    # block transfer to/from some other base register, not the stack
+        delta = sign * self.word_size * bin(mask).count("1")
+        if self.arch == "armv7m":
+            m = self.armv7m_sp_pattern.match(text)
+            if m:
+                imm = int(m.group(2), 0)
+                delta += imm if m.group(1) == "sub" else -imm
+        elif self.arch == "rh850":
+            m = self.rh850_frame_pattern.match(text)
+            if m:
+                # prepare list, imm / dispose imm, list: imm is the number of words of the local frame
+                operands = re.sub(r"\{[^}]*\}|\[[^\]]*\]", "", m.group(2))
+                imm = self.rh850_imm_pattern.search(operands)
+                if imm:
+                    delta += (1 if m.group(1) == "prepare" else -1) * self.word_size * int(imm.group(1), 0)
+            else:
+                m = self.rh850_sp_pattern.match(text)
+                if m:
+                    delta -= int(m.group(1), 0)
+        return delta
+
+    def frame_size(self, body: str) -> int:
+        depth = 0
+        peak = 0
+        for line in body.splitlines():
+            depth += self.stack_delta(line)
+            if depth > peak:
+                peak = depth
+        return peak
+
+    def analyze(self, asm_bodies: dict):
+        self.frames = [self.frame_size(asm_bodies.get(func, "")) for func in self.callgraph.funcs]
+        self.deepest = []
+
+        def combine(comp: int, callee_depths: list):
+            callees = sorted(self.callgraph.scc_callees[comp])
+            deepest = -1
+            worst = 0
+            for callee, depth in zip(callees, callee_depths):
+                if depth is None:
+                    worst = None
+                    deepest = callee
+                    break
+                if depth > worst or deepest == -1:
+                    worst = depth
+                    deepest = callee
+            self.deepest.append(deepest)
+            if worst is None or self.callgraph.scc_cyclic[comp] == 1:
+                return None
+            return self.frames[self.callgraph.scc_members[comp][0]] + worst
+
+        self.depths = self.callgraph.fold_callees(combine)
+
+    # call chain of the worst case below comp (function names, a cycle is named by the function the path enters it through)
+    def worst_path(self, comp: int) -> list:
+        callgraph = self.callgraph
+        path = []
+        i = callgraph.scc_members[comp][0]
+        while True:
+            if callgraph.scc_cyclic[comp] == 1:
+                path.append(callgraph.funcs[i] + " (recursion)")
+                break
+            path.append(callgraph.funcs[i])
+            comp = self.deepest[comp]
+            if comp == -1:
+                break
+            # the callee of i that is in the next component
+            i = next(callee for callee in callgraph.callee_ids_of(i) if callgraph.scc_of[callee] == comp)
+        return path
+
+    # [(entry func, depth or None, worst path)] deepest first, unbounded (recursion) before everything else
+    def report(self) -> list:
+        entries = []
+        for comp in range(len(self.callgraph.scc_members)):
+            if len(self.callgraph.scc_callers[comp]) == 0:
+                entries.append((self.callgraph.funcs[self.callgraph.scc_members[comp][0]], self.depths[comp], self.worst_path(comp)))
+        entries.sort(key = lambda entry: (entry[1] is not None, -(entry[1] or 0), entry[0]))
+        return entries
@@ -0,0 +1,243 @@
+import re
+import os
+import json
+import mmap
+import threading
+import concurrent.futures
+
+# CpuRegSymbolIndex
+# where the special registers (VTOR, SCBP, ...) get assigned, and which symbol goes into them.
+# filled while the sources are generated, so finding the vector table later is a dictionary lookup.
+#
+# CpuRegSymbolIndex(arch).scan(lines: list, where: str = "") -> [[REG, symbol, where, line]]
+# one pass over the lines, every line goes through the patterns once:
+# 1. c:      VTOR = sym / VTOR = (cast)&sym                          -> site
+#            r0 = sym ... VTOR = r0                                   -> site (last symbol put into that gpr)
+# 2. armv7m: ldr r0, =sym / ldr r1, =0xE000ED08 ... str r0, [r1]     -> site (gpr holding the address of the register)
+# 3. rh850:  mov sym, r20 (movhi hi(sym) / movea lo(sym) too) ... ldsr r20, scbp -> site
+# register names are matched case-insensitive and recorded upper case.
+# the lines are never the source as written (preprocessed text, or an inline asm block split on its \n),
+# so a site is not given as source:line but as line (1-based) in where, what those lines are:
+# the generated file (name.generated.c, see keep_intermediates) or "func() inline asm" (line within the block)
+#
+# CpuRegSymbolIndex(arch).scan_tables(lines: list) -> ({label: [entry]}, {alias: target})
+# data tables of an asm source: a label directly followed by .word / .long / .4byte lines,
+# every entry is the symbol in that slot ("" for numbers and expressions, so slot numbers stay right).
+# .thumb_set / .equ aliases (weak handlers pointing at a default one) are kept to resolve the entries.
+# labels and symbols lose their leading '_' like the asm function names do
+#
+# CpuRegSymbolIndex(arch).scan_source(lines: list, asm: bool, where: str) -> {"sites": scan(lines, where), "tables": ..., "aliases": ...}
+# CpuRegSymbolIndex(arch).build(symbols: {src: scan_source result}) / save(path) / load(path) -> bool
+# sysregs[REG] = [[symbol, src, where, line]] (sorted by src, where and line), tables / aliases merged over the sources
+# lookup(REG) -> first symbol assigned to REG, "" if none
+# vector_entries() -> [(slot, handler)] of the vector table: the table assigned to VTOR / SCBP,
+# or else the only table with "vector" in its name (startup code that relies on the reset value of VTOR)
+#
+# CpuRegSymbolIndex(arch).rescan(paths: list, reg: str, jobs: int) -> (symbol, path)
+# fallback for workspaces without the index: the files are mapped (mmap) and scanned in parallel,
+# a file that does not even contain the register name (or address) is dropped without decoding it,
+# inline asm strings (everything on one line after preprocessing) are split on their \n first,
+# and the remaining files are not started anymore once the earliest file (in paths order) has a hit.
+
+class CpuRegSymbolIndex:
+    version = 3
+    arch_sysregs = {
+        "armv7m": {"VTOR": 0xE000ED08},             # memory mapped: name -> address
+        "rh850": {"SCBP": None, "EBASE": None, "INTBP": None}  # system registers (ldsr)
+    }
+    arch_vector_regs = {"armv7m": "VTOR", "rh850": "SCBP"}
+    symbol = r"([A-Za-z_.$][\w.$]*)"
+    gpr_assign_pattern = re.compile(r"\b(r\d+)\s*=\s*" + symbol, re.IGNORECASE)
+    armv7m_ldr_pattern = re.compile(r"\bldr(?:\.w)?\s+(r\d+)\s*,\s*=\s*(?:(0x[0-9a-f]+|\d+)\b|" + symbol + ")", re.IGNORECASE)
+    armv7m_str_pattern = re.compile(r"\bstr(?:\.w)?\s+(r\d+)\s*,\s*\[\s*(r\d+)\s*(?:,\s*#\s*0+\s*)?\]", re.IGNORECASE)
+    rh850_mov_pattern = re.compile(r"\b(?:mov|mov32|movhi|movea)\s+(?:(?:hi|lo|hi1)\s*\(\s*)?" + symbol + r"\s*\)?\s*,\s*(?:r0\s*,\s*)?(r\d+)\b", re.IGNORECASE)
+    rh850_ldsr_pattern = re.compile(r"\bldsr\s+(r\d+)\s*,\s*([A-Za-z_]\w*)", re.IGNORECASE)
+    gpr_name_pattern = re.compile(r"r\d+$", re.IGNORECASE)
+    label_pattern = re.compile(r"^\s*([A-Za-z_.$][\w.$]*)\s*:\s*(.*)$")
+    data_pattern = re.compile(r"^\s*\.(?:word|long|4byte|int)\s+(.*)$", re.IGNORECASE)
+    alias_pattern = re.compile(r"^\s*\.(?:thumb_set|equ)\s+([A-Za-z_.$][\w.$]*)\s*,\s*([A-Za-z_.$][\w.$]*)\s*$", re.IGNORECASE)
+    symbol_pattern = re.compile(symbol + "$")
+    skip_pattern = re.compile(r"^\s*(?:$|\.(?:align|balign|p2align|type|size|section|global|globl|weak)\b)", re.IGNORECASE)
+
+    def __init__(self, arch: str):
+        self.arch = arch
+        self.sysregs_of_arch = self.arch_sysregs.get(arch, {})
+        self.sysreg_addresses = {address: reg for reg, address in self.sysregs_of_arch.items() if address is not None}
+        self.sysregs = {}   # REG -> [[symbol, src, where, line]]
+        self.tables = {}    # label -> [symbol per slot]
+        self.aliases = {}   # alias -> target
+        names = "|".join(sorted(self.sysregs_of_arch)) or "(?!)"
+        # VTOR = sym (casts and & skipped), or VTOR = r0
+        self.direct_pattern = re.compile(r"\b(" + names + r")\s*=(?!=)\s*(?:\(\s*[\w\s\*]+\)\s*)*&?\s*" + self.symbol, re.IGNORECASE)
+        # prefilter of the rescan: the register name, or its address for the memory mapped ones
+        prefilter = sorted(self.sysregs_of_arch) + [format(address, "#x") for address in self.sysreg_addresses]
+        self.name_bytes_pattern = re.compile(("(?:" + ("|".join(prefilter) or "(?!)") + ")").encode(), re.IGNORECASE)
+
+    def scan(self, lines: list, where: str = "") -> list:
+        sites = []
+        gpr_map = {}    # gpr -> symbol last put into it
+        addr_map = {}   # gpr -> special register whose address it holds (armv7m)
+        for i, line in enumerate(lines):
+            m = self.direct_pattern.search(line)
+            if m:
+                reg = m.group(1).upper()
+                value = m.group(2)
+                if not self.gpr_name_pattern.match(value):
+                    sites.append([reg, value, where, i + 1])
+                elif value.lower() in gpr_map:
+                    sites.append([reg, gpr_map[value.lower()], where, i + 1])
+                continue
+            m = self.gpr_assign_pattern.search(line)
+            if m:
+                gpr_map[m.group(1).lower()] = m.group(2)
+                continue
+            if self.arch == "armv7m":
+                m = self.armv7m_ldr_pattern.search(line)
+                if m:
+                    gpr = m.group(1).lower()
+                    if m.group(3) is not None:
+                        gpr_map[gpr] = m.group(3)
+                        addr_map.pop(gpr, None)
+                    else:
+                        reg = self.sysreg_addresses.get(int(m.group(2), 0), None)
+                        if reg is not None:
+                            addr_map[gpr] = reg
+                    continue
+                m = self.armv7m_str_pattern.search(line)
+                if m:
+                    value = m.group(1).lower()
+                    base = m.group(2).lower()
+                    if base in addr_map and value in gpr_map:
+                        sites.append([addr_map[base], gpr_map[value], where, i + 1])
+            elif self.arch == "rh850":
+                m = self.rh850_mov_pattern.search(line)
+                if m:
+                    if not self.gpr_name_pattern.match(m.group(1)):
+                        gpr_map[m.group(2).lower()] = m.group(1)
+                    continue
+                m = self.rh850_ldsr_pattern.search(line)
+                if m:
+                    reg = m.group(2).upper()
+                    value = m.group(1).lower()
+                    if reg in self.sysregs_of_arch and value in gpr_map:
+                        sites.append([reg, gpr_map[value], where, i + 1])
+        return sites
+
+    def scan_tables(self, lines: list) -> tuple:
+        tables = {}
+        aliases = {}
+        table = None    # entries of the table being read
+        for line in lines:
+            m = self.alias_pattern.match(line)
+            if m:
+                aliases[m.group(1).lstrip("_")] = m.group(2).lstrip("_")
+                continue
+            m = self.label_pattern.match(line)
+            if m:
+                table = tables.setdefault(m.group(1).lstrip("_"), [])
+                line = m.group(2)
+            m = self.data_pattern.match(line)
+            if m:
+                if table is not None:
+                    for entry in m.group(1).split(","):
+                        entry = entry.strip()
+                        table.append(entry.lstrip("_") if self.symbol_pattern.match(entry) else "")
+            elif not self.skip_pattern.match(line):
+                table = None
+        return {label: entries for label, entries in tables.items() if len(entries) > 0}, aliases
+
+    def scan_source(self, lines: list, asm: bool, where: str) -> dict:
+        symbols = {"sites": self.scan(lines, where), "tables": {}, "aliases": {}}
+        if asm:
+            symbols["tables"], symbols["aliases"] = self.scan_tables(lines)
+        return symbols
+
+    def build(self, symbols: dict):
+        self.sysregs = {}
+        self.tables = {}
+        self.aliases = {}
+        for src in sorted(symbols):
+            for reg, symbol, where, line in symbols[src]["sites"]:
+                self.sysregs.setdefault(reg, []).append([symbol, src, where, line])
+            self.tables.update(symbols[src]["tables"])
+            self.aliases.update(symbols[src]["aliases"])
+        for entries in self.sysregs.values():
+            entries.sort(key = lambda entry: (entry[1], entry[2], entry[3]))
+
+    def save(self, path: str):
+        data = {"version": self.version, "arch": self.arch, "sysregs": self.sysregs, "tables": self.tables, "aliases": self.aliases}
+        tmp_file = path + ".tmp"
+        with open(tmp_file, 'w', encoding = "UTF-8") as f:
+            json.dump(data, f)
+        os.replace(tmp_file, path)
+
+    # False if there is no index (or one of another version/arch)
+    def load(self, path: str) -> bool:
+        try:
+            with open(path, 'r', encoding = "UTF-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if data.get("version", 0) != self.version or data.get("arch", "") != self.arch:
+            return False
+        self.sysregs = data["sysregs"]
+        self.tables = data["tables"]
+        self.aliases = data["aliases"]
+        return True
+
+    def lookup(self, reg: str) -> str:
+        entries = self.sysregs.get(reg.upper(), [])
+        return entries[0][0] if len(entries) > 0 else ""
+
+    def vector_table(self) -> str:
+        table = self.lookup(self.arch_vector_regs.get(self.arch, "")).lstrip("_")
+        if table in self.tables:
+            return table
+        named = [label for label in sorted(self.tables) if "vector" in label.lower()]
+        return named[0] if len(named) == 1 else ""
+
+    def vector_entries(self) -> list:
+        entries = []
+        for slot, symbol in enumerate(self.tables.get(self.vector_table(), [])):
+            seen = set()
+            while symbol in self.aliases and symbol not in seen:
+                seen.add(symbol)
+                symbol = self.aliases[symbol]
+            if symbol != "":
+                entries.append((slot, symbol))
+        return entries
+
+    # one file of the rescan, None if the register is not assigned in it
+    def rescan_file(self, path: str, reg: str, stop: threading.Event):
+        if stop.is_set():
+            return None
+        try:
+            with open(path, 'rb') as f:
+                if os.fstat(f.fileno()).st_size == 0:
+                    return None
+                with mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ) as mm:
+                    if not self.name_bytes_pattern.search(mm):
+                        return None
+                    text = mm[:].decode("UTF-8", errors = "replace")
+        except OSError as e:
+            print("Error reading " + path + ": " + str(e))
+            return None
+        for site_reg, symbol, where, line in self.scan(text.replace("\\n", "\n").splitlines()):
+            if site_reg == reg:
+                return symbol
+        return None
+
+    def rescan(self, paths: list, reg: str, jobs: int) -> tuple:
+        stop = threading.Event()
+        with concurrent.futures.ThreadPoolExecutor(max_workers = max(1, jobs)) as executor:
+            futures = [executor.submit(self.rescan_file, path, reg, stop) for path in paths]
+            try:
+                for path, future in zip(paths, futures):
+                    symbol = future.result()
+                    if symbol is not None:
+                        return symbol, path
+            finally:
+                stop.set()
+                for future in futures:
+                    future.cancel()
+        return "", ""
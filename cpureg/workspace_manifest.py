@@ -0,0 +1,136 @@
+import os
+import json
+import hashlib
+
+# CpuRegManifest
+# this class keeps track of what went into the workspace on the last generate run,
+# so that the next run only has to redo the sources that actually changed.
+#
+# manifest.json layout:
+# {
+#   "version": 1,
+#   "sources": {
+#     srcpath: {
+#       "hash": sha1 of the source contents,
+#       "flags": whatever was passed to gcc (platform, include paths),
+#       "deps": {header path: sha1 of the header contents},  (headers gcc pulled in)
+#       "index": path of the saved per-source parse result (json)
+#     }
+#   },
+#   "outputs": {workspace file path: sha1 of the contents written last time}
+# }
+#
+# a source is considered dirty if its own hash, its flags, or any of its headers changed.
+# headers are hashed only once per run (many sources share the same headers).
+
+class CpuRegManifest:
+    version = 1
+
+    def __init__(self, manifest_file: str, srcindex_dir: str):
+        self.manifest_file = manifest_file
+        self.srcindex_dir = srcindex_dir
+        self.sources = {}
+        self.outputs = {}
+        self.hash_memo = {}  # path -> sha1 (per generate, cleared by CpuRegParser.parse_functions)
+
+    def load(self):
+        self.sources = {}
+        self.outputs = {}
+        if not os.path.isfile(self.manifest_file):
+            return
+        try:
+            with open(self.manifest_file, 'r', encoding="UTF-8") as f:
+                data = json.load(f)
+            if data.get("version", None) != self.version:
+                return  # old layout, regenerate everything
+            self.sources = data.get("sources", {})
+            self.outputs = data.get("outputs", {})
+        except (OSError, ValueError):
+            print("manifest is broken, regenerating everything")
+            self.sources = {}
+            self.outputs = {}
+
+    def save(self):
+        tmp_file = self.manifest_file + ".tmp"
+        with open(tmp_file, 'w', encoding="UTF-8") as f:
+            json.dump({"version": self.version, "sources": self.sources, "outputs": self.outputs}, f, indent=1, sort_keys=True)
+        os.replace(tmp_file, self.manifest_file)
+
+    def file_hash(self, path: str) -> str:
+        if path in self.hash_memo:
+            return self.hash_memo[path]
+        try:
+            with open(path, 'rb') as f:
+                htemp = hashlib.sha1(f.read()).hexdigest()
+        except OSError:
+            htemp = ""
+        self.hash_memo[path] = htemp
+        return htemp
+
+    def content_hash(self, content: str) -> str:
+        return hashlib.sha1(content.encode("utf-8")).hexdigest()
+
+    # where the parse result of srcpath is saved
+    def srcindex_path(self, srcpath: str) -> str:
+        htemp = hashlib.sha1(srcpath.encode("utf-8")).hexdigest()[:8]
+        return os.path.join(self.srcindex_dir, os.path.basename(srcpath) + "." + htemp + ".json")
+
+    def source_changed(self, srcpath: str, flags: dict) -> bool:
+        entry = self.sources.get(srcpath, None)
+        if entry is None:
+            return True
+        if entry.get("flags", None) != flags:
+            return True
+        if entry.get("hash", None) != self.file_hash(srcpath):
+            return True
+        for dep, dephash in entry.get("deps", {}).items():
+            if self.file_hash(dep) != dephash:
+                return True
+        if not os.path.isfile(entry.get("index", "")):
+            return True
+        return False
+
+    def load_source_index(self, srcpath: str) -> dict:
+        with open(self.sources[srcpath]["index"], 'r', encoding="UTF-8") as f:
+            return json.load(f)
+
+    def update_source(self, srcpath: str, flags: dict, deps: set, index: dict):
+        index_file = self.srcindex_path(srcpath)
+        with open(index_file, 'w', encoding="UTF-8") as f:
+            json.dump(index, f)
+        self.sources[srcpath] = {
+            "hash": self.file_hash(srcpath),
+            "flags": flags,
+            "deps": {dep: self.file_hash(dep) for dep in sorted(deps) if dep != srcpath},
+            "index": index_file
+        }
+
+    # forget about sources that are gone from the tree
+    def prune_sources(self, srcpaths: list):
+        for srcpath in list(self.sources.keys()):
+            if srcpath not in srcpaths:
+                index_file = self.sources[srcpath].get("index", "")
+                if os.path.isfile(index_file):
+                    os.remove(index_file)
+                del self.sources[srcpath]
+
+    # outputs: {file path: contents}
+    # only writes the files whose contents changed since last run,
+    # and removes the files that are not generated anymore.
+    # returns number of files (re)written
+    def write_outputs(self, outputs: dict) -> int:
+        written = 0
+        new_outputs = {}
+        for path, content in outputs.items():
+            chash = self.content_hash(content)
+            new_outputs[path] = chash
+            if self.outputs.get(path, None) == chash and os.path.isfile(path):
+                continue
+            with open(path, 'w') as wf:
+                wf.write(content)
+            written += 1
+        for path in self.outputs.keys():
+            if path not in new_outputs and os.path.isfile(path):
+                os.remove(path)
+        self.outputs = new_outputs
+        return written
@@ -0,0 +1,12 @@
+cmp r0, #0
+ite eq
+moveq r1, #1
+movne r1, #2
+ldr r2, [r3]
+add r4, r2, r2
+itt ne
+addne r5, r5, #1
+strne r5, [r6]
+mul r7, r8, r9
+ldr r10, [r11]
+bx lr
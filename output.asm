@@ -1,14 +1,14 @@
-MOV R10, R11
-MOV R12, R13
 LDR R1, [R2]
-STR R12, [R1]
+SUB R7, R8, R9
 ADD R3, R1, R4
 MUL R5, R3, R6
-SUB R7, R8, R9
+MOV R12, R13
 STR R5, [R7]
+MOV R10, R11
+STR R12, [R1]
 B label1
 
-ADD R2, R10, R11
 LDR R14, [R3]
+ADD R2, R10, R11
 STR R14, [R2]
 MOV R15, R0
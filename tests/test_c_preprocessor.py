@@ -0,0 +1,114 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from cpureg.c_preprocessor import CpuRegPreprocessor
+
+# conformance cases of the builtin preprocessor (CpuRegPreprocessor).
+# every case is a main file (plus headers) and the expected output, compared line by line
+# without the linemarkers, blank lines and with white space collapsed (layout is --check-preprocessor's job).
+# when gcc is installed, gcc -E is the reference too: gcc has to give the expected output as well,
+# so a case can not silently drift away from what gcc does.
+
+GCC = shutil.which("gcc")
+
+
+def normalize(lines) -> list:
+    return [" ".join(line.split()) for line in lines if line.strip() != "" and not line.startswith("#")]
+
+
+class CpuRegPreprocessorTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    # files: {name: text}, the first one is the main file
+    def check(self, files: dict, expected: list):
+        for name, text in files.items():
+            with open(os.path.join(self.tmpdir, name), 'w', encoding = "UTF-8") as f:
+                f.write(text)
+        main = os.path.join(self.tmpdir, next(iter(files)))
+        lines, deps = CpuRegPreprocessor([self.tmpdir]).preprocess(main)
+        self.assertEqual(normalize(lines), expected)
+        if GCC is not None:
+            # -undef: no predefined macros, the builtin preprocessor above has none either
+            proc = subprocess.run([GCC, "-E", "-undef", "-nostdinc", "-I", self.tmpdir, main], stdout = subprocess.PIPE, encoding = "UTF-8")
+            self.assertEqual(proc.returncode, 0)
+            self.assertEqual(normalize(proc.stdout.splitlines()), expected)
+
+    def test_object_like(self):
+        self.check({"a.c": "#define N 4\n#define M (N * 2)\nint x[M];\n"},
+                   ["int x[(4 * 2)];"])
+
+    def test_function_like(self):
+        self.check({"a.c": "#define MAX(a, b) ((a) > (b) ? (a) : (b))\n#define F f\nint y = MAX(1, MAX(2, 3));\nint z = F (1);\nint MAX;\n"},
+                   ["int y = ((1) > (((2) > (3) ? (2) : (3))) ? (1) : (((2) > (3) ? (2) : (3))));", "int z = f (1);", "int MAX;"])
+
+    def test_arguments_with_parens_and_commas(self):
+        self.check({"a.c": "#define FIRST(a, b) a\n#define EMPTY()\nint v = FIRST((1, 2), 3) EMPTY();\n"},
+                   ["int v = (1, 2) ;"])
+
+    def test_variadic(self):
+        self.check({"a.c": "#define LOG(fmt, ...) printf(fmt, __VA_ARGS__)\n#define LOG2(fmt, ...) printf(fmt, ## __VA_ARGS__)\n"
+                           "LOG(\"%d %d\", 1, 2);\nLOG2(\"x\");\nLOG2(\"%d\", 3);\n"},
+                   ["printf(\"%d %d\", 1, 2);", "printf(\"x\");", "printf(\"%d\", 3);"])
+
+    def test_stringify(self):
+        self.check({"a.c": "#define STR(x) #x\n#define XSTR(x) STR(x)\n#define V 12\nchar *a = STR(V);\nchar *b = XSTR(V);\nchar *c = STR(  a  +   \"q\\n\" );\n"},
+                   ["char *a = \"V\";", "char *b = \"12\";", "char *c = \"a + \\\"q\\\\n\\\"\";"])
+
+    def test_paste(self):
+        self.check({"a.c": "#define CAT(a, b) a ## b\n#define XCAT(a, b) CAT(a, b)\n#define ONE 1\nint CAT(var, 1);\nint CAT(x, ONE);\nint XCAT(y, ONE);\nint z = CAT(0x, 1f);\n"},
+                   ["int var1;", "int xONE;", "int y1;", "int z = 0x1f;"])
+
+    def test_recursion_is_blocked(self):
+        self.check({"a.c": "#define foo foo + 1\n#define f(x) g(x)\n#define g(x) f(x) + x\nint a = foo;\nint b = f(2);\n"},
+                   ["int a = foo + 1;", "int b = f(2) + 2;"])
+
+    def test_if_expressions(self):
+        self.check({"a.c": "#define A 3\n#define B\n"
+                           "#if (A << 2) == 12 && -1 < 0 && 7 / 2 == 3 && 7 % 4 == 3\nint arith;\n#endif\n"
+                           "#if defined(A) && defined B && !defined(C)\nint defd;\n#endif\n"
+                           "#if A > 2 ? 1 : 0\nint cond;\n#endif\n"
+                           "#if UNDEFINED_NAME == 0 && (0x10 | 1) == 17 && 'a' == 97\nint undef;\n#endif\n"
+                           "#if A == 1\nint one;\n#elif A == 3\nint three;\n#else\nint other;\n#endif\n"
+                           "#if 0\n#if garbage (((\n#endif\nint dead;\n#endif\n"},
+                   ["int arith;", "int defd;", "int cond;", "int undef;", "int three;"])
+
+    def test_ifdef_and_undef(self):
+        self.check({"a.c": "#define X 1\n#ifdef X\nint a = X;\n#endif\n#undef X\n#ifndef X\nint b = X;\n#endif\n#define X 2\nint c = X;\n"},
+                   ["int a = 1;", "int b = X;", "int c = 2;"])
+
+    def test_include_guard(self):
+        self.check({"a.c": "#include \"g.h\"\n#include \"g.h\"\nint main_part;\n",
+                    "g.h": "#ifndef G_H\n#define G_H\nint guarded;\n#endif\n"},
+                   ["int guarded;", "int main_part;"])
+
+    def test_include_guard_undefined_again(self):
+        self.check({"a.c": "#include \"g.h\"\n#undef G_H\n#include \"g.h\"\n",
+                    "g.h": "#ifndef G_H\n#define G_H\nint guarded;\n#endif\n"},
+                   ["int guarded;", "int guarded;"])
+
+    def test_pragma_once(self):
+        self.check({"a.c": "#include \"o.h\"\n#include \"o.h\"\n",
+                    "o.h": "#pragma once\nint once;\n"},
+                   ["int once;"])
+
+    def test_macro_include(self):
+        self.check({"a.c": "#define HDR \"m.h\"\n#include HDR\nint x = M;\n",
+                    "m.h": "#define M 5\n"},
+                   ["int x = 5;"])
+
+    def test_comments_and_splices(self):
+        self.check({"a.c": "#define LONG(a) \\\n    ((a) + 1) /* c */\nint x = LONG(2); // tail\nint /* in */ y;\n"},
+                   ["int x = ((2) + 1);", "int y;"])
+
+
+if __name__ == '__main__':
+    unittest.main()